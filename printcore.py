@@ -17,7 +17,7 @@
 
 from serial import Serial, SerialException
 from select import error as SelectError
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from Queue import Queue, Empty as QueueEmpty
 import time, getopt, sys
 import platform, os, traceback
@@ -25,8 +25,11 @@ import socket
 import re
 from functools import wraps
 from collections import deque
+from array import array
+from operator import xor
 from printrun.GCodeAnalyzer import GCodeAnalyzer
 from printrun import gcoder
+from printrun.gcoder import encode_line, LINE_SEND, LINE_HOST_COMMAND
 
 def locked(f):
     @wraps(f)
@@ -44,12 +47,56 @@ def control_ttyhup(port, disable_hup):
         else:
             os.system("stty -F %s hup" % port)
 
+host_regexp = re.compile("^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$|^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$")
+
+def parse_tcp_address(port):
+    """Returns (hostname, port) if port is a host:port address, None if it is
+    a serial device"""
+    bits = port.split(":")
+    if len(bits) != 2:
+        return None
+    try:
+        tcp_port = int(bits[1])
+    except ValueError:
+        return None
+    if host_regexp.match(bits[0]) and 1 <= tcp_port <= 65535:
+        return (bits[0], tcp_port)
+    return None
+
 def enable_hup(port):
     control_ttyhup(port, False)
 
 def disable_hup(port):
     control_ttyhup(port, True)
 
+class SentLines(object):
+    """Ring buffer of the last size checksummed lines, indexed by line number.
+    Looking up a line which was overwritten raises a KeyError.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lines = [None] * size
+        self.linenos = array('l', [-1] * size)
+
+    def __setitem__(self, lineno, line):
+        slot = lineno % self.size
+        self.lines[slot] = line
+        self.linenos[slot] = lineno
+
+    def __getitem__(self, lineno):
+        slot = lineno % self.size
+        if lineno < 0 or self.linenos[slot] != lineno:
+            raise KeyError(lineno)
+        return self.lines[slot]
+
+    def __contains__(self, lineno):
+        return lineno >= 0 and self.linenos[lineno % self.size] == lineno
+
+    def clear(self):
+        self.lines = [None] * self.size
+        self.linenos = array('l', [-1] * self.size)
+
 class printcore():
     def __init__(self, port = None, baud = None):
         """Initializes a printcore instance. Pass the port and baud rate to connect immediately
@@ -58,7 +105,13 @@ class printcore():
         self.port = None
         self.analyzer = GCodeAnalyzer()
         self.printer = None #Serial instance connected to the printer, None when disconnected
+        self.printer_tcp = None #socket behind self.printer for TCP connections
         self.clear = 0 #clear to send, enabled after responses
+        self.clear_cv = Condition() #notified when clear is set or printing stops
+        self.window_lines = 0 #streaming mode: max lines awaiting an ok, 0 to disable
+        self.window_bytes = 0 #streaming mode: firmware RX buffer size, 0 to disable
+        self.inflight = deque() #(lineno, length) of lines awaiting an ok in streaming mode
+        self.inflight_bytes = 0
         self.online = False #The printer has responded to the initial command and is active
         self.printing = False #is a print currently running, true if printing, false if paused
         self.mainqueue = None
@@ -66,11 +119,27 @@ class printcore():
         self.queueindex = 0
         self.lineno = 0
         self.resendfrom = -1
+        self.resend_request = -1 #line number of the last resend request
+        self.resend_mark = 0 #stream position where it started being sent again
+        self.stream_lines = 0 #lines sent since the window was reset
+        self.stream_acks = 0 #oks received since then, the nth answers the nth line
         self.paused = False
-        self.sentlines = {}
+        self.history_size = 1024 #minimum number of lines kept for resends
+        self.sentlines = SentLines(self.history_size)
+        self.linebuffer = None #GCodeSendLines of the print queue
+        self.edits_seen = 0 #edits of the print queue followed so far
+        self.held = None #line kept back by a pause while waiting for room in the window
+        self.precompute_lines = True #encode the print queue when starting a print
+        self.precompute_async = True #encode it on a background thread
         self.log = deque(maxlen = 10000)
-        self.sent = []
+        self.sent = deque(maxlen = 1000) #last commands sent, None to disable
         self.writefailures = 0
+        self.outbuf = [] #lines waiting to be written in a single write
+        self.outbuf_bytes = 0
+        self.write_budget = 512 #max bytes coalesced into a single write
+        self.write_lock = Lock()
+        self.write_calls = 0 #number of write/flush pairs, for statistics
+        self.written_lines = 0
         self.tempcb = None #impl (wholeline)
         self.recvcb = None #impl (wholeline)
         self.sendcb = None #impl (wholeline)
@@ -105,13 +174,17 @@ class printcore():
                 self.read_thread = None
             if self.print_thread:
                 self.printing = False
+                self._wake_print_thread()
                 self.print_thread.join()
             self._stop_sender()
             try:
                 self.printer.close()
+                if self.printer_tcp:
+                    self.printer_tcp.close()
             except socket.error:
                 pass
         self.printer = None
+        self.printer_tcp = None
         self.online = False
         self.printing = False
 
@@ -127,20 +200,11 @@ class printcore():
             self.baud = baud
         if self.port is not None and self.baud is not None:
             # Connect to socket if "port" is an IP, device if not
-            host_regexp = re.compile("^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$|^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$")
-            is_serial = True
-            if ":" in port:
-                bits = port.split(":")
-                if len(bits) == 2:
-                    hostname = bits[0]
-                    try:
-                        port = int(bits[1])
-                        if host_regexp.match(hostname) and 1 <= port <= 65535:
-                            is_serial = False
-                    except:
-                        pass
+            address = parse_tcp_address(self.port)
+            is_serial = address is None
             self.writefailures = 0
             if not is_serial:
+                hostname, port = address
                 self.printer_tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.timeout = 0.25
                 self.printer_tcp.settimeout(1.0)
@@ -250,8 +314,10 @@ class printcore():
                 break
             if line.startswith('DEBUG_'):
                 continue
-            if line.startswith(tuple(self.greetings)) or line.startswith('ok'):
-                self.clear = True
+            if line.startswith(tuple(self.greetings)):
+                self._reset_window()
+            elif line.startswith('ok'):
+                self._ack()
             if line.startswith('ok') and "T:" in line and self.tempcb:
                 #callback for temp, status, whatever
                 try: self.tempcb(line)
@@ -266,16 +332,125 @@ class printcore():
             if line.lower().startswith("resend") or line.startswith("rs"):
                 line = line.replace("N:", " ").replace("N", " ").replace(":", " ")
                 linewords = line.split()
+                toresend = None
                 while len(linewords) != 0:
                     try:
                         toresend = int(linewords.pop(0))
-                        self.resendfrom = toresend
-                        #print str(toresend)
                         break
                     except:
                         pass
-                self.clear = True
-        self.clear = True
+                if toresend is not None and toresend == self.resend_request \
+                   and (self.resend_mark is None or self.stream_acks < self.resend_mark):
+                    # the firmware also rejects the lines which were sent
+                    # after the faulty one, before going back to it
+                    pass
+                elif toresend is not None:
+                    self.resend_request = toresend
+                    self.resend_mark = None
+                    self.resendfrom = toresend
+                    self._resync_window(toresend)
+                    self._set_clear(True)
+                else:
+                    self._set_clear(True)
+        self._reset_window()
+
+    def _set_clear(self, clear):
+        """Sets the clear to send flag and wakes up threads waiting on it
+        """
+        with self.clear_cv:
+            self.clear = clear
+            self.clear_cv.notify_all()
+
+    def _streaming(self):
+        return self.window_lines > 0 or self.window_bytes > 0
+
+    def _window_has_room(self, length):
+        if not self.inflight:
+            return True
+        if self.window_lines and len(self.inflight) >= self.window_lines:
+            return False
+        if self.window_bytes and self.inflight_bytes + length > self.window_bytes:
+            return False
+        return True
+
+    def _reserve(self, lineno, length, wait):
+        """Accounts for a line about to be written in streaming mode, waiting
+        for enough acknowledgements to fit it in the window if wait is set.
+        Returns False, without accounting for the line, if printing stops or
+        the printer goes offline meanwhile: the caller holds it until the
+        print is resumed.
+        """
+        with self.clear_cv:
+            must_wait = wait and not self._window_has_room(length)
+        if must_wait:
+            # the window is full: push the lines coalesced so far
+            self._flush_writes()
+        with self.clear_cv:
+            while wait and not self._window_has_room(length):
+                if not (self.printing and self.online):
+                    return False
+                self.clear_cv.wait()
+            self.inflight.append((lineno, length))
+            self.inflight_bytes += length
+        return True
+
+    def _ack(self):
+        """Handles an ok: releases the oldest line of the window and sets clear
+        """
+        with self.clear_cv:
+            self.stream_acks += 1
+            if self.inflight:
+                self.inflight_bytes -= self.inflight.popleft()[1]
+            self.clear = True
+            self.clear_cv.notify_all()
+
+    def _resync_window(self, lineno):
+        """The firmware answers each line it receives with an ok, even the
+        ones it rejects after requesting a resend of lineno. Those still to
+        come are for the rejected line and the ones sent after it, forget
+        about older lines whose ok got lost along with them.
+        """
+        with self.clear_cv:
+            items = list(self.inflight)
+            start = 0
+            for i, item in enumerate(items):
+                if item[0] is not None and item[0] <= lineno:
+                    start = i
+            kept = deque(items[start:])
+            self.inflight = kept
+            self.inflight_bytes = sum(item[1] for item in kept)
+            self.clear_cv.notify_all()
+
+    def _reset_window(self):
+        with self.clear_cv:
+            self.inflight.clear()
+            self.inflight_bytes = 0
+            self.stream_lines = 0
+            self.stream_acks = 0
+            self.clear = True
+            self.clear_cv.notify_all()
+
+    def _wake_print_thread(self):
+        with self.clear_cv:
+            self.clear_cv.notify_all()
+
+    def _wait_drained(self):
+        """In streaming mode, blocks until the lines in flight are all
+        acknowledged, the printer asks for one of them again or printing
+        stopped. Returns True unless the print is over.
+        """
+        self._flush_writes()
+        with self.clear_cv:
+            while self.printer and self.printing and self.inflight and self.resendfrom == -1:
+                self.clear_cv.wait()
+            return bool(self.inflight) or self.resendfrom != -1 or not self.printing
+
+    def _wait_clear(self):
+        """Blocks until the printer acknowledged the last line or printing stopped
+        """
+        with self.clear_cv:
+            while self.printer and self.printing and not self.clear:
+                self.clear_cv.wait()
 
     def _start_sender(self):
         self.stop_send_thread = False
@@ -294,14 +469,13 @@ class printcore():
                 command = self.priqueue.get(True, 0.1)
             except QueueEmpty:
                 continue
-            while self.printer and self.printing and not self.clear:
-                time.sleep(0.001)
-            self._send(command)
-            while self.printer and self.printing and not self.clear:
-                time.sleep(0.001)
+            self._wait_clear()
+            # coalesce bursts of commands such as macros into a single write
+            self._send(command, flush = self.priqueue.empty())
+            self._wait_clear()
 
     def _checksum(self, command):
-        return reduce(lambda x, y:x ^ y, map(ord, command))
+        return reduce(xor, map(ord, command))
 
     def startprint(self, gcode, startindex = 0):
         """Start a print, gcode is an array of gcode commands.
@@ -313,17 +487,64 @@ class printcore():
             return False
         self.printing = True
         self.mainqueue = gcode
+        self.sentlines = SentLines(self._history_size())
         self.lineno = 0
         self.queueindex = startindex
+        self.edits_seen = len(gcode.edits)
+        self._precompute(gcode)
+        self.held = None
         self.resendfrom = -1
+        self.resend_request = -1
+        self._reset_window()
+        # clear the flag before sending so that a fast "ok" can't be lost
+        self.clear = False
         self._send("M110", -1, True)
-        if not gcode.lines:
+        if not len(gcode):
             return True
-        self.clear = False
         self.print_thread = Thread(target = self._print)
         self.print_thread.start()
         return True
 
+    def _history_size(self):
+        """The firmware can only ask to resend lines it did not acknowledge,
+        so keep at least twice what the streaming window lets through
+        """
+        size = self.history_size
+        if self.window_lines:
+            size = max(size, 2 * self.window_lines)
+        if self.window_bytes:
+            size = max(size, self.window_bytes)
+        return size
+
+    def _precompute(self, gcode):
+        if self.linebuffer:
+            self.linebuffer.stop = True
+        self.linebuffer = None
+        if not self.precompute_lines or not gcode or not gcode.lines:
+            return
+        # kept by gcode, so printing it again doesn't encode it again
+        self.linebuffer = gcode.send_lines()
+        if self.linebuffer.ready == self.linebuffer.end:
+            return
+        if self.precompute_async:
+            thread = Thread(target = self.linebuffer.compute)
+            thread.daemon = True
+            thread.start()
+        else:
+            self.linebuffer.compute()
+
+    def _follow_edits(self):
+        """Moves queueindex along with the lines inserted in or removed from
+        the print queue before it since the last call, linebuffer following
+        them by itself. Called with the edit lock of the queue held."""
+        edits = self.mainqueue.edits
+        if len(edits) == self.edits_seen:
+            return
+        for index, delta in edits[self.edits_seen:]:
+            if index < self.queueindex:
+                self.queueindex += delta
+        self.edits_seen = len(edits)
+
     # run a simple script if it exists, no multithreading
     def runSmallScript(self, filename):
         if filename == None: return
@@ -346,6 +567,7 @@ class printcore():
         if not self.printing: return False
         self.paused = True
         self.printing = False
+        self._wake_print_thread()
 
         # try joining the print thread: enclose it in try/except because we might be calling it from the thread itself
         try:
@@ -420,9 +642,11 @@ class printcore():
                     traceback.print_exc(file = sys.stdout)
             while self.printing and self.printer and self.online:
                 self._sendnext()
-            self.sentlines = {}
+            self._flush_writes()
+            self.sentlines.clear()
             self.log.clear()
-            self.sent = []
+            if self.sent is not None:
+                self.sent.clear()
             if self.endcb:
                 #callback for printing done
                 try: self.endcb()
@@ -448,81 +672,162 @@ class printcore():
     def _sendnext(self):
         if not self.printer:
             return
-        while self.printer and self.printing and not self.clear:
-            time.sleep(0.001)
-        self.clear = False
+        # in streaming mode _send waits for room in the window instead
+        if not self._streaming():
+            self._wait_clear()
+            self.clear = False
         if not (self.printing and self.printer and self.online):
             self.clear = True
             return
         if self.resendfrom < self.lineno and self.resendfrom > -1:
-            self._send(self.sentlines[self.resendfrom], self.resendfrom, False)
+            if self.resendfrom not in self.sentlines:
+                error = _("Printer requested resend of line %d, which is out of the %d lines resend history. Pausing print.") % (self.resendfrom, self.sentlines.size)
+                print error
+                if self.errorcb:
+                    try: self.errorcb(error)
+                    except: pass
+                self.resendfrom = -1
+                self.pause()
+                return
+            if self.resend_mark is None:
+                self.resend_mark = self.stream_lines
+            if self.held is not None and self.held[1] is not None:
+                # the lines up to the held one are all sent again
+                self.held = None
+            self._send(self.sentlines[self.resendfrom], self.resendfrom, False,
+                       flush = not self._streaming())
             self.resendfrom += 1
             return
         self.resendfrom = -1
         if not self.priqueue.empty():
-            self._send(self.priqueue.get_nowait())
+            self._send(self.priqueue.get_nowait(), flush = not self._streaming())
             self.priqueue.task_done()
             return
-        if self.printing and self.queueindex < len(self.mainqueue):
-            (layer, line) = self.mainqueue.idxs(self.queueindex)
-            gline = self.mainqueue.all_layers[layer][line]
-            if self.layerchangecb and self.queueindex > 0:
-                (prev_layer, prev_line) = self.mainqueue.idxs(self.queueindex - 1)
-                if prev_layer != layer:
-                    try: self.layerchangecb(layer)
-                    except: traceback.print_exc()
+        if self.held is not None:
+            # after the commands restoring the position on resume
+            command, lineno, gline = self.held
+            self.held = None
+            self._send(command, lineno, gline = gline, flush = not self._streaming())
+            return
+        if self.outbuf and not self.mainqueue.available(self.queueindex + 1):
+            # a stream would wait for the next line, or the one after it
+            # read ahead for preprintsendcb, to be parsed: write the
+            # coalesced lines first
+            self._flush_writes()
+        # everything read by index is read at once, as other threads can
+        # insert or remove lines meanwhile
+        with self.mainqueue.edit_lock:
+            self._follow_edits()
+            if self.linebuffer:
+                # step over the comment lines at once
+                self.queueindex = self.linebuffer.next_index(self.queueindex)
+            queued = self.mainqueue.getline(self.queueindex) if self.printing else None
+            if queued is not None:
+                prev_queued = None
+                if self.layerchangecb and self.queueindex > 0:
+                    prev_queued = self.mainqueue.getline(self.queueindex - 1)
+                next_queued = None
+                if self.preprintsendcb:
+                    next_index = self.queueindex + 1
+                    if self.linebuffer:
+                        next_index = self.linebuffer.next_index(next_index)
+                    next_queued = self.mainqueue.getline(next_index)
+                encoded = self.linebuffer.get(self.queueindex) if self.linebuffer else None
+                # taken: a line inserted in its place from now on is ahead
+                self.queueindex += 1
+        if queued is not None:
+            (layer, gline) = queued
+            queued_gline = gline
+            if prev_queued is not None and prev_queued[0] != layer:
+                try: self.layerchangecb(layer)
+                except: traceback.print_exc()
             if self.preprintsendcb:
-                if self.queueindex + 1 < len(self.mainqueue):
-                    (next_layer, next_line) = self.mainqueue.idxs(self.queueindex + 1)
-                    next_gline = self.mainqueue.all_layers[next_layer][next_line]
-                else:
-                    next_gline = None
+                next_gline = next_queued[1] if next_queued is not None else None
                 gline = self.preprintsendcb(gline, next_gline)
             if gline == None:
-                self.queueindex += 1
                 self.clear = True
                 return
-            tline = gline.raw
-            if tline.lstrip().startswith(";@"): # check for host command
-                self.processHostCommand(tline)
-                self.queueindex += 1
+            if gline is not queued_gline:
+                encoded = None
+            if encoded is None:
+                encoded = encode_line(gline.raw)
+            kind, tline, checksum = encoded
+            if kind == LINE_HOST_COMMAND:
+                self.processHostCommand(gline.raw)
                 self.clear = True
                 return
 
-            tline = tline.split(";")[0]
-            if len(tline) > 0:
-                self._send(tline, self.lineno, True)
+            if kind == LINE_SEND:
+                self._send(tline, self.lineno, True, checksum, gline,
+                           flush = not self._streaming())
                 self.lineno += 1
                 if self.printsendcb:
                     try: self.printsendcb(gline)
                     except: traceback.print_exc()
             else:
                 self.clear = True
-            self.queueindex += 1
         else:
+            # the lines of the last window can still have to be sent again
+            if self._streaming() and self._wait_drained():
+                return
             self.printing = False
             self.clear = True
             if not self.paused:
                 self.queueindex = 0
                 self.lineno = 0
+                self.linebuffer = None
                 self._send("M110", -1, True)
 
-    def _send(self, command, lineno = 0, calcchecksum = False):
+    def _send(self, command, lineno = None, calcchecksum = False, checksum = None, gline = None, flush = True):
+        """Sends command, prefixed by lineno and followed by its checksum if
+        calcchecksum is set. lineno is None for commands sent out of the
+        numbered stream. checksum can give the precomputed XOR of command,
+        and gline the already parsed line to feed the analyzer with.
+        Unless flush is set, the line may be kept in a buffer and written
+        later along with the next ones, up to write_budget bytes.
+        """
         if calcchecksum:
-            prefix = "N" + str(lineno) + " " + command
-            command = prefix + "*" + str(self._checksum(prefix))
+            prefix = "N%d " % lineno
+            if checksum is None:
+                checksum = self._checksum(command)
+            command = "%s%s*%d" % (prefix, command, checksum ^ self._checksum(prefix))
             if "M110" not in command:
                 self.sentlines[lineno] = command
         if self.printer:
-            self.sent.append(command)
-            self.analyzer.Analyze(command) # run the command through the analyzer
+            if self._streaming() and not self._reserve(lineno, len(command) + 1, self.printing):
+                # printing stopped meanwhile: send it on resume
+                self.held = (command, lineno, gline)
+                return
+            if self.sent is not None:
+                self.sent.append(command)
+            # run the command through the analyzer
+            if gline is not None and gline.command is not None:
+                self.analyzer.AnalyzeLine(gline)
+            else:
+                self.analyzer.Analyze(command)
             if self.loud:
                 print "SENT: ", command
             if self.sendcb:
                 try: self.sendcb(command)
                 except: pass
+            with self.write_lock:
+                self.outbuf.append(str(command + "\n"))
+                self.outbuf_bytes += len(command) + 1
+                self.stream_lines += 1
+            if flush or self.outbuf_bytes >= self.write_budget:
+                self._flush_writes()
+
+    def _flush_writes(self):
+        with self.write_lock:
+            if not self.outbuf or not self.printer:
+                return
+            data = "".join(self.outbuf)
+            self.written_lines += len(self.outbuf)
+            self.outbuf = []
+            self.outbuf_bytes = 0
+            self.write_calls += 1
             try:
-                self.printer.write(str(command + "\n"))
+                self.printer.write(data)
                 self.printer.flush()
                 self.writefailures = 0
             except socket.error as e:
@@ -567,8 +872,7 @@ if __name__ == '__main__':
     p = printcore(port, baud)
     p.loud = loud
     time.sleep(2)
-    gcode = [i.strip() for i in open(filename)]
-    gcode = gcoder.GCode(gcode)
+    gcode = gcoder.GCodeStream(open(filename))
     p.startprint(gcode)
 
     try:
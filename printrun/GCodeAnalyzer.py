@@ -69,9 +69,12 @@ class GCodeAnalyzer():
 
     def Analyze(self, gcode):
         gline = gcoder.Line(gcode)
-        split_raw = gcoder.split(gline)
-        if gline.command.startswith(";@"): return # code is a host command
-        gcoder.parse_coordinates(gline, split_raw, self.imperial)
+        if gcode.lstrip().startswith(";@"): return # code is a host command
+        gcoder.parse_line(gline, self.imperial)
+        self.AnalyzeLine(gline)
+
+    def AnalyzeLine(self, gline):
+        """Updates the state from a line already parsed by gcoder"""
         code_g = int(gline.command[1:]) if gline.command.startswith("G") else None
         code_m = int(gline.command[1:]) if gline.command.startswith("M") else None
 
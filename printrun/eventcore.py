@@ -0,0 +1,671 @@
+# This file is part of the Printrun suite.
+#
+# Printrun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Printrun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
+
+# Single threaded alternative to printcore: every eventcore instance
+# registers its serial port or TCP socket on a shared EventLoop, so that a
+# single thread can drive any number of printers. The API and callbacks
+# mirror the ones of printcore, but all calls have to be made from the loop
+# thread (use EventLoop.call_soon_threadsafe from other threads).
+#
+# Serial ports are driven through their file descriptor, so this only
+# works on POSIX systems.
+
+import os, sys, time, traceback
+import errno, fcntl, select, socket
+import heapq, itertools
+from threading import Lock
+from collections import deque
+
+from serial import Serial, SerialException
+from printcore import parse_tcp_address, disable_hup, SentLines
+from printrun.gcoder import encode_line, LINE_SEND, LINE_HOST_COMMAND
+from printrun.GCodeAnalyzer import GCodeAnalyzer
+
+class EventLoop(object):
+    """Minimal select based loop: file descriptor callbacks and timers"""
+
+    def __init__(self):
+        self.readers = {}
+        self.writers = {}
+        self.timers = []
+        self.counter = itertools.count()
+        self.callbacks = deque()
+        self.lock = Lock()
+        self.running = False
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.add_reader(self.wakeup_r, self._drain_wakeup)
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd, None)
+
+    def add_writer(self, fd, callback):
+        self.writers[fd] = callback
+
+    def remove_writer(self, fd):
+        self.writers.pop(fd, None)
+
+    def call_later(self, delay, callback):
+        """Schedules callback in delay seconds, returns a handle for cancel"""
+        timer = [time.time() + delay, self.counter.next(), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def call_soon_threadsafe(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+        try:
+            os.write(self.wakeup_w, "x")
+        except OSError:
+            pass # pipe is full, the loop will wake up anyway
+
+    def _drain_wakeup(self):
+        try:
+            os.read(self.wakeup_r, 4096)
+        except OSError:
+            pass
+
+    def run_once(self, timeout = None):
+        """Waits for events for at most timeout seconds and handles them"""
+        if self.callbacks:
+            timeout = 0
+        elif self.timers:
+            next_timer = max(0, self.timers[0][0] - time.time())
+            timeout = next_timer if timeout is None else min(timeout, next_timer)
+        try:
+            r, w, x = select.select(self.readers.keys(), self.writers.keys(), [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd in r:
+            callback = self.readers.get(fd)
+            if callback: callback()
+        for fd in w:
+            callback = self.writers.get(fd)
+            if callback: callback()
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            callback = heapq.heappop(self.timers)[2]
+            if callback: callback()
+        with self.lock:
+            callbacks = list(self.callbacks)
+            self.callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def run_forever(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def run_until(self, condition, timeout = None):
+        """Runs the loop until condition() is true, returns its value"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while not condition():
+            if deadline is None:
+                self.run_once()
+            elif time.time() < deadline:
+                self.run_once(deadline - time.time())
+            else:
+                break
+        return condition()
+
+    def stop(self):
+        def do_stop():
+            self.running = False
+        self.call_soon_threadsafe(do_stop)
+
+_loop = None
+
+def get_loop():
+    """Returns the default EventLoop shared by eventcore instances"""
+    global _loop
+    if _loop is None:
+        _loop = EventLoop()
+    return _loop
+
+class eventcore(object):
+    def __init__(self, port = None, baud = None, loop = None):
+        """Initializes an eventcore instance on loop (the default one if None).
+        Pass the port and baud rate to connect immediately
+        """
+        self.loop = loop or get_loop()
+        self.baud = None
+        self.port = None
+        self.analyzer = GCodeAnalyzer()
+        self.printer = None #Serial or socket connected to the printer, None when disconnected
+        self.fd = None
+        self.clear = True #clear to send, enabled after responses
+        self.window_lines = 0 #streaming mode: max lines awaiting an ok, 0 to disable
+        self.window_bytes = 0 #streaming mode: firmware RX buffer size, 0 to disable
+        self.inflight = deque() #(lineno, length) of lines awaiting an ok in streaming mode
+        self.inflight_bytes = 0
+        self.online = False #The printer has responded to the initial command and is active
+        self.printing = False #is a print currently running, true if printing, false if paused
+        self.paused = False
+        self.mainqueue = None
+        self.linebuffer = None #GCodeSendLines of the print queue
+        self.edits_seen = 0 #edits of the print queue followed so far
+        self.priqueue = deque()
+        self.pending = None #numbered line waiting for room in the streaming window
+        self.held = None #pending line kept back by a pause
+        self.queueindex = 0
+        self.lineno = 0
+        self.resendfrom = -1
+        self.resend_request = -1 #line number of the last resend request
+        self.resend_mark = 0 #stream position where it started being sent again
+        self.stream_lines = 0 #lines sent since the window was reset
+        self.stream_acks = 0 #oks received since then, the nth answers the nth line
+        self.history_size = 1024 #minimum number of lines kept for resends
+        self.sentlines = SentLines(self.history_size)
+        self.log = deque(maxlen = 10000)
+        self.sent = deque(maxlen = 1000) #last commands sent, None to disable
+        self.inbuf = ""
+        self.outbuf = ""
+        self.writefailures = 0
+        self.write_calls = 0 #number of writes, for statistics
+        self.written_lines = 0
+        self.online_timer = None
+        self.tempcb = None #impl (wholeline)
+        self.recvcb = None #impl (wholeline)
+        self.sendcb = None #impl (wholeline)
+        self.preprintsendcb = None #impl (wholeline)
+        self.printsendcb = None #impl (wholeline)
+        self.layerchangecb = None #impl (wholeline)
+        self.errorcb = None #impl (wholeline)
+        self.startcb = None #impl ()
+        self.endcb = None #impl ()
+        self.onlinecb = None #impl ()
+        self.loud = False #emit sent and received lines to terminal
+        self.greetings = ['start', 'Grbl ']
+        self.xy_feedrate = None
+        self.z_feedrate = None
+        if port is not None and baud is not None:
+            self.connect(port, baud)
+
+    def connect(self, port = None, baud = None):
+        """Set port and baudrate if given, then connect to printer
+        """
+        if self.printer:
+            self.disconnect()
+        if port is not None:
+            self.port = port
+        if baud is not None:
+            self.baud = baud
+        if self.port is None or self.baud is None:
+            return
+        self.writefailures = 0
+        address = parse_tcp_address(self.port)
+        try:
+            if address:
+                self.printer = socket.create_connection(address, 1.0)
+                self.printer.setblocking(False)
+                self.fd = self.printer.fileno()
+            else:
+                disable_hup(self.port)
+                self.printer = Serial(port = self.port, baudrate = self.baud, timeout = 0)
+                self.fd = self.printer.fileno()
+                flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+                fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        except (socket.error, SerialException) as e:
+            print _("Could not connect to %s:") % self.port, e
+            self.printer = None
+            self.fd = None
+            return
+        self.inbuf = ""
+        self.outbuf = ""
+        self.loop.add_reader(self.fd, self._on_readable)
+        self._probe_online()
+
+    def disconnect(self):
+        """Disconnects from printer and pauses the print
+        """
+        if self.printer:
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+            try:
+                self.printer.close()
+            except (socket.error, SerialException, OSError):
+                pass
+        if self.online_timer:
+            self.loop.cancel(self.online_timer)
+            self.online_timer = None
+        self.printer = None
+        self.fd = None
+        self.online = False
+        self.printing = False
+
+    def reset(self):
+        """Reset the printer
+        """
+        if self.printer and isinstance(self.printer, Serial):
+            self.printer.setDTR(1)
+            self.loop.call_later(0.2, lambda: self.printer and self.printer.setDTR(0))
+
+    def _probe_online(self):
+        self.online_timer = None
+        if self.online or not self.printer:
+            return
+        self._write_command("M105")
+        self._flush()
+        self.online_timer = self.loop.call_later(1.25, self._probe_online)
+
+    def _on_readable(self):
+        try:
+            if self.fd is not None and not isinstance(self.printer, socket.socket):
+                data = os.read(self.fd, 4096)
+            else:
+                data = self.printer.recv(4096)
+        except (OSError, socket.error) as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            print "Can't read from printer (disconnected?) ({0}): {1}".format(e.args[0], e)
+            self.disconnect()
+            return
+        if not data:
+            print "Can't read from printer (disconnected?): read EOF"
+            self.disconnect()
+            return
+        lines = (self.inbuf + data).split("\n")
+        self.inbuf = lines.pop()
+        for line in lines:
+            self._process_line(line + "\n")
+            if not self.printer:
+                return
+        self._pump()
+
+    def _process_line(self, line):
+        """Acts on a message from the firmware, as printcore._listen does
+        """
+        if len(line) > 1:
+            self.log.append(line)
+            if self.recvcb:
+                try: self.recvcb(line)
+                except: pass
+            if self.loud: print "RECV: ", line.rstrip()
+        if line.startswith('DEBUG_'):
+            return
+        if not self.online:
+            if line.startswith(tuple(self.greetings)) or line.startswith('ok'):
+                self.online = True
+                if self.onlinecb:
+                    try: self.onlinecb()
+                    except: pass
+        if line.startswith(tuple(self.greetings)):
+            self._reset_window()
+        elif line.startswith('ok'):
+            self.stream_acks += 1
+            if self.inflight:
+                self.inflight_bytes -= self.inflight.popleft()[1]
+            self.clear = True
+        if line.startswith('ok') and "T:" in line and self.tempcb:
+            #callback for temp, status, whatever
+            try: self.tempcb(line)
+            except: pass
+        elif line.startswith('Error'):
+            if self.errorcb:
+                #callback for errors
+                try: self.errorcb(line)
+                except: pass
+        if line.lower().startswith("resend") or line.startswith("rs"):
+            line = line.replace("N:", " ").replace("N", " ").replace(":", " ")
+            toresend = None
+            for word in line.split():
+                try:
+                    toresend = int(word)
+                    break
+                except ValueError:
+                    pass
+            if toresend is not None and toresend == self.resend_request \
+               and (self.resend_mark is None or self.stream_acks < self.resend_mark):
+                # the firmware also rejects the lines which were sent after
+                # the faulty one, before going back to it
+                pass
+            elif toresend is not None:
+                self.resend_request = toresend
+                self.resend_mark = None
+                self.resendfrom = toresend
+                # oks are still to come for the rejected line and the ones
+                # sent after it, forget about older lines
+                items = list(self.inflight)
+                start = 0
+                for i, item in enumerate(items):
+                    if item[0] is not None and item[0] <= toresend:
+                        start = i
+                self.inflight = deque(items[start:])
+                self.inflight_bytes = sum(item[1] for item in self.inflight)
+            self.clear = True
+
+    def _reset_window(self):
+        self.inflight.clear()
+        self.inflight_bytes = 0
+        self.stream_lines = 0
+        self.stream_acks = 0
+        self.clear = True
+
+    def _streaming(self):
+        return self.window_lines > 0 or self.window_bytes > 0
+
+    def _window_has_room(self, length):
+        if not self.inflight:
+            return True
+        if self.window_lines and len(self.inflight) >= self.window_lines:
+            return False
+        if self.window_bytes and self.inflight_bytes + length > self.window_bytes:
+            return False
+        return True
+
+    def _pump(self):
+        """Sends as many lines as the protocol allows, then flushes them with a
+        single write
+        """
+        streaming = self._streaming()
+        while self.printer:
+            if self.pending is None:
+                if self.printing and not streaming and not self.clear:
+                    break
+                if self.outbuf and self.printing and \
+                   not self.mainqueue.available(self.queueindex + 1):
+                    # a stream is about to block the loop until the next
+                    # lines are parsed, write the ones sent so far first
+                    self._flush()
+                self.pending = self._next_command()
+                if self.pending is None:
+                    break
+            command, lineno, gline = self.pending
+            if self.printing and streaming and not self._window_has_room(len(command) + 1):
+                break
+            self.pending = None
+            self._write_command(command, lineno, gline)
+            if self.printing:
+                self.clear = False
+        self._flush()
+
+    def _next_command(self):
+        """Returns the next (command, lineno, gline) to send, or None"""
+        if self.printing and -1 < self.resendfrom < self.lineno:
+            if self.resendfrom not in self.sentlines:
+                error = _("Printer requested resend of line %d, which is out of the %d lines resend history. Pausing print.") % (self.resendfrom, self.sentlines.size)
+                print error
+                if self.errorcb:
+                    try: self.errorcb(error)
+                    except: pass
+                self.resendfrom = -1
+                self.pause()
+                return None
+            if self.resend_mark is None:
+                self.resend_mark = self.stream_lines
+            # the lines up to the held one are all sent again
+            self.held = None
+            lineno = self.resendfrom
+            self.resendfrom += 1
+            return (self.sentlines[lineno], lineno, None)
+        self.resendfrom = -1
+        if self.priqueue:
+            return (self.priqueue.popleft(), None, None)
+        if self.printing and self.held is not None:
+            # after the commands restoring the position on resume
+            held, self.held = self.held, None
+            return held
+        while self.printing:
+            # everything read by index is read at once, as other threads can
+            # insert or remove lines meanwhile
+            with self.mainqueue.edit_lock:
+                self._follow_edits()
+                if self.linebuffer:
+                    # step over the comment lines at once
+                    self.queueindex = self.linebuffer.next_index(self.queueindex)
+                queued = self.mainqueue.getline(self.queueindex)
+                if queued is not None:
+                    prev_queued = None
+                    if self.layerchangecb and self.queueindex > 0:
+                        prev_queued = self.mainqueue.getline(self.queueindex - 1)
+                    next_queued = None
+                    if self.preprintsendcb:
+                        next_index = self.queueindex + 1
+                        if self.linebuffer:
+                            next_index = self.linebuffer.next_index(next_index)
+                        next_queued = self.mainqueue.getline(next_index)
+                    encoded = self.linebuffer.get(self.queueindex) if self.linebuffer else None
+                    # taken: a line inserted in its place from now on is ahead
+                    self.queueindex += 1
+            if queued is None:
+                # the lines of the last window can still have to be sent
+                # again, the ok which empties it ends the print
+                if not (self._streaming() and self.inflight):
+                    self._end_print()
+                break
+            (layer, gline) = queued
+            queued_gline = gline
+            if prev_queued is not None and prev_queued[0] != layer:
+                try: self.layerchangecb(layer)
+                except: traceback.print_exc()
+            if self.preprintsendcb:
+                next_gline = next_queued[1] if next_queued is not None else None
+                gline = self.preprintsendcb(gline, next_gline)
+            if gline == None:
+                continue
+            if gline is not queued_gline:
+                encoded = None
+            if encoded is None:
+                encoded = encode_line(gline.raw)
+            kind, payload, checksum = encoded
+            if kind == LINE_HOST_COMMAND:
+                if gline.raw.lstrip().startswith(";@pause"):
+                    self.pause()
+                continue
+            if kind != LINE_SEND:
+                continue
+            command = self._checksummed(payload, self.lineno, checksum)
+            lineno = self.lineno
+            self.lineno += 1
+            if self.printsendcb:
+                try: self.printsendcb(gline)
+                except: traceback.print_exc()
+            return (command, lineno, gline)
+        if self.priqueue:
+            return (self.priqueue.popleft(), None, None)
+        return None
+
+    def _follow_edits(self):
+        """Moves queueindex along with the lines inserted in or removed from
+        the print queue before it since the last call, linebuffer following
+        them by itself"""
+        edits = self.mainqueue.edits
+        if len(edits) == self.edits_seen:
+            return
+        for index, delta in edits[self.edits_seen:]:
+            if index < self.queueindex:
+                self.queueindex += delta
+        self.edits_seen = len(edits)
+
+    def _end_print(self):
+        self.printing = False
+        self.clear = True
+        if not self.paused:
+            self.queueindex = 0
+            self.lineno = 0
+            self.priqueue.append(self._checksummed("M110", -1))
+            self.sentlines.clear()
+            if self.sent is not None:
+                self.sent.clear()
+        self._call_endcb()
+
+    def _call_endcb(self):
+        if self.endcb:
+            #callback for printing done or paused, as with printcore
+            try: self.endcb()
+            except:
+                print "Print end callback failed with:"
+                traceback.print_exc(file = sys.stdout)
+
+    def _checksummed(self, command, lineno, checksum = None):
+        prefix = "N%d " % lineno
+        if checksum is None:
+            checksum = encode_line(command)[2]
+        command = "%s%s*%d" % (prefix, command, checksum ^ encode_line(prefix)[2])
+        if lineno >= 0 and "M110" not in command:
+            self.sentlines[lineno] = command
+        return command
+
+    def _write_command(self, command, lineno = None, gline = None):
+        if self._streaming():
+            self.inflight.append((lineno, len(command) + 1))
+            self.inflight_bytes += len(command) + 1
+        if self.sent is not None:
+            self.sent.append(command)
+        if gline is not None and gline.command is not None:
+            self.analyzer.AnalyzeLine(gline)
+        else:
+            self.analyzer.Analyze(command)
+        if self.loud:
+            print "SENT: ", command
+        if self.sendcb:
+            try: self.sendcb(command)
+            except: pass
+        self.outbuf += str(command + "\n")
+        self.written_lines += 1
+        self.stream_lines += 1
+
+    def _flush(self):
+        if not self.printer or not self.outbuf:
+            return
+        self.write_calls += 1
+        try:
+            if isinstance(self.printer, socket.socket):
+                written = self.printer.send(self.outbuf)
+            else:
+                written = os.write(self.fd, self.outbuf)
+            self.outbuf = self.outbuf[written:]
+            self.writefailures = 0
+        except (OSError, socket.error) as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                print "Can't write to printer (disconnected?) ({0}): {1}".format(e.args[0], e)
+                self.writefailures += 1
+        if self.outbuf:
+            self.loop.add_writer(self.fd, self._flush)
+        else:
+            self.loop.remove_writer(self.fd)
+
+    def startprint(self, gcode, startindex = 0):
+        """Start a print, gcode is a GCode object.
+        returns True on success, False if already printing.
+        Lines are then sent from the event loop as the printer acknowledges them.
+        A GCodeStream blocks the loop whenever it falls behind the printer.
+        """
+        if self.printing or not self.online or not self.printer:
+            return False
+        self.printing = True
+        self.paused = False
+        self.mainqueue = gcode
+        self.edits_seen = len(gcode.edits)
+        self.linebuffer = None
+        if gcode.lines:
+            self.linebuffer = gcode.send_lines()
+            self._precompute(self.linebuffer)
+        self.sentlines = SentLines(max(self.history_size, 2 * self.window_lines,
+                                       self.window_bytes))
+        self.lineno = 0
+        self.queueindex = startindex
+        self.resendfrom = -1
+        self.resend_request = -1
+        self.pending = None
+        self.held = None
+        self._reset_window()
+        self.priqueue.appendleft(self._checksummed("M110", -1))
+        if self.startcb:
+            try: self.startcb(False)
+            except:
+                print "Print start callback failed with:"
+                traceback.print_exc(file = sys.stdout)
+        self._pump()
+        return True
+
+    def _precompute(self, linebuffer):
+        # a chunk of lines per loop iteration, so that the other printers
+        # keep going, until another print starts
+        if linebuffer is self.linebuffer and not linebuffer.compute(1):
+            self.loop.call_later(0, lambda: self._precompute(linebuffer))
+
+    def pause(self):
+        """Pauses the print, saving the current position.
+        """
+        if not self.printing: return False
+        self.paused = True
+        self.printing = False
+        if self.pending is not None and self.pending[1] is not None:
+            # it would go out ignoring the window, and ahead of the
+            # commands restoring the position
+            self.held, self.pending = self.pending, None
+        self.pauseX = self.analyzer.x - self.analyzer.xOffset
+        self.pauseY = self.analyzer.y - self.analyzer.yOffset
+        self.pauseZ = self.analyzer.z - self.analyzer.zOffset
+        self.pauseE = self.analyzer.e - self.analyzer.eOffset
+        self.pauseF = self.analyzer.f
+        self.pauseRelative = self.analyzer.relative
+        self._call_endcb()
+
+    def resume(self):
+        """Resumes a paused print.
+        """
+        if not self.paused: return False
+        # queued rather than sent at once, to go out at the pace of the print
+        # ahead of the line held by the pause
+        self.priqueue.append("G90") # go to absolute coordinates
+        xyFeedString = ""
+        zFeedString = ""
+        if self.xy_feedrate != None: xyFeedString = " F" + str(self.xy_feedrate)
+        if self.z_feedrate != None: zFeedString = " F" + str(self.z_feedrate)
+        self.priqueue.append("G1 X" + str(self.pauseX) + " Y" + str(self.pauseY) + xyFeedString)
+        self.priqueue.append("G1 Z" + str(self.pauseZ) + zFeedString)
+        self.priqueue.append("G92 E" + str(self.pauseE))
+        if self.pauseRelative: self.priqueue.append("G91") # go back to relative if needed
+        self.priqueue.append("G1 F" + str(self.pauseF))
+        self.paused = False
+        self.printing = True
+        if self.startcb:
+            try: self.startcb(True)
+            except:
+                print "Print start callback failed with:"
+                traceback.print_exc(file = sys.stdout)
+        self._pump()
+
+    def send(self, command, wait = 0):
+        """Adds a command to the checksummed main command queue if printing, or sends the command immediately if not printing
+        """
+        if self.online:
+            if self.printing:
+                self.mainqueue.append(command)
+            else:
+                self.send_now(command)
+        else:
+            print "Not connected to printer."
+
+    def send_now(self, command, wait = 0):
+        """Sends a command to the printer ahead of the command queue, without a checksum
+        """
+        if self.online:
+            self.priqueue.append(command)
+            self._pump()
+        else:
+            print "Not connected to printer."
@@ -0,0 +1,612 @@
+#!/usr/bin/env python
+
+# This file is part of the Printrun suite.
+#
+# Printrun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Printrun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
+
+# Firmware emulator listening on a local TCP socket, which printcore.connect
+# accepts as a "host:port" port, or on a pty pair. It checks line numbers
+# and checksums like Marlin does, and can emulate a small RX buffer, slow
+# command processing, link latency and transmission errors. Run with
+#   python -m printrun.fakeprinter [-n lines] [--suite | --resend-test | --edit-test | --pause-test | --stall-test]
+# from the Printrun directory to benchmark printcore against it, or to check
+# that both printcore and eventcore recover from errors near the end of a
+# print, follow edits of the print queue, pause without blocking and write
+# the lines sent before waiting for a streamed file.
+
+import os, sys, time, getopt
+import re, math, random
+import socket
+import tty
+from threading import Thread, Condition, Event as ThreadEvent
+from Queue import Queue as ThreadQueue
+from multiprocessing import Process, Event, Queue
+
+numbered_exp = re.compile("^N(-?[0-9]+) (.*)\*([0-9]+)$")
+
+class FakePrinter(object):
+
+    def __init__(self, host = "127.0.0.1", port = 0, pty = False,
+                 rx_buffer = 0, line_delay = 0, latency = 0, resend_rate = 0,
+                 corrupt_lines = (), record = False):
+        """rx_buffer is the size of the receive buffer in bytes, data which
+        doesn't fit is dropped (0 for an unlimited buffer). line_delay is the
+        time taken to process each command and latency the delay before
+        replies reach the host, both in seconds. resend_rate is the
+        probability that a numbered line arrives corrupted, corrupt_lines the
+        line numbers which arrive corrupted the first time they are sent on
+        each connection. If record is set, the commands of the numbered lines
+        accepted are kept in accepted.
+        """
+        self.rx_buffer = rx_buffer
+        self.line_delay = line_delay
+        self.latency = latency
+        self.resend_rate = resend_rate
+        self.corrupt_lines = corrupt_lines
+        self.lines = 0 #commands processed
+        self.received = 0 #numbered lines accepted, M110 aside
+        self.record = record
+        self.accepted = []
+        self.resends = 0 #resend requests
+        self.recoveries = [] #seconds from a resend request to the requested line
+        self.sock = None
+        if pty:
+            self.master, self.slave = os.openpty()
+            tty.setraw(self.slave)
+            self.device = os.ttyname(self.slave)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((host, port))
+            self.sock.listen(1)
+            self.host, self.port = self.sock.getsockname()
+
+    def address(self):
+        if self.sock is None:
+            return self.device
+        return "%s:%d" % (self.host, self.port)
+
+    def serve_forever(self, done = None):
+        """Serves connections one after the other, calling done (if any)
+        after each of them"""
+        if self.sock is None:
+            try:
+                self.serve(lambda: os.read(self.master, 4096), self._write_pty)
+            except OSError:
+                pass
+            return
+        while True:
+            conn, addr = self.sock.accept()
+            try:
+                self.serve(lambda: conn.recv(4096), conn.sendall)
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+            if done:
+                done(self)
+
+    def start(self):
+        thread = Thread(target = self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _write_pty(self, data):
+        while data:
+            data = data[os.write(self.master, data):]
+
+    def serve(self, read, write):
+        """Emulates the firmware on a connection until read returns nothing.
+        This thread fills the RX buffer, a processor thread executes the
+        commands in it and a writer thread sends the replies."""
+        self.rx = ""
+        self.rx_cv = Condition()
+        self.connected = True
+        self.expected = 0
+        self.resend_started = None
+        self.corrupted = set(self.corrupt_lines) #still to corrupt
+        self.hotend = [20.0, 0.0]
+        self.bed = [20.0, 0.0]
+        self.temp_time = time.time()
+        self.replies = ThreadQueue()
+        processor = Thread(target = self._process_rx)
+        processor.start()
+        writer = Thread(target = self._write_replies, args = (write,))
+        writer.start()
+        self._reply("start\n")
+        try:
+            while True:
+                data = read()
+                if not data:
+                    break
+                with self.rx_cv:
+                    if self.rx_buffer:
+                        data = data[:max(0, self.rx_buffer - len(self.rx))]
+                    self.rx += data
+                    self.rx_cv.notify()
+        finally:
+            with self.rx_cv:
+                self.connected = False
+                self.rx_cv.notify()
+            processor.join()
+            self.replies.put(None)
+            writer.join()
+
+    def _reply(self, data):
+        self.replies.put((time.time() + self.latency, data))
+
+    def _write_replies(self, write):
+        while True:
+            item = self.replies.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                write(data)
+            except (OSError, socket.error):
+                pass
+
+    def _process_rx(self):
+        while True:
+            with self.rx_cv:
+                while self.connected and "\n" not in self.rx:
+                    self.rx_cv.wait()
+                if not self.connected:
+                    return
+                line, self.rx = self.rx.split("\n", 1)
+            self._process(line.strip())
+
+    def _request_resend(self, error):
+        """Asks for the expected line again. As with Marlin, the lines which
+        follow the faulty one get rejected too until it is sent again."""
+        self.resends += 1
+        if self.resend_started is None:
+            self.resend_started = time.time()
+        self._reply("Error:%s, Last Line: %d\nResend: %d\nok\n"
+                    % (error, self.expected - 1, self.expected))
+
+    def _process(self, line):
+        if not line:
+            return
+        if line.startswith("N"):
+            match = numbered_exp.match(line)
+            if not match:
+                return self._request_resend("No Checksum with line number")
+            lineno, command, checksum = match.groups()
+            lineno = int(lineno)
+            if reduce(lambda x, y: x ^ y, map(ord, line[:line.rindex("*")])) != int(checksum) \
+               or random.random() < self.resend_rate or lineno in self.corrupted:
+                self.corrupted.discard(lineno)
+                return self._request_resend("checksum mismatch")
+            if command.startswith("M110"):
+                self.expected = lineno + 1
+            elif lineno != self.expected:
+                return self._request_resend("Line Number is not Last Line Number+1")
+            else:
+                self.expected += 1
+                self.received += 1
+                if self.record:
+                    self.accepted.append(command)
+                if self.resend_started is not None:
+                    self.recoveries.append(time.time() - self.resend_started)
+                    self.resend_started = None
+            line = command
+        if self.line_delay:
+            time.sleep(self.line_delay)
+        self.lines += 1
+        self._reply(self.response(line))
+
+    def _update_temperatures(self):
+        now = time.time()
+        factor = 1 - math.exp(-(now - self.temp_time) / 5.0)
+        self.temp_time = now
+        for heater in (self.hotend, self.bed):
+            heater[0] += (max(heater[1], 20.0) - heater[0]) * factor
+
+    def response(self, line):
+        """Returns the reply to a command stripped of its line number"""
+        words = line.split(";")[0].split()
+        if not words:
+            return "ok\n"
+        command = words[0].upper()
+        if command in ("M104", "M109", "M140", "M190"):
+            self._update_temperatures()
+            heater = self.hotend if command in ("M104", "M109") else self.bed
+            for word in words[1:]:
+                if word[0] in "sS":
+                    try:
+                        heater[1] = float(word[1:])
+                    except ValueError:
+                        pass
+        if command == "M105":
+            self._update_temperatures()
+            return "ok T:%.1f /%.1f B:%.1f /%.1f\n" % tuple(self.hotend + self.bed)
+        return "ok\n"
+
+def _serve(port, ready, options, stats):
+    def done(printer):
+        stats.put((printer.lines, printer.resends, printer.recoveries))
+        printer.lines = printer.resends = 0
+        printer.recoveries = []
+    printer = FakePrinter(port = port, **options)
+    ready.set()
+    printer.serve_forever(done)
+
+def _free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+def _gcode(lines):
+    from printrun import gcoder
+    return gcoder.GCode("G1 X%d Y%d E%d" % (i % 200, (i / 200) % 200, i)
+                        for i in xrange(lines))
+
+def benchmark(lines = 100000, setup = None, options = {}):
+    """Prints lines G-code moves to a fake printer created with options and
+    running in a separate process. Returns a dict of statistics."""
+    from printrun.printrun_utils import install_locale
+    install_locale('pronterface')
+    from printcore import printcore
+
+    port = _free_port()
+    ready = Event()
+    stats = Queue()
+    server = Process(target = _serve, args = (port, ready, options, stats))
+    server.daemon = True
+    server.start()
+    ready.wait()
+    try:
+        gcode = _gcode(lines)
+        p = printcore("127.0.0.1:%d" % port, 115200)
+        while not p.online:
+            time.sleep(0.01)
+        if setup:
+            setup(p)
+        start_cpu = _cpu_time()
+        start_wall = time.time()
+        p.startprint(gcode)
+        while p.printing:
+            time.sleep(0.05)
+        cpu = _cpu_time() - start_cpu
+        wall = time.time() - start_wall
+        writes = float(p.write_calls) / p.written_lines
+        p.disconnect()
+        processed, resends, recoveries = stats.get(timeout = 10)
+    finally:
+        server.terminate()
+    return {"lines": lines, "cpu": cpu, "wall": wall, "writes": writes,
+            "resends": resends, "recoveries": recoveries}
+
+def _serve_ptys(count, devices, options):
+    printers = [FakePrinter(pty = True, **options) for i in range(count)]
+    for printer in printers:
+        printer.start()
+    devices.put([printer.address() for printer in printers])
+    while True:
+        time.sleep(1)
+
+def load_test(printers = 50, lines = 10000, setup = None, options = {}):
+    """Prints lines G-code moves on each of printers fake printers on pty
+    pairs, all driven by a single eventcore loop. Returns a dict of
+    statistics."""
+    from printrun.printrun_utils import install_locale
+    install_locale('pronterface')
+    from printrun.eventcore import EventLoop, eventcore
+
+    devices = Queue()
+    server = Process(target = _serve_ptys, args = (printers, devices, options))
+    server.daemon = True
+    server.start()
+    try:
+        loop = EventLoop()
+        cores = [eventcore(device, 250000, loop) for device in devices.get()]
+        if not loop.run_until(lambda: all(p.online for p in cores), 10):
+            raise RuntimeError("fake printers did not come online")
+        gcode = _gcode(lines)
+        if setup:
+            for p in cores:
+                setup(p)
+        start_cpu = _cpu_time()
+        start_wall = time.time()
+        for p in cores:
+            p.startprint(gcode)
+        loop.run_until(lambda: not any(p.printing for p in cores))
+        cpu = _cpu_time() - start_cpu
+        wall = time.time() - start_wall
+        writes = float(sum(p.write_calls for p in cores)) / sum(p.written_lines for p in cores)
+        for p in cores:
+            p.disconnect()
+    finally:
+        server.terminate()
+    return {"lines": lines * printers, "cpu": cpu, "wall": wall, "writes": writes}
+
+def report(name, stats):
+    recoveries = stats.get("recoveries")
+    if recoveries:
+        recovery = "%.2f" % (1000 * sum(recoveries) / len(recoveries))
+    else:
+        recovery = "-"
+    print "%-12s %10.0f %10.1f %10.3f %8s %10s" % (name, stats["lines"] / stats["wall"],
+                                                  1e6 * stats["cpu"] / stats["lines"],
+                                                  stats["writes"], stats.get("resends", "-"),
+                                                  recovery)
+
+suite_modes = [("ping-pong", 0, 0),
+               ("4 lines", 4, 0),
+               ("16 lines", 16, 0),
+               ("127 bytes", 0, 127)]
+
+def suite(lines = 10000, options = {}):
+    """Benchmarks each of the send modes of suite_modes (name, window_lines,
+    window_bytes) against the same firmware"""
+    print "%-12s %10s %10s %10s %8s %10s" % ("mode", "lines/s", "CPU us/l", "writes/l", "resends", "recov. ms")
+    for name, window_lines, window_bytes in suite_modes:
+        def setup(p):
+            p.window_lines = window_lines
+            p.window_bytes = window_bytes
+        report(name, benchmark(lines, setup, options))
+
+def _poll(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def _print_once(core, printer, gcode, window_lines, window_bytes, edit_at = None, edit = None):
+    """Prints gcode with core, printcore or eventcore, on printer, a
+    FakePrinter which is served from a thread for the length of the print.
+    edit(p), if given, is called from this thread with the core once the
+    queue index reached edit_at."""
+    from printrun.eventcore import EventLoop, eventcore
+    closed = ThreadEvent()
+    thread = Thread(target = printer.serve_forever, args = (lambda printer: closed.set(),))
+    thread.daemon = True
+    thread.start()
+    if core is eventcore:
+        loop = EventLoop()
+        p = eventcore(printer.address(), 115200, loop)
+        run_until = loop.run_until
+    else:
+        p = core(printer.address(), 115200)
+        run_until = _poll
+    if not run_until(lambda: p.online, 10):
+        raise RuntimeError("fake printer did not come online")
+    # the greeting brings the host online, let the ok of its probe arrive
+    # too rather than taking it for the ok of the first line printed
+    run_until(lambda: False, 0.2)
+    p.window_lines = window_lines
+    p.window_bytes = window_bytes
+    p.startprint(gcode)
+    if edit:
+        run_until(lambda: p.queueindex >= edit_at or not p.printing, 30)
+        edit(p)
+    run_until(lambda: not p.printing, 30)
+    p.disconnect()
+    closed.wait(10)
+
+def _cores():
+    from printrun.printrun_utils import install_locale
+    install_locale('pronterface')
+    from printcore import printcore
+    from printrun.eventcore import eventcore
+    return printcore, eventcore
+
+def final_window_test(lines = 300, options = {}):
+    """Prints lines G-code moves with printcore and eventcore in each of the
+    send modes of suite_modes, the firmware asking for one of the last lines
+    again after the rest of them were sent. Returns True if all the lines
+    got through every time."""
+    cores = _cores()
+    gcode = _gcode(lines)
+    passed = True
+    print "%-12s %10s %10s" % ("mode", "printcore", "eventcore")
+    for name, window_lines, window_bytes in suite_modes:
+        received = []
+        for core in cores:
+            printer = FakePrinter(corrupt_lines = [lines - 3], **options)
+            _print_once(core, printer, gcode, window_lines, window_bytes)
+            received.append(printer.received)
+        print "%-12s %10s %10s" % ((name,) + tuple("%d/%d" % (count, lines) for count in received))
+        passed = passed and received == [lines, lines]
+    return passed
+
+def edit_test(lines = 300, options = {}):
+    """Prints lines G-code moves with printcore and eventcore in each of the
+    send modes of suite_modes, inserting and removing lines both before and
+    after the one being sent a third of the way through. Returns True if
+    the firmware got the lines after it as edited every time."""
+    cores = _cores()
+    options = dict(options, line_delay = options.get("line_delay", 0.001))
+    passed = True
+    print "%-12s %10s %10s" % ("mode", "printcore", "eventcore")
+    for name, window_lines, window_bytes in suite_modes:
+        results = []
+        for core in cores:
+            gcode = _gcode(lines)
+            expected = [line.raw for line in gcode]
+            def edit(p):
+                # before the line being sent, which the printer never gets
+                gcode.insert(lines / 30, "G1 X-1 Y-1")
+                gcode.remove(lines / 15)
+                # and after it
+                gcode.insert(lines * 5 / 6, "G1 X-2 Y-2")
+                gcode.remove(lines * 9 / 10)
+            expected.insert(lines * 5 / 6, "G1 X-2 Y-2")
+            del expected[lines * 9 / 10]
+            printer = FakePrinter(record = True, **options)
+            _print_once(core, printer, gcode, window_lines, window_bytes, lines / 3, edit)
+            results.append(printer.accepted == expected)
+        print "%-12s %10s %10s" % ((name,) + tuple("ok" if result else "FAILED" for result in results))
+        passed = passed and all(results)
+    return passed
+
+def pause_test(lines = 40, options = {}):
+    """Prints lines G-code moves with printcore and eventcore in each of the
+    send modes of suite_modes on a slow firmware, pausing a third of the way
+    through and resuming. Returns True if every pause returned before the
+    firmware acknowledged a line and all the lines got through in order."""
+    cores = _cores()
+    options = dict(options, line_delay = options.get("line_delay", 0.1))
+    passed = True
+    print "%-12s %10s %10s" % ("mode", "printcore", "eventcore")
+    for name, window_lines, window_bytes in suite_modes:
+        results = []
+        for core in cores:
+            gcode = _gcode(lines)
+            expected = [line.raw for line in gcode]
+            paused = []
+            def edit(p):
+                start = time.time()
+                p.pause()
+                paused.append(time.time() - start)
+                time.sleep(3 * options["line_delay"])
+                p.resume()
+            printer = FakePrinter(record = True, **options)
+            _print_once(core, printer, gcode, window_lines, window_bytes, lines / 3, edit)
+            results.append("%.0fms" % (1000 * paused[0]) if printer.accepted == expected else "FAILED")
+            passed = passed and printer.accepted == expected and paused[0] < options["line_delay"] / 2
+        print "%-12s %10s %10s" % ((name,) + tuple(results))
+    return passed
+
+def stall_test(lines = 3000, options = {}):
+    """Prints lines G-code moves with printcore and eventcore in each of the
+    send modes of suite_modes from a GCodeStream whose source stalls for a
+    second past the lines parsed on creation. Returns True if the firmware
+    got every line parsed before the stall while it lasted, and all the
+    lines in the end."""
+    from printrun import gcoder
+    cores = _cores()
+    passed = True
+    print "%-12s %10s %10s" % ("mode", "printcore", "eventcore")
+    for name, window_lines, window_bytes in suite_modes:
+        results = []
+        for core in cores:
+            stalled = ThreadEvent()
+            def data():
+                for i in xrange(lines):
+                    if i == lines * 5 / 6:
+                        stalled.set()
+                        time.sleep(1)
+                    yield "G1 X%d Y%d E%d" % (i % 200, (i / 200) % 200, i)
+            gcode = gcoder.GCodeStream(data(), 2 * gcoder.GCodeStream.batch_size)
+            printer = FakePrinter(**options)
+            during = []
+            def check():
+                stalled.wait(30)
+                time.sleep(0.5)
+                during.append((printer.received, gcode.parsed))
+            thread = Thread(target = check)
+            thread.daemon = True
+            thread.start()
+            _print_once(core, printer, gcode, window_lines, window_bytes)
+            thread.join(30)
+            received, parsed = during[0] if during else (0, 0)
+            result = received == parsed and printer.received == lines
+            results.append("%d/%d" % (received, parsed) if result else "FAILED")
+            passed = passed and result
+        print "%-12s %10s %10s" % ((name,) + tuple(results))
+    return passed
+
+def main():
+    lines = 100000
+    window_lines = 0
+    window_bytes = 0
+    printers = 0
+    run_suite = False
+    run_resend_test = False
+    run_edit_test = False
+    run_pause_test = False
+    run_stall_test = False
+    options = {}
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:w:b:p:sreut",
+                                   ["help", "lines=", "window-lines=", "window-bytes=", "printers=", "suite", "resend-test", "edit-test", "pause-test", "stall-test",
+                                    "rx-buffer=", "line-delay=", "latency=", "resend-rate="])
+    except getopt.GetoptError, err:
+        print str(err)
+        sys.exit(2)
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print "Opts are: --help, -n --lines = number of lines to send, -w --window-lines = lines in flight, -b --window-bytes = bytes in flight, -p --printers = load test eventcore with this many pty printers, -s --suite = benchmark all send modes, -r --resend-test = check that a resend in the last window of a print is served in all send modes, -e --edit-test = check that lines inserted and removed during a print are followed in all send modes, -u --pause-test = check that a print pauses at once and resumes without losing lines in all send modes, -t --stall-test = check that the lines sent are written while a streamed file stalls in all send modes"
+            print "Firmware opts are: --rx-buffer = RX buffer size in bytes, --line-delay = ms per command, --latency = ms before each reply, --resend-rate = probability of a corrupted line"
+            sys.exit(1)
+        if o in ('-n', '--lines'):
+            lines = int(a)
+        if o in ('-w', '--window-lines'):
+            window_lines = int(a)
+        if o in ('-b', '--window-bytes'):
+            window_bytes = int(a)
+        if o in ('-p', '--printers'):
+            printers = int(a)
+        if o in ('-s', '--suite'):
+            run_suite = True
+        if o in ('-r', '--resend-test'):
+            run_resend_test = True
+        if o in ('-e', '--edit-test'):
+            run_edit_test = True
+        if o in ('-u', '--pause-test'):
+            run_pause_test = True
+        if o in ('-t', '--stall-test'):
+            run_stall_test = True
+        if o == '--rx-buffer':
+            options["rx_buffer"] = int(a)
+        if o == '--line-delay':
+            options["line_delay"] = float(a) / 1000
+        if o == '--latency':
+            options["latency"] = float(a) / 1000
+        if o == '--resend-rate':
+            options["resend_rate"] = float(a)
+
+    if run_suite:
+        suite(lines, options)
+        return
+    if run_resend_test:
+        sys.exit(0 if final_window_test(options = options) else 1)
+    if run_edit_test:
+        sys.exit(0 if edit_test(options = options) else 1)
+    if run_pause_test:
+        sys.exit(0 if pause_test(options = options) else 1)
+    if run_stall_test:
+        sys.exit(0 if stall_test(options = options) else 1)
+
+    def setup(p):
+        p.window_lines = window_lines
+        p.window_bytes = window_bytes
+
+    if printers:
+        stats = load_test(printers, lines, setup, options)
+        print "Sent %d lines to each of %d printers in %0.2fs" % (lines, printers, stats["wall"])
+    else:
+        stats = benchmark(lines, setup, options)
+        print "Sent %d lines in %0.2fs" % (lines, stats["wall"])
+    print "Host CPU time: %0.3fs (%0.3fs per 100k lines)" % (stats["cpu"], stats["cpu"] * 100000.0 / stats["lines"])
+    print "Writes per line: %0.3f" % stats["writes"]
+    if "resends" in stats:
+        print "Resend requests: %d" % stats["resends"]
+        if stats["recoveries"]:
+            print "Mean resend recovery time: %0.2fms" % (1000 * sum(stats["recoveries"]) / len(stats["recoveries"]))
+
+if __name__ == '__main__':
+    main()
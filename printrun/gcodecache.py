@@ -0,0 +1,305 @@
+# This file is part of the Printrun suite.
+#
+# Printrun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Printrun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
+
+# On-disk cache of preprocessed G-code files. An entry holds everything
+# gcoder computes when loading a file (parsed coordinates, modal flags,
+# positions, layers, bounds, filament length and durations) as raw
+# arrays behind a JSON header, so that loading the file again only has to
+# rebuild the line objects. Entries are named after the SHA-1 of the file
+# contents; a stamp per file path keeps the hash computed for its size and
+# mtime, so that unchanged files aren't hashed again. The least recently
+# used entries are removed when the cache grows over max_size, and a
+# max_size of 0 disables the cache.
+
+import os, sys
+import json
+import hashlib
+import logging
+from array import array
+from itertools import izip
+from operator import attrgetter
+
+from printrun import gcoder
+
+version = 5
+magic = "PRGC"
+
+float_fields = gcoder.restore_fields
+
+# line flags
+is_move = 1
+relative = 2
+relative_e = 4
+extruding = 8
+has_extruding = 16
+
+def float_code():
+    # GLines store single precision floats, PyLines double precision ones
+    return "d" if gcoder.Line is gcoder.PyLine else "f"
+
+def line_sections(lines):
+    """Returns the command names of lines and their commands, flags, tools,
+    indices, fields and values sections"""
+    ids = {}
+    moves, relatives, relatives_e, extrudings, tools, commands = \
+        zip(*map(attrgetter("is_move", "relative", "relative_e", "extruding",
+                            "current_tool", "command"), lines)) or ((),) * 6
+    commands = [ids.setdefault(command, len(ids)) for command in commands]
+    commands = array("H" if len(ids) <= 0x10000 else "I", commands)
+    names = sorted(ids, key = ids.get)
+    flags = array("B", [(is_move | (relative if r else 0) | (relative_e if re else 0) if m else 0)
+                        | (0 if x is None else has_extruding | (extruding if x else 0))
+                        for m, r, re, x in izip(moves, relatives, relatives_e, extrudings)])
+    tools = array("B", [(t or 0) if m else 0 for m, t in izip(moves, tools)])
+    # coordinates are stored as (line index, field, value)
+    indices = array("I")
+    fields = array("B")
+    values = array(float_code())
+    columns = zip(*map(attrgetter(*float_fields), lines)) or ((),) * len(float_fields)
+    for field, column in enumerate(columns):
+        set_indices = [i for i, value in enumerate(column) if value is not None]
+        indices.extend(set_indices)
+        fields.extend([field] * len(set_indices))
+        values.extend([column[i] for i in set_indices])
+    return names, [commands, flags, tools, indices, fields, values]
+
+def column_sections(lines):
+    """Same as line_sections, from the gcoder.GCodeColumns of lines"""
+    numpy = gcoder.numpy
+    columns = gcoder.GCodeColumns(None, lines, exact = True)
+    move = (columns.flags & is_move) != 0
+    flags = numpy.where(move, columns.flags & (is_move | relative | relative_e), 0)
+    # only the moves with an E have their extruding flag set
+    flags |= numpy.where(move & ~numpy.isnan(columns.e),
+                         has_extruding | (columns.flags & extruding), 0)
+    tools = numpy.where(move, columns.tool, 0)
+    indices = []
+    fields = []
+    values = []
+    for field, name in enumerate(float_fields):
+        column = getattr(columns, name)
+        set_indices = numpy.flatnonzero(~numpy.isnan(column))
+        indices.append(set_indices)
+        fields.append(numpy.repeat(numpy.uint8(field), len(set_indices)))
+        values.append(column[set_indices])
+    command_code = "H" if columns.command.dtype == numpy.uint16 else "I"
+    sections = [(command_code, columns.command), ("B", flags), ("B", tools),
+                ("I", numpy.concatenate(indices)), ("B", numpy.concatenate(fields)),
+                (float_code(), numpy.concatenate(values))]
+    dtypes = {"B": numpy.uint8, "H": numpy.uint16, "I": numpy.uint32,
+              "f": numpy.float32, "d": numpy.float64}
+    return columns.commands, [array(code, section.astype(dtypes[code]).tostring())
+                              for code, section in sections]
+
+class GCodeCache(object):
+
+    def __init__(self, path = None, max_size = 256 << 20):
+        self.path = path or os.path.expanduser("~/.printrun/gcode-cache")
+        self.max_size = max_size
+
+    def load(self, filename, lazy = False):
+        """Returns a gcoder.MappedGCode of filename holding its contents in
+        memory, restored from the cache if it's there, parsed and added to
+        the cache otherwise. Binary files (see gcoder.write_binary) and lazy
+        loads (see gcoder.GCode) don't go through the cache, nor any file if
+        max_size is 0."""
+        source = open(filename, "rb").read()
+        if gcoder.is_binary(source):
+            return gcoder.BinaryGCode(source, lazy)
+        gcode = gcoder.MappedGCode.__new__(gcoder.MappedGCode)
+        gcode.source = source
+        if lazy or not self.max_size:
+            gcode.lazy = lazy
+            gcode.lines = gcode._map_lines()
+            gcode._preprocess()
+            return gcode
+        key = None
+        try:
+            key = self.key(filename, gcode.source)
+            entry = os.path.join(self.path, key + ".gcache")
+            if os.path.exists(entry) and self.restore(gcode, entry):
+                os.utime(entry, None)
+                return gcode
+        except Exception, e:
+            logging.warning("Could not read the G-code cache: %s" % e)
+        gcode.lines = gcode._map_lines()
+        gcode._preprocess()
+        if key is not None:
+            try:
+                gcode.estimate_duration()
+                self.store(gcode, key)
+                self.evict()
+            except Exception, e:
+                logging.warning("Could not write to the G-code cache: %s" % e)
+        return gcode
+
+    def key(self, filename, source):
+        """Returns the SHA-1 of source, the contents of filename, or the one
+        computed last time if its size and mtime didn't change"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        stat = os.stat(filename)
+        stamp = "%d %r" % (stat.st_size, stat.st_mtime)
+        path = os.path.realpath(filename)
+        stamp_file = os.path.join(self.path, hashlib.sha1(path).hexdigest() + ".stamp")
+        try:
+            f = open(stamp_file)
+            try:
+                old_stamp, key = f.read().rsplit(" ", 1)
+            finally:
+                f.close()
+            if old_stamp == stamp:
+                os.utime(stamp_file, None)
+                return key
+        except (IOError, ValueError):
+            pass
+        key = hashlib.sha1(source).hexdigest()
+        self._write(stamp_file, "%s %s" % (stamp, key))
+        return key
+
+    def _write(self, filename, data):
+        # written aside then renamed so that readers never see partial files
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        f = open(tmp, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        try:
+            os.rename(tmp, filename)
+        except OSError:
+            # Windows doesn't replace existing files: readers may then find
+            # none for a moment, and load the file again
+            try:
+                os.remove(filename)
+                os.rename(tmp, filename)
+            except OSError:
+                os.remove(tmp)
+
+    def store(self, gcode, key):
+        """Writes the entry of gcode, a freshly loaded MappedGCode whose
+        duration was estimated"""
+        source = gcode.source
+        if len(source) > 0xffffffff:
+            return
+        lines = gcode.lines
+        spans = zip(*gcoder.line_spans(source)) or ((), ())
+        starts = array("I", spans[0])
+        lengths = array("I", spans[1])
+        if gcoder.numpy is not None:
+            names, sections = column_sections(lines)
+        else:
+            names, sections = line_sections(lines)
+        commands, flags, tools, indices, fields, values = sections
+        sections = [starts, lengths, commands, flags, tools, indices, fields, values,
+                    gcode.layer_idxs, gcode.line_idxs, gcode.line_times]
+        header = {
+            "version": version,
+            "byteorder": sys.byteorder,
+            "size": len(source),
+            "float": float_code(),
+            "sections": [(a.typecode, len(a)) for a in sections],
+            "commands": names,
+            "layer_z": gcode.all_layers_z,
+            "layers": gcode.layers.keys(),
+            "durations": [getattr(layer, "duration", None) for layer in gcode.all_layers],
+            "state": gcode._state(),
+            "bounds": gcode.bounds,
+            "filament_length": gcode.filament_length,
+        }
+        data = [magic, json.dumps(header), "\n"] + [a.tostring() for a in sections]
+        self._write(os.path.join(self.path, key + ".gcache"), "".join(data))
+
+    def restore(self, gcode, entry):
+        """Sets up gcode, a MappedGCode whose source is set, from entry.
+        Returns False if entry was written for another build or file."""
+        f = open(entry, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if not data.startswith(magic):
+            return False
+        end = data.index("\n")
+        header = json.loads(data[len(magic):end])
+        if header["version"] != version or header["byteorder"] != sys.byteorder \
+           or header["size"] != len(gcode.source) or header["float"] != float_code():
+            return False
+        # the raw bytes of each array
+        sections = []
+        pos = end + 1
+        for typecode, count in header["sections"]:
+            size = count * array(str(typecode)).itemsize
+            sections.append(data[pos:pos + size])
+            pos += size
+        layer_idxs = array(str(header["sections"][8][0]), sections[8])
+        line_idxs = array(str(header["sections"][9][0]), sections[9])
+        line_times = array(str(header["sections"][10][0]), sections[10])
+
+        names = [str(name) for name in header["commands"]]
+        lines = gcoder.restore_lines(gcode.source, names, *sections[:8])
+
+        all_layers = [gcoder.Layer([]) for z in header["layer_z"]]
+        for line, layer in izip(lines, layer_idxs):
+            all_layers[layer].append(line)
+        z_lines = {}
+        for layer, z, duration in izip(all_layers, header["layer_z"], header["durations"]):
+            if duration is not None:
+                layer.duration = duration
+            if layer:
+                z_lines.setdefault(z, []).extend(layer)
+
+        gcode.lines = lines
+        gcode.all_layers = all_layers
+        gcode.all_layers_z = header["layer_z"]
+        gcode.z_lines = z_lines
+        gcode.layers = dict((z, gcoder.Layer(z_lines[z])) for z in header["layers"])
+        gcode.append_layer_id = len(all_layers) - 1
+        gcode.append_layer = all_layers[-1]
+        gcode.layer_idxs = layer_idxs
+        gcode.line_idxs = line_idxs
+        gcode.line_times = line_times
+        state = header["state"]
+        state[6] = tuple(state[6])
+        gcode._set_state(tuple(state))
+        gcode.bounds = header["bounds"]
+        gcode._set_bounds()
+        gcode.filament_length = header["filament_length"]
+        return True
+
+    def evict(self):
+        """Removes the least recently used entries and stamps until the cache
+        fits in max_size"""
+        files = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".gcache") and not name.endswith(".stamp"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -15,10 +15,26 @@
 # along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import os
 import re
 import math
+import json
+import mmap
 import datetime
 from array import array
+from bisect import bisect_left, bisect_right
+from cStringIO import StringIO
+from collections import deque
+from itertools import islice, izip, imap
+from operator import attrgetter, xor
+from threading import Thread, Condition, Lock
+from Queue import Queue, Empty as QueueEmpty
+from multiprocessing import Pool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 gcode_parsed_args = ["x", "y", "e", "f", "z", "i", "j"]
 gcode_parsed_nonargs = ["g", "t", "m", "n"]
@@ -43,11 +59,75 @@ class PyLine(object):
     def __getattr__(self, name):
         return None
 
+class PyMappedLine(object):
+    """PyLine whose raw text stays in the buffer it comes from, such as the
+    memory map of a file, and is only copied out when needed. The buffer is
+    a class attribute, see mapped_line_class, and each line only keeps its
+    span: start offset << 16 | length.
+    """
+
+    __slots__ = tuple(name for name in PyLine.__slots__ if name != 'raw') + ('span',)
+
+    source = None
+
+    def __init__(self, start, length):
+        self.span = (start << 16) | length
+
+    def __getattr__(self, name):
+        return None
+
+    @property
+    def raw(self):
+        span = self.span
+        start = span >> 16
+        return self.source[start:start + (span & 0xffff)]
+
+def lazy_getattr(line, name):
+    # coordinates are parsed on first access, line.lazy being the unit mode
+    # to parse them in until then, and None afterwards. Lines without Z are
+    # the only ones left to parse, so that layers can be split without it.
+    if name in gcode_parsed_args and name != "z":
+        imperial = line.lazy
+        if imperial is not None:
+            line.lazy = None
+            parse_line(line, imperial)
+            return getattr(line, name)
+    return None
+
+class PyLazyLine(PyLine):
+    """PyLine whose coordinates can be left to parse on first access, see
+    py_parse_line"""
+
+    __slots__ = ('lazy',)
+
+    __getattr__ = lazy_getattr
+
+class PyLazyMappedLine(PyMappedLine):
+    """PyMappedLine whose coordinates can be left to parse on first access"""
+
+    __slots__ = ('lazy',)
+
+    __getattr__ = lazy_getattr
+
 try:
     import gcoder_line
     Line = gcoder_line.GLine
+    MappedLine = getattr(gcoder_line, "MappedGLine", None)
+    # GLines keep track of their lazy parsing themselves
+    LazyLine = Line
 except ImportError:
+    gcoder_line = None
     Line = PyLine
+    MappedLine = None
+    LazyLine = PyLazyLine
+
+def mapped_line_class(source, lazy = False):
+    """Returns a (start, length) -> line constructor for lines of source,
+    which can be parsed lazily if lazy is set"""
+    if MappedLine is not None:
+        return lambda start, length: MappedLine(source, start, length)
+    base = PyLazyMappedLine if lazy else PyMappedLine
+    return type(base.__name__, (base,), {"__slots__": (), "source": source})
 
 def find_specific_code(line, code):
     exp = specific_exp % code
@@ -63,26 +143,115 @@ def P(line):
 
 def split(line):
     split_raw = gcode_exp.findall(line.raw.lower())
-    command = split_raw[0] if split_raw[0][0] != "n" else split_raw[1]
-    line.command = command[0].upper() + command[1]
+    if split_raw and split_raw[0][0] == "n":
+        command = split_raw[1] if len(split_raw) > 1 else ("", "")
+    else:
+        command = split_raw[0] if split_raw else ("", "")
+    line.command = intern(command[0].upper() + command[1])
     line.is_move = line.command in move_gcodes
     return split_raw
 
 def parse_coordinates(line, split_raw, imperial = False, force = False):
     # Not a G-line, we don't want to parse its arguments
-    if not force and line.command[0] != "G":
+    if not force and line.command[:1] != "G":
         return
     unit_factor = 25.4 if imperial else 1
     for bit in split_raw:
         code = bit[0]
         if code not in gcode_parsed_nonargs and bit[1]:
-            setattr(line, code, unit_factor*float(bit[1]))
+            try:
+                setattr(line, code, unit_factor*float(bit[1]))
+            except ValueError: # sign or dot alone
+                pass
+
+numeric_chars = "0123456789.+-"
+word_chars = numeric_chars + " \t\r\x0b\x0c"
+
+def py_parse_line(line, imperial = False, force = False, lazy = False):
+    """Does split and parse_coordinates in a single pass: sets the command
+    and is_move of line and, for G-codes or if force is set, its coordinates.
+    G20 and G21 lines are parsed in the units they select. Lines which are
+    not made of whitespace separated letter + number words go through split
+    instead. If lazy is set, the coordinates of the G-codes which can't
+    change the Z (other than G92 and the ones without a Z) are only parsed
+    on first access; line must then be a PyLazyLine or PyLazyMappedLine.
+    """
+    raw = line.raw
+    if type(raw) is str and "(" not in raw and "\n" not in raw:
+        body = raw.split(";", 1)[0].lower()
+        words = body.split()
+        if not words:
+            line.command = ""
+            line.is_move = False
+            return
+        first = 1 if words[0][0] == "n" else 0
+        command = words[first] if first < len(words) else ""
+        # one letter per word: the line number and the command are checked
+        # here, the first character of the other words below
+        if len(body.translate(None, word_chars)) == len(words) \
+           and not (first and words[0][1:].translate(None, numeric_chars)) \
+           and command[:1] in ("g", "m", "t") and command[1:].isdigit():
+            command = intern(command.upper())
+            if not force and command[0] != "G":
+                line.command = command
+                line.is_move = False
+                return
+            if lazy and command != "G92" and "z" not in body:
+                line.command = command
+                line.is_move = command in move_gcodes
+                line.lazy = imperial
+                return
+            values = []
+            for word in words[first + 1:]:
+                code = word[0]
+                if code in numeric_chars:
+                    break
+                if code in gcode_parsed_args and len(word) > 1:
+                    try:
+                        values.append((code, float(word[1:])))
+                    except ValueError:
+                        break
+            else:
+                line.command = command
+                line.is_move = command in move_gcodes
+                if command == "G20":
+                    imperial = True
+                elif command == "G21":
+                    imperial = False
+                unit_factor = 25.4 if imperial else 1
+                for code, value in values:
+                    setattr(line, code, unit_factor * value)
+                return
+    split_raw = split(line)
+    if line.command == "G20":
+        imperial = True
+    elif line.command == "G21":
+        imperial = False
+    parse_coordinates(line, split_raw, imperial, force)
+
+if gcoder_line is not None and hasattr(gcoder_line, "parse_line"):
+    parse_line = gcoder_line.parse_line
+else:
+    parse_line = py_parse_line
+
+# line count from which the position and extrusion passes go through NumPy
+# instead of looping over the lines. Without the gcoder_line helpers to read
+# and set the fields of the lines, that costs more than the loops.
+if numpy is not None and hasattr(gcoder_line, "set_positions"):
+    numpy_min_lines = 256
+else:
+    numpy_min_lines = sys.maxint
 
 class Layer(list):
 
     __slots__ = ("duration")
 
     def _preprocess(self, current_x, current_y, current_z):
+        """Sets current_x, current_y and current_z of the moves and G92s,
+        starting from the given position. Returns the position after them
+        and the bounds of the extruding moves."""
+        if len(self) >= numpy_min_lines:
+            return preprocess_positions(self, current_x, current_y, current_z)
         xmin = float("inf")
         ymin = float("inf")
         zmin = 0
@@ -96,7 +265,7 @@ class Layer(list):
             if not line.is_move and line.command != "G92":
                 continue
             if line.is_move:
-                x = line.x 
+                x = line.x
                 y = line.y
                 z = line.z
 
@@ -104,32 +273,194 @@ class Layer(list):
                     x = current_x + (x or 0)
                     y = current_y + (y or 0)
                     z = current_z + (z or 0)
-                
-                current_x = x or current_x
-                current_y = y or current_y
-                current_z = z or current_z
+
+                if line.e and line.command in ("G2", "G3"):
+                    xm, xM, ym, yM = arc_bounds(current_x, current_y,
+                                                x if x is not None else current_x,
+                                                y if y is not None else current_y,
+                                                line.i, line.j, line.command == "G2")
+                    xmin = min(xmin, xm)
+                    xmax = max(xmax, xM)
+                    ymin = min(ymin, ym)
+                    ymax = max(ymax, yM)
+
+                if x is not None:
+                    current_x = x
+                if y is not None:
+                    current_y = y
+                if z is not None:
+                    current_z = z
 
                 if line.e:
-                    if x:
+                    if x is not None:
                         xmin = min(xmin, x)
                         xmax = max(xmax, x)
-                    if y:
+                    if y is not None:
                         ymin = min(ymin, y)
                         ymax = max(ymax, y)
-                    if current_z:
-                        zmin = min(zmin, current_z)
-                        zmax = max(zmax, current_z)
+                    zmin = min(zmin, current_z)
+                    zmax = max(zmax, current_z)
 
             else:
-                current_x = line.x or current_x
-                current_y = line.y or current_y
-                current_z = line.z or current_z    
+                if line.x is not None:
+                    current_x = line.x
+                if line.y is not None:
+                    current_y = line.y
+                if line.z is not None:
+                    current_z = line.z
 
             line.current_x = current_x
             line.current_y = current_y
             line.current_z = current_z
         return (current_x, current_y, current_z), (xmin, xmax), (ymin, ymax), (zmin, zmax)
 
+def layer_zs(lines, prev_z):
+    """Returns the z of the layer of each line as GCode._create_layers
+    tracks it, prev_z being the one of the line before, None at the start"""
+    cur_z = prev_z if prev_z is not None else 0
+    zs = []
+    for line in lines:
+        if line.command == "G92" and line.z != None:
+            cur_z = line.z
+        elif line.is_move and line.z != None:
+            if line.relative:
+                cur_z += line.z
+            else:
+                cur_z = line.z
+        zs.append(cur_z)
+    return zs
+
+def empty_bounds():
+    """Returns the [xmin, xmax, ymin, ymax, zmin, zmax] bounds of no lines"""
+    return [float("inf"), float("-inf"), float("inf"), float("-inf"), 0, float("-inf")]
+
+def merge_bounds(a, b):
+    return [min(a[0], b[0]), max(a[1], b[1]),
+            min(a[2], b[2]), max(a[3], b[3]),
+            min(a[4], b[4]), max(a[5], b[5])]
+
+# G2 and G3 arcs, in the XY plane, their center being given by I and J
+# relative to their start as with G91.1, the firmware default
+
+arc_tolerance = 0.01 #mm, largest distance between arcs and their segments
+
+def arc_geometry(x0, y0, x1, y1, i, j, clockwise):
+    """Returns the center, radius, start angle and sweep of the arc from
+    (x0, y0) to (x1, y1), the sweep being negative for clockwise arcs.
+    Arcs ending where they start are full circles."""
+    cx = x0 + (i or 0)
+    cy = y0 + (j or 0)
+    radius = math.hypot(x0 - cx, y0 - cy)
+    start = math.atan2(y0 - cy, x0 - cx)
+    if math.hypot(x1 - x0, y1 - y0) < 1e-6:
+        sweep = 2 * math.pi
+    else:
+        sweep = (math.atan2(y1 - cy, x1 - cx) - start) % (2 * math.pi)
+        if clockwise:
+            sweep = 2 * math.pi - sweep
+    return cx, cy, radius, start, -sweep if clockwise else sweep
+
+def arc_bounds(x0, y0, x1, y1, i, j, clockwise):
+    """Returns (xmin, xmax, ymin, ymax) of an arc: its ends, and the points
+    where it crosses the axes through its center"""
+    cx, cy, radius, start, sweep = arc_geometry(x0, y0, x1, y1, i, j, clockwise)
+    xs = [x0, x1]
+    ys = [y0, y1]
+    for quadrant in range(4):
+        angle = quadrant * math.pi / 2
+        offset = (angle - start if sweep > 0 else start - angle) % (2 * math.pi)
+        if offset <= abs(sweep):
+            xs.append(cx + radius * math.cos(angle))
+            ys.append(cy + radius * math.sin(angle))
+    return min(xs), max(xs), min(ys), max(ys)
+
+def arc_length(x0, y0, x1, y1, i, j, clockwise):
+    """Returns the length of an arc in the XY plane"""
+    cx, cy, radius, start, sweep = arc_geometry(x0, y0, x1, y1, i, j, clockwise)
+    return radius * abs(sweep)
+
+def tessellate_arc(start, end, i, j, clockwise, tolerance = arc_tolerance):
+    """Returns the (x, y, z) ends of the segments following an arc from
+    start to end within tolerance, Z moving linearly along them, end
+    included and start not"""
+    x0, y0, z0 = start
+    x1, y1, z1 = end
+    cx, cy, radius, angle, sweep = arc_geometry(x0, y0, x1, y1, i, j, clockwise)
+    count = 1
+    if radius > tolerance:
+        count = max(1, int(math.ceil(abs(sweep) / (2 * math.acos(1 - tolerance / radius)))))
+    points = []
+    for k in xrange(1, count):
+        a = angle + sweep * k / count
+        points.append((cx + radius * math.cos(a), cy + radius * math.sin(a),
+                       z0 + (z1 - z0) * k / count))
+    points.append(tuple(end))
+    return points
+
+def time_moves(lines, state, times):
+    """Appends to times the time at the end of each of lines, roughly
+    estimated as GCode.estimate_duration does without a planner, going on
+    from state, the (x, y, e, f, total duration) after the lines before.
+    Returns the state after lines."""
+    lastx, lasty, laste, lastf, totalduration = state
+    x, y, e, f = lastx, lasty, laste, lastf
+    currenttravel = 0.0
+    moveduration = 0.0
+    acceleration = 1500.0 #mm/s/s  ASSUMING THE DEFAULT FROM SPRINTER !!!!
+    #TODO:
+    # get device caps from firmware: max speed, acceleration/axis (including extruder)
+    # calculate the maximum move duration accounting for above ;)
+    for line in lines:
+        if line.command not in ["G1", "G0", "G2", "G3", "G4"]:
+            times.append(totalduration)
+            continue
+        if line.command == "G4":
+            moveduration = P(line)
+            if not moveduration:
+                times.append(totalduration)
+                continue
+            else:
+                moveduration /= 1000.0
+        else:
+            x = line.x if line.x != None else lastx
+            y = line.y if line.y != None else lasty
+            e = line.e if line.e != None else laste
+            f = line.f / 60.0 if line.f != None else lastf # mm/s vs mm/m => divide by 60
+                
+            # given last feedrate and current feedrate calculate the distance needed to achieve current feedrate.
+            # if travel is longer than req'd distance, then subtract distance to achieve full speed, and add the time it took to get there.
+            # then calculate the time taken to complete the remaining distance
+
+            if line.command in ("G2", "G3"):
+                currenttravel = arc_length(lastx, lasty, x, y, line.i, line.j,
+                                           line.command == "G2")
+            else:
+                currenttravel = math.hypot(x - lastx, y - lasty)
+            # FIXME: review this better
+            # this looks wrong : there's little chance that the feedrate we'll decelerate to is the previous feedrate
+            # shouldn't we instead look at three consecutive moves ?
+            distance = 2 * abs(((lastf + f) * (f - lastf) * 0.5) / acceleration)  # multiply by 2 because we have to accelerate and decelerate
+            if distance <= currenttravel and lastf + f != 0 and f != 0:
+                # Unsure about this formula -- iXce reviewing this code
+                moveduration = 2 * distance / (lastf + f)
+                currenttravel -= distance
+                moveduration += currenttravel/f
+            else:
+                moveduration = math.sqrt(2 * distance / acceleration) # probably buggy : not taking actual travel into account
+
+        totalduration += moveduration
+        times.append(totalduration)
+
+        lastx = x
+        lasty = y
+        laste = e
+        lastf = f
+
+    return (lastx, lasty, laste, lastf, totalduration)
+
+# guards the creation of the edit locks of GCode objects
+edit_locks_lock = Lock()
+
 class GCode(object):
 
     lines = None
@@ -156,14 +487,70 @@ class GCode(object):
     depth = None
     height = None
 
-    def __init__(self,data):
-        self.lines = [Line(l2) for l2 in
+    # running state after the last line, kept so that appending a line only
+    # has to preprocess that line
+    cur_e = 0
+    total_e = 0
+    current = (0, 0, 0)
+    bounds = None
+    prev_z = None #z of the layer of the last line
+    all_layers_z = None #z of each layer of all_layers
+    z_lines = None #all the lines at each z, layers only has the extruding ones
+
+    # preprocessing state at the start of every block of about block_size
+    # lines, as [line count, state, max extruded length, bounds] lists,
+    # built by the first insert or remove
+    blocks = None
+    block_size = 1024
+
+    line_times = None #estimated time at the end of each line, see estimate_duration
+
+    # tessellated arcs by start, end, center and tolerance, see arc_points
+    arc_cache = None
+
+    # set while the coordinates only needed by the extrusion, position and
+    # bounds passes are left to parse, see preprocess_coordinates
+    lazy = False
+
+    _columns = None
+    _index = None
+    _send_lines = None
+
+    # (index, 1 or -1) of the lines inserted and removed so far, a list which
+    # only grows, so that senders going through the lines by index can follow
+    # them from the length they last saw
+    edits = ()
+    _edit_lock = None
+
+    def __init__(self, data, lazy = False):
+        """Loads the lines of data. If lazy is set, only the commands, modal
+        state and Z are parsed up front, enough to split the layers, and the
+        other coordinates when they are accessed: filament_length, the
+        positions and the bounds are then only computed by
+        preprocess_coordinates."""
+        self.lazy = lazy
+        line_class = LazyLine if lazy else Line
+        self.lines = [line_class(l2) for l2 in
                         (l.strip() for l in data)
                       if l2]
-        self._preprocess_lines()
-        self.filament_length = self._preprocess_extrusion()
+        self._preprocess()
+
+    def _preprocess(self, parse = True):
+        """Runs all the preprocessing passes over the freshly loaded lines"""
+        self._preprocess_lines(parse = parse, lazy = self.lazy)
+        if not self.lazy:
+            self.filament_length = self._preprocess_extrusion()
         self._create_layers()
-        self._preprocess_layers()
+        if not self.lazy:
+            self._preprocess_layers()
+
+    def preprocess_coordinates(self):
+        """Runs the extrusion, position and bounds passes lazy loading left
+        out, parsing all the lines"""
+        if self.lazy:
+            self.lazy = False
+            self.filament_length = self._preprocess_extrusion()
+            self._preprocess_layers()
 
     def __len__(self):
         return len(self.line_idxs)
@@ -172,28 +559,289 @@ class GCode(object):
         return self.lines.__iter__()
 
     def append(self, command):
+        """Appends command, preprocessing it from the running state so that
+        the result is the same as if the file had ended with it"""
         command = command.strip()
         if not command:
             return
         gline = Line(command)
+        with self.edit_lock:
+            self._append(gline)
+        return gline
+
+    def _append(self, gline):
         self.lines.append(gline)
+        if self._send_lines is not None:
+            # encoded by the next compute, or by the sender meanwhile
+            self._send_lines.end = len(self.lines)
+        if self.lazy:
+            # preprocess_coordinates does the rest with the other lines
+            self._preprocess_lines([gline])
+            return self._append_layer(gline)
+        if self.blocks is not None:
+            if not self.blocks or self.blocks[-1][0] >= self.block_size:
+                self.blocks.append([0, self._state(), self.total_e, empty_bounds()])
+            block = self.blocks[-1]
         self._preprocess_lines([gline])
-        self._preprocess_extrusion([gline])
-        self.append_layer.append(gline)
-        self.layer_idxs.append(self.append_layer_id)
-        self.line_idxs.append(len(self.append_layer))
+        max_e = self._preprocess_extrusion([gline], self.cur_e, self.total_e)
+        self.filament_length = max(self.filament_length, max_e)
+        self.current, xs, ys, zs = Layer([gline])._preprocess(*self.current)
+        bounds = xs + ys + zs
+        self.bounds = merge_bounds(self.bounds, bounds)
+        self._set_bounds()
+        if self.blocks is not None:
+            block[0] += 1
+            block[2] = max(block[2], max_e)
+            block[3] = merge_bounds(block[3], bounds)
+        return self._append_layer(gline)
+
+    def _append_layer(self, gline):
+        # adds gline, the new last line, to the layers
+        z = layer_zs([gline], self.prev_z)[0]
+        all_layers = self.all_layers
+        if self.prev_z is None:
+            # the first layer of a file is an empty one
+            all_layers.insert(-1, Layer([]))
+            self.all_layers_z.insert(-1, None)
+        if z == self.prev_z:
+            layer_id = len(all_layers) - 2
+        else:
+            # the empty layer at the end becomes the one of the line
+            layer_id = len(all_layers) - 1
+            self.all_layers_z[layer_id] = z
+            self.append_layer_id = len(all_layers)
+            self.append_layer = Layer([])
+            all_layers.append(self.append_layer)
+            self.all_layers_z.append(None)
+        self.prev_z = z
+        all_layers[layer_id].append(gline)
+        self.layer_idxs.append(layer_id)
+        self.line_idxs.append(len(all_layers[layer_id]) - 1)
+        z_lines = self.z_lines.setdefault(z, [])
+        z_lines.append(gline)
+        if z in self.layers:
+            self.layers[z].append(gline)
+        elif gline.is_move and gline.e != None:
+            self.layers[z] = Layer(z_lines)
         return gline
 
-    def _preprocess_lines(self, lines = None):
-        """Checks for G20, G21, G90 and G91, sets imperial and relative flags"""
-        if not lines:
+    def insert(self, i, command):
+        """Inserts command before line i. Only the lines whose preprocessing
+        it changes are preprocessed again, but the layers are rebuilt if it
+        changes which lines are in which layer. Layer durations are not
+        updated until estimate_duration is called again."""
+        command = command.strip()
+        if not command:
+            return
+        if i >= len(self.lines):
+            return self.append(command)
+        gline = Line(command)
+        i = max(i, 0)
+        with self.edit_lock:
+            self.preprocess_coordinates()
+            self._edit(i, gline)
+            self._edited(i, 1)
+        return gline
+
+    def remove(self, i):
+        """Removes line i and returns it, updating the preprocessing as
+        insert does"""
+        if i < 0:
+            i += len(self.lines)
+        with self.edit_lock:
+            gline = self.lines[i]
+            self.preprocess_coordinates()
+            self._edit(i, None)
+            self._edited(i, -1)
+        return gline
+
+    def _edited(self, i, delta):
+        # logs the edit and moves the encoded lines along, with the edit
+        # lock held
+        if not self.edits:
+            self.edits = []
+        self.edits.append((i, delta))
+        if self._send_lines is not None:
+            self._send_lines.edit(i, delta)
+
+    @property
+    def edit_lock(self):
+        """Lock held by insert and remove while the lines and layers are
+        inconsistent, for the threads reading them by index"""
+        if self._edit_lock is None:
+            with edit_locks_lock:
+                if self._edit_lock is None:
+                    self._edit_lock = Lock()
+        return self._edit_lock
+
+    def _state(self):
+        return (self.imperial, self.relative, self.relative_e, self.current_tool,
+                self.cur_e, self.total_e, self.current, self.prev_z)
+
+    def _set_state(self, state):
+        (self.imperial, self.relative, self.relative_e, self.current_tool,
+         self.cur_e, self.total_e, self.current, self.prev_z) = state
+
+    def _run_block(self, lines, state, parse = False):
+        """Redoes the preprocessing passes over lines, starting from state.
+        Returns the state after them, their maximum extruded length and
+        bounds, and the z of the layer of each of them."""
+        self._set_state(state)
+        self._preprocess_lines(lines, parse = parse)
+        max_e = self._preprocess_extrusion(lines, self.cur_e, self.total_e)
+        self.current, xs, ys, zs = Layer(lines)._preprocess(*self.current)
+        line_zs = layer_zs(lines, self.prev_z)
+        if line_zs:
+            self.prev_z = line_zs[-1]
+        return self._state(), max_e, xs + ys + zs, line_zs
+
+    def _build_blocks(self):
+        saved = self._state()
+        state = (False, False, False, 0, 0, 0, (0, 0, 0), None) #before the first line
+        self.blocks = []
+        for start in xrange(0, len(self.lines), self.block_size):
+            lines = self.lines[start:start + self.block_size]
+            end, max_e, bounds, zs = self._run_block(lines, state)
+            self.blocks.append([len(lines), state, max_e, bounds])
+            state = end
+        self._set_state(saved)
+
+    def _edit(self, i, gline):
+        """Inserts gline before line i, or removes line i if gline is None,
+        then preprocesses the blocks of lines from the one of line i until
+        the state at the start of the next one is the same as before"""
+        if self.blocks is None:
+            self._build_blocks()
+        blocks = self.blocks
+        saved = self._state()
+        b = 0
+        start = 0
+        while b < len(blocks) - 1 and start + blocks[b][0] <= i:
+            start += blocks[b][0]
+            b += 1
+        if gline is not None:
+            # the state before line i gives the units of the new line
+            self._run_block(self.lines[start:i], blocks[b][1])
+            parse_line(gline, self.imperial)
+            self.lines.insert(i, gline)
+            blocks[b][0] += 1
+            edited = gline
+        else:
+            edited = self.lines.pop(i)
+            blocks[b][0] -= 1
+        # the following lines are parsed again if the units change
+        parse = edited.command in ("G20", "G21")
+
+        # lines whose layer z was computed again, as (index, z) pairs
+        new_zs = []
+        while True:
+            count, state = blocks[b][:2]
+            end, blocks[b][2], blocks[b][3], zs = \
+                self._run_block(self.lines[start:start + count], state, parse)
+            new_zs.extend(izip(xrange(start, start + count), zs))
+            start += count
+            b += 1
+            if b == len(blocks):
+                saved = end
+                break
+            old = blocks[b][1]
+            if end[:5] + end[6:] == old[:5] + old[6:]:
+                # a change of the extruded length moves the later ones
+                delta = end[5] - old[5]
+                if delta:
+                    for block in blocks[b:]:
+                        block[1] = block[1][:5] + (block[1][5] + delta,) + block[1][6:]
+                        block[2] += delta
+                    saved = saved[:5] + (saved[5] + delta,) + saved[6:]
+                break
+            blocks[b][1] = end
+        self._set_state(saved)
+        self.filament_length = max([0] + [block[2] for block in blocks])
+        self.bounds = reduce(merge_bounds, [block[3] for block in blocks], empty_bounds())
+        self._set_bounds()
+        self._columns = None
+        self._index = None
+        self.line_times = None
+
+        if not self._edit_layers(i, gline, new_zs):
+            self._create_layers()
+
+    def _edit_layers(self, i, gline, new_zs):
+        """Adds gline to the layers before line i, or removes line i from
+        them if gline is None, as long as no other line changes layer.
+        Returns False if they have to be rebuilt instead."""
+        layer_idxs = self.layer_idxs
+        line_idxs = self.line_idxs
+        all_layers_z = self.all_layers_z
+        # layer_idxs and line_idxs still index the lines before the change
+        shift = -1 if gline is not None else 1
+        z = None
+        for k, line_z in new_zs:
+            if k == i and gline is not None:
+                z = line_z
+            elif line_z != all_layers_z[layer_idxs[k if k < i else k + shift]]:
+                return False
+        if gline is not None:
+            if i > 0 and z == all_layers_z[layer_idxs[i - 1]]:
+                layer_id = layer_idxs[i - 1]
+                position = line_idxs[i - 1] + 1
+            elif z == all_layers_z[layer_idxs[i]]:
+                layer_id = layer_idxs[i]
+                position = line_idxs[i]
+            else:
+                return False
+            layer = self.all_layers[layer_id]
+            layer_idxs.insert(i, layer_id)
+            line_idxs.insert(i, position)
+            for k in xrange(i + 1, i + 1 + len(layer) - position):
+                line_idxs[k] += 1
+        else:
+            layer_id = layer_idxs[i]
+            position = line_idxs[i]
+            layer = self.all_layers[layer_id]
+            if len(layer) == 1:
+                return False
+            del layer_idxs[i]
+            del line_idxs[i]
+            for k in xrange(i, i + len(layer) - position - 1):
+                line_idxs[k] -= 1
+        z = all_layers_z[layer_id]
+        z_lines = self.z_lines[z]
+        if gline is not None:
+            layer.insert(position, gline)
+            # the lines at z are in file order
+            if position > 0:
+                z_position = z_lines.index(layer[position - 1]) + 1
+            else:
+                z_position = z_lines.index(layer[1])
+            z_lines.insert(z_position, gline)
+            if z in self.layers:
+                self.layers[z].insert(z_position, gline)
+            elif gline.is_move and gline.e != None:
+                self.layers[z] = Layer(z_lines)
+        else:
+            gline = layer.pop(position)
+            z_position = z_lines.index(gline)
+            del z_lines[z_position]
+            if z in self.layers:
+                del self.layers[z][z_position]
+                if not [l for l in z_lines if l.is_move and l.e != None]:
+                    del self.layers[z]
+        return True
+
+    def _preprocess_lines(self, lines = None, parse = True, lazy = False):
+        """Checks for G20, G21, G90 and G91, sets imperial and relative flags.
+        Also parses the lines unless parse is False, only up to their command
+        for the G moves without Z if lazy is set."""
+        if lines is None:
             lines = self.lines
         imperial = self.imperial
         relative = self.relative
         relative_e = self.relative_e
         current_tool = self.current_tool
         for line in lines:
-            split_raw = split(line)
+            if parse:
+                parse_line(line, imperial, lazy = lazy)
             if not line.command:
                 continue
             if line.is_move:
@@ -216,19 +864,22 @@ class GCode(object):
                 relative_e = True
             elif line.command[0] == "T":
                 current_tool = int(line.command[1:])
-            if line.command[0] == "G":
-                parse_coordinates(line, split_raw, imperial)
         self.imperial = imperial
         self.relative = relative
         self.relative_e = relative_e
         self.current_tool = current_tool
     
-    def _preprocess_extrusion(self, lines = None, cur_e = 0):
-        if not lines:
+    def _preprocess_extrusion(self, lines = None, cur_e = 0, total_e = 0):
+        """Sets the extruding flag of the moves, starting at cur_e and with
+        total_e extruded, keeps the final cur_e and total_e and returns the
+        maximum extruded length"""
+        if lines is None:
             lines = self.lines
+        if len(lines) >= numpy_min_lines:
+            self.cur_e, self.total_e, max_e = preprocess_extrusion(lines, cur_e, total_e)
+            return max_e
 
-        total_e = 0
-        max_e = 0
+        max_e = total_e
         
         for line in lines:
             if line.e == None:
@@ -245,12 +896,15 @@ class GCode(object):
             elif line.command == "G92":
                 cur_e = line.e
 
+        self.cur_e = cur_e
+        self.total_e = total_e
         return max_e
     
     # FIXME : looks like this needs to be tested with list Z on move
     def _create_layers(self):
         layers = {}
         all_layers = []
+        all_layers_z = []
         layer_idxs = []
         line_idxs = []
 
@@ -272,6 +926,7 @@ class GCode(object):
 
             if cur_z != prev_z:
                 all_layers.append(Layer(cur_lines))
+                all_layers_z.append(prev_z)
                 old_lines = layers.get(prev_z, [])
                 old_lines += cur_lines
                 layers[prev_z] = old_lines
@@ -287,10 +942,12 @@ class GCode(object):
 
         if cur_lines:
             all_layers.append(Layer(cur_lines))
+            all_layers_z.append(prev_z)
             old_lines = layers.get(prev_z, [])
             old_lines += cur_lines
             layers[prev_z] = old_lines
 
+        self.z_lines = dict(layers)
         for idx in layers.keys():
             cur_lines = layers[idx]
             has_movement = False
@@ -306,7 +963,10 @@ class GCode(object):
         self.append_layer_id = len(all_layers)
         self.append_layer = Layer([])
         all_layers.append(self.append_layer)
+        all_layers_z.append(None)
         self.all_layers = all_layers
+        self.all_layers_z = all_layers_z
+        self.prev_z = prev_z
         self.layers = layers
         self.layer_idxs = array('I', layer_idxs)
         self.line_idxs = array('I', line_idxs)
@@ -314,9 +974,63 @@ class GCode(object):
     def idxs(self, i):
         return self.layer_idxs[i], self.line_idxs[i]
 
+    def getline(self, i):
+        """Returns the (layer id, line) pair of line i, None past the end"""
+        if i >= len(self.line_idxs):
+            return None
+        layer = self.layer_idxs[i]
+        return layer, self.all_layers[layer][self.line_idxs[i]]
+
+    def available(self, i):
+        """Returns whether getline(i) returns at once, without waiting for
+        line i to be parsed"""
+        return True
+
     def num_layers(self):
         return len(self.layers)
 
+    def columns(self):
+        """Returns the GCodeColumns of the lines, built on first use and
+        again after lines were appended. Needs NumPy."""
+        if self._columns is None or len(self._columns) != len(self.lines):
+            self.preprocess_coordinates()
+            self._columns = GCodeColumns(self)
+        return self._columns
+
+    def index(self):
+        """Returns the GCodeIndex of the layers and lines, built on first use
+        and again after lines were added or removed, estimating the duration
+        first if the line times aren't up to date"""
+        if self._index is None or self._index.count != len(self.lines):
+            if self.line_times is None or len(self.line_times) != len(self.lines):
+                self.estimate_duration()
+            self._index = GCodeIndex(self)
+        return self._index
+
+    def send_lines(self):
+        """Returns the GCodeSendLines of the lines, built on first use and
+        then kept up to date by insert, remove and append. Its compute method
+        encodes the lines."""
+        if self._send_lines is None or self._send_lines.end != len(self.lines):
+            self._send_lines = GCodeSendLines(self)
+        return self._send_lines
+
+    def arc_points(self, start, line, tolerance = arc_tolerance):
+        """Returns the tessellation of line, a G2 or G3 move from start, the
+        (x, y, z) position before it, as tessellate_arc does. Arcs are
+        tessellated once and then kept in arc_cache, so that each renderer
+        doesn't have to do it again."""
+        self.preprocess_coordinates()
+        end = (line.current_x, line.current_y, line.current_z)
+        key = (tuple(start), end, line.i, line.j, line.command, tolerance)
+        if self.arc_cache is None:
+            self.arc_cache = {}
+        points = self.arc_cache.get(key)
+        if points is None:
+            points = self.arc_cache[key] = tessellate_arc(start, end, line.i, line.j,
+                                                          line.command == "G2", tolerance)
+        return points
+
     def _preprocess_layers(self):
         xmin = float("inf")
         ymin = float("inf")
@@ -329,99 +1043,2070 @@ class GCode(object):
         current_y = 0
         current_z = 0
 
-        for l in self.all_layers:
-            (current_x, current_y, current_z), (xm, xM), (ym, yM), (zm, zM) = l._preprocess(current_x, current_y, current_z)
-            xmin = min(xm, xmin)
-            xmax = max(xM, xmax)
-            ymin = min(ym, ymin)
-            ymax = max(yM, ymax)
-            zmin = min(zm, zmin)
-            zmax = max(zM, zmax)
-
-        self.xmin = xmin if not math.isinf(xmin) else 0
-        self.xmax = xmax if not math.isinf(xmax) else 0
-        self.ymin = ymin if not math.isinf(ymin) else 0
-        self.ymax = ymax if not math.isinf(ymax) else 0
-        self.zmin = zmin if not math.isinf(zmin) else 0
-        self.zmax = zmax if not math.isinf(zmax) else 0
+        if len(self.lines) >= numpy_min_lines:
+            # the whole file at once rather than layer by layer
+            self.current, (xmin, xmax), (ymin, ymax), (zmin, zmax) = \
+                preprocess_positions(self.lines, current_x, current_y, current_z)
+        else:
+            for l in self.all_layers:
+                (current_x, current_y, current_z), (xm, xM), (ym, yM), (zm, zM) = l._preprocess(current_x, current_y, current_z)
+                xmin = min(xm, xmin)
+                xmax = max(xM, xmax)
+                ymin = min(ym, ymin)
+                ymax = max(yM, ymax)
+                zmin = min(zm, zmin)
+                zmax = max(zM, zmax)
+            self.current = (current_x, current_y, current_z)
+        self.bounds = [xmin, xmax, ymin, ymax, zmin, zmax]
+        self._set_bounds()
+
+    def _set_bounds(self):
+        self.xmin, self.xmax, self.ymin, self.ymax, self.zmin, self.zmax = \
+            [b if not math.isinf(b) else 0 for b in self.bounds]
         self.width = self.xmax - self.xmin
         self.depth = self.ymax - self.ymin
         self.height = self.zmax - self.zmin
 
-    def estimate_duration(self):
-        lastx = lasty = lastz = laste = lastf = 0.0
-        x = y = z = e = f = 0.0
-        currenttravel = 0.0
-        totaltravel = 0.0
-        moveduration = 0.0
-        totalduration = 0.0
-        acceleration = 1500.0 #mm/s/s  ASSUMING THE DEFAULT FROM SPRINTER !!!!
-        layerduration = 0.0
-        layerbeginduration = 0.0
-        layercount = 0
-        #TODO:
-        # get device caps from firmware: max speed, acceleration/axis (including extruder)
-        # calculate the maximum move duration accounting for above ;)
+    def estimate_duration(self, planner = None):
+        """Sets the duration of each layer and line_times, and returns a
+        summary with the total duration. The moves are timed by planner, a
+        MotionPlanner, if given, and by a rough approximation otherwise."""
+        self.preprocess_coordinates()
+        self._index = None
+        if planner is not None:
+            durations = planner.durations(self)
+            times = numpy.cumsum(durations)
+            self.line_times = array("d", times.tostring())
+            layer_times = numpy.bincount(self.columns().layer, durations, len(self.all_layers))
+            for layer, duration in izip(self.all_layers, layer_times):
+                layer.duration = float(duration)
+            return self._duration_summary(times[-1] if len(times) else 0)
+        state = (0.0, 0.0, 0.0, 0.0, 0.0)
+        times = array("d")
         for layer in self.all_layers:
-            for line in layer:
-                if line.command not in ["G1", "G0", "G4"]:
-                    continue
-                if line.command == "G4":
-                    moveduration = line.p
-                    if not moveduration:
-                        continue
+            layerbeginduration = state[-1]
+            state = time_moves(layer, state, times)
+            layer.duration = state[-1] - layerbeginduration
+
+        self.line_times = times
+        return self._duration_summary(state[-1])
+
+    def duration_summary(self):
+        """Returns the summary estimate_duration returns, only estimating the
+        duration if the line times aren't up to date, as after an edit"""
+        if self.line_times is None or len(self.line_times) != len(self.lines):
+            return self.estimate_duration()
+        return self._duration_summary(self.line_times[-1] if self.line_times else 0)
+
+    def _duration_summary(self, total):
+        return "%d layers, %s" % (len(self.layers), str(datetime.timedelta(seconds = int(total))))
+
+class MappedGCode(GCode):
+    """GCode reading the file through a read only memory map, and keeping
+    only the offset and length of each line in it instead of a copy of its
+    text. The file must be replaced rather than modified in place while the
+    object is in use, unless in_memory is set: the file is then read in a
+    single string instead of being mapped. lazy is the one of GCode.
+    """
+
+    def __init__(self, filename, in_memory = False, lazy = False):
+        if in_memory:
+            self.source = open(filename, "rb").read()
+        else:
+            self.source = map_file(filename)
+        self.lazy = lazy
+        self.lines = self._map_lines()
+        self._preprocess()
+
+    def _map_lines(self):
+        source = self.source
+        make_line = mapped_line_class(source, self.lazy)
+        line_class = LazyLine if self.lazy else Line
+        lines = []
+        for start, length in line_spans(source):
+            if length > 0xffff:
+                lines.append(line_class(source[start:start + length]))
+            else:
+                lines.append(make_line(start, length))
+        return lines
+
+def line_spans(source):
+    """Yields the (offset, length) of the stripped non empty lines of source,
+    a string or a memory map"""
+    if isinstance(source, str):
+        source = StringIO(source)
+    else:
+        source.seek(0)
+    pos = 0
+    for raw in iter(source.readline, ""):
+        stripped = raw.strip()
+        if stripped:
+            # the leading whitespace can't contain stripped[0]
+            yield pos + raw.index(stripped[0]), len(stripped)
+        pos += len(raw)
+
+def map_file(filename):
+    """Returns a read only memory map of filename, or "" if it is empty"""
+    f = open(filename, "rb")
+    try:
+        if os.fstat(f.fileno()).st_size:
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        return ""
+    finally:
+        f.close()
+
+class ParallelGCode(MappedGCode):
+    """MappedGCode tokenizing the file in a pool of processes, each one
+    parsing a byte range of chunk_size bytes. The lines are built from the
+    results of the workers as they come, then the modal state (G90/G91,
+    M82/M83, tool), extrusion, layers and positions are computed by the
+    usual sequential passes. Only worth it for files of hundreds of MB on a
+    machine with several cores.
+    """
+
+    chunk_size = 16 << 20
+
+    def __init__(self, filename, processes = None):
+        self.source = map_file(filename)
+        self.lines = self._parse_chunks(filename, processes)
+        self._preprocess(parse = False)
+
+    def _chunks(self, filename):
+        source = self.source
+        size = len(source)
+        switches = self._unit_switches()
+        start = 0
+        while start < size:
+            end = source.find("\n", start + self.chunk_size) + 1 or size
+            # the unit mode the chunk starts in, so that its lines are parsed
+            # in the right units from the start
+            i = bisect_left(switches, (start,))
+            imperial = switches[i - 1][1] if i else self.imperial
+            yield filename, start, end, imperial
+            start = end
+
+    def _unit_switches(self):
+        """Returns the sorted (offset, imperial) of the G20 and G21 lines,
+        found by parsing the lines with one of them in their text"""
+        source = self.source
+        switches = set()
+        for text in ("G20", "G21", "g20", "g21"):
+            pos = source.find(text)
+            while pos != -1:
+                start = source.rfind("\n", 0, pos) + 1
+                end = source.find("\n", pos)
+                if end == -1:
+                    end = len(source)
+                line = Line(source[start:end].strip())
+                parse_line(line)
+                if line.command in ("G20", "G21"):
+                    switches.add((start, line.command == "G20"))
+                pos = source.find(text, end)
+        return sorted(switches)
+
+    def _parse_chunks(self, filename, processes):
+        lines = []
+        if not self.source:
+            return lines
+        make_line = mapped_line_class(self.source)
+        imperial = self.imperial
+        pool = Pool(processes)
+        try:
+            for chunk in pool.imap(parse_chunk, self._chunks(filename)):
+                imperial = self._add_chunk(lines, make_line, chunk, imperial)
+        finally:
+            pool.terminate()
+            pool.join()
+        return lines
+
+    def _add_chunk(self, lines, make_line, chunk, imperial):
+        """Appends the lines of chunk, coming from parse_chunk, to lines.
+        imperial is the unit mode the chunk starts in, returns the one it
+        ends in."""
+        starts, lengths, names, commands, indices, codes, values, units, end_units, \
+            chunk_imperial = chunk
+        base = len(lines)
+        source = self.source
+        for start, length, command in izip(starts, lengths, commands):
+            if length > 0xffff:
+                line = Line(source[start:start + length])
+            else:
+                line = make_line(start, length)
+            command = names[command]
+            line.command = command
+            line.is_move = command in move_gcodes
+            lines.append(line)
+        # the worker parsed the lines before the first G20/G21 in the unit
+        # mode _chunks found, they are parsed again if it was wrong. Scaling
+        # the values instead would round them twice with GLines.
+        reparsed = units if chunk_imperial != imperial else 0
+        for index, code, value in izip(indices, codes, values):
+            if index >= reparsed:
+                setattr(lines[base + index], gcode_parsed_args[code], value)
+        for line in lines[base:base + reparsed]:
+            parse_line(line, imperial)
+        return imperial if end_units is None else end_units
+
+def parse_chunk(args):
+    """Parses the lines of the (filename, start, end, imperial) byte range
+    for ParallelGCode, starting in inches if imperial is set. Returns arrays
+    of offsets, lengths and command ids of the lines and of the
+    (line index, code, value) of their coordinates, the list of command
+    names, the index of the first G20/G21 line (or the number of lines),
+    the unit mode at the end of the range (None if it's not set in it) and
+    imperial."""
+    filename, start, end, start_imperial = args
+    f = open(filename, "rb")
+    try:
+        f.seek(start)
+        data = f.read(end - start)
+    finally:
+        f.close()
+    starts = array('L')
+    lengths = array('L')
+    names = []
+    ids = {}
+    commands = array('I')
+    indices = array('L')
+    codes = array('B')
+    values = array('d')
+    units = None
+    imperial = start_imperial
+    end_units = None
+    pos = start
+    for raw in data.split("\n"):
+        stripped = raw.strip()
+        if stripped:
+            line = Line(stripped)
+            parse_line(line, imperial)
+            command = line.command
+            if command == "G20" or command == "G21":
+                imperial = end_units = command == "G20"
+                if units is None:
+                    units = len(starts)
+            command_id = ids.get(command)
+            if command_id is None:
+                command_id = ids[command] = len(names)
+                names.append(command)
+            index = len(starts)
+            for code, name in enumerate(gcode_parsed_args):
+                value = getattr(line, name)
+                if value is not None:
+                    indices.append(index)
+                    codes.append(code)
+                    values.append(value)
+            starts.append(pos + raw.index(stripped[0]))
+            lengths.append(len(stripped))
+            commands.append(command_id)
+        pos += len(raw) + 1
+    if units is None:
+        units = len(starts)
+    return starts, lengths, names, commands, indices, codes, values, units, end_units, \
+        start_imperial
+
+# fields of restore_lines, in the order of gcoder_line.set_field
+restore_fields = ("x", "y", "z", "e", "f", "i", "j",
+                  "current_x", "current_y", "current_z")
+
+def py_restore_lines(source, names, starts, lengths, commands, flags, tools,
+                     indices, fields, values):
+    """Same as gcoder_line.restore_lines: builds the lines of source from
+    the sections of a printrun.gcodecache entry, passed as strings"""
+    starts, lengths, indices = [array("I", section) for section in (starts, lengths, indices)]
+    commands = array("I" if len(commands) == 4 * len(lengths) else "H", commands)
+    flags, tools, fields = [array("B", section) for section in (flags, tools, fields)]
+    values = array("d" if Line is PyLine else "f", values)
+    make_line = mapped_line_class(source)
+    lines = []
+    for start, length, command, flag, tool in izip(starts, lengths, commands, flags, tools):
+        if length > 0xffff:
+            line = Line(source[start:start + length])
+        else:
+            line = make_line(start, length)
+        command = names[command]
+        line.command = command
+        line.is_move = command in move_gcodes
+        if flag & 1:
+            line.relative = flag & 2 != 0
+            line.relative_e = flag & 4 != 0
+            line.current_tool = tool
+        if flag & 16:
+            line.extruding = flag & 8 != 0
+        lines.append(line)
+    for index, field, value in izip(indices, fields, values):
+        setattr(lines[index], restore_fields[field], value)
+    return lines
+
+if gcoder_line is not None and hasattr(gcoder_line, "restore_lines"):
+    restore_lines = gcoder_line.restore_lines
+else:
+    restore_lines = py_restore_lines
+
+binary_magic = "PRGB"
+binary_version = 1
+# exact powers of ten, dividing the integer values of the numbers
+binary_scales = [float(10 ** decimals) for decimals in range(16)]
+# restore_lines fields of the coordinates of G-codes
+binary_fields = {"X": 0, "Y": 1, "Z": 2, "E": 3, "F": 4, "I": 5, "J": 6}
+
+def is_binary(data):
+    """Tells whether data starts like the files written by write_binary"""
+    return data[:len(binary_magic)] == binary_magic
+
+def binary_template(raw):
+    """Splits raw into its binary template, (command, ((letter, decimals),
+    ...), comment), and the integer value of each of its numbers, that is
+    the number times 10 ** decimals. Returns None if raw isn't a G, M or T
+    command followed by space separated letter + number words and an ASCII
+    comment."""
+    code = raw.split(";", 1)[0].rstrip()
+    comment = raw[len(code):]
+    if comment:
+        try:
+            comment.decode("ascii")
+        except UnicodeDecodeError:
+            return None
+    words = code.split(" ")
+    command = words[0]
+    if command[:1] not in ("G", "M", "T") or not command[1:].isdigit():
+        return None
+    letters = []
+    values = []
+    for word in words[1:]:
+        integer, dot, fraction = word[1:].partition(".")
+        # the values have to fit in doubles and in int64 deltas
+        if not "A" <= word[:1] <= "Z" or len(word) > 16:
+            return None
+        try:
+            values.append(int(integer + fraction))
+        except ValueError:
+            return None
+        letters.append((word[0], len(fraction)))
+    return (command, tuple(letters), comment), values
+
+def binary_format(template):
+    """Returns the format string giving back the lines of template from
+    their numbers"""
+    command, letters, comment = template
+    return command + "".join(" %s%%.%df" % word for word in letters) + comment.replace("%", "%%")
+
+def write_binary(gcode, f):
+    """Writes the lines of gcode to the file f in the format BinaryGCode
+    loads. Lines are stored as the id of their template, or as text when
+    their template doesn't give them back exactly (parenthesized comments,
+    line numbers, numbers written another way than "%.<decimals>f"...) or
+    isn't used by other lines. Needs NumPy."""
+    splits = []
+    counts = {}
+    formats = {}
+    for line in gcode.lines:
+        raw = line.raw
+        split = binary_template(raw)
+        if split is not None:
+            template, values = split
+            fmt = formats.get(template)
+            if fmt is None:
+                fmt = formats[template] = (binary_format(template),
+                                           [binary_scales[decimals] for letter, decimals in template[1]])
+            if fmt[0] % tuple(map(float.__rdiv__, fmt[1], values)) == raw:
+                counts[template] = counts.get(template, 0) + 1
+            else:
+                split = None
+        splits.append(split)
+
+    templates = [None]
+    template_ids = {}
+    ids = array("H")
+    text = []
+    columns = {}
+    for line, split in izip(gcode.lines, splits):
+        template_id = 0
+        if split is not None and counts[split[0]] > 1:
+            template, values = split
+            template_id = template_ids.get(template)
+            if template_id is None and len(templates) <= 0xffff:
+                template_id = template_ids[template] = len(templates)
+                templates.append(template)
+        if template_id:
+            for (letter, decimals), value in izip(template[1], values):
+                columns.setdefault(letter, []).append(value)
+        else:
+            text.append(line.raw)
+            template_id = 0
+        ids.append(template_id)
+
+    ids = numpy.frombuffer(ids, numpy.uint16)
+    if len(templates) <= 0x100:
+        ids = ids.astype(numpy.uint8)
+    sections = [("template", ids),
+                ("text", numpy.frombuffer("\n".join(text), numpy.uint8))]
+    # the numbers of each letter in file order, as deltas in the smallest
+    # integer type holding them
+    for letter in sorted(columns):
+        values = numpy.array(columns[letter], numpy.int64)
+        deltas = numpy.diff(numpy.concatenate(([0], values)))
+        for dtype in (numpy.int8, numpy.int16, numpy.int32, numpy.int64):
+            info = numpy.iinfo(dtype)
+            if info.min <= deltas.min() and deltas.max() <= info.max:
+                break
+        sections.append((letter, deltas.astype(numpy.dtype(dtype).newbyteorder("<"))))
+    header = {
+        "version": binary_version,
+        "templates": templates,
+        "sections": [(name, a.dtype.str, len(a)) for name, a in sections],
+        # z and line count of each layer but the empty one lines are
+        # appended to
+        "layers": zip(gcode.all_layers_z, map(len, gcode.all_layers))[:-1],
+    }
+    f.write(binary_magic + json.dumps(header) + "\n")
+    for name, a in sections:
+        f.write(a.tostring())
+
+def read_binary(data):
+    """Returns the header of data, the contents of a binary file, and its
+    sections as a name -> NumPy array dict"""
+    if not is_binary(data):
+        raise ValueError("Not a binary G-code file")
+    end = data.index("\n")
+    header = json.loads(data[len(binary_magic):end])
+    if header["version"] != binary_version:
+        raise ValueError("Unsupported binary G-code version %s" % header["version"])
+    sections = {}
+    pos = end + 1
+    for name, dtype, count in header["sections"]:
+        dtype = numpy.dtype(str(dtype))
+        sections[str(name)] = numpy.frombuffer(data, dtype, count, pos)
+        pos += count * dtype.itemsize
+    return header, sections
+
+class BinaryGCode(MappedGCode):
+    """GCode loaded from data, the contents of a file written by
+    write_binary. The header holds the templates of the lines, their
+    command followed by the letter and number of decimals of each word, and
+    the layer table; the sections hold the template id of each line, the
+    text of the lines without one and, for each letter, the integer values
+    of its numbers as deltas. Nothing is parsed: the sections are read with
+    numpy.frombuffer, the numbers set as the coordinates of the lines and
+    the text of the lines rendered back from them. If lazy is set, the
+    extrusion, position and bounds passes are left to preprocess_coordinates
+    as with GCode. Needs NumPy.
+    """
+
+    def __init__(self, data, lazy = False):
+        if numpy is None:
+            raise ImportError("BinaryGCode needs NumPy")
+        header, sections = read_binary(data)
+        templates = [None] + [(str(command), tuple((str(letter), decimals)
+                                                   for letter, decimals in letters), str(comment))
+                              for command, letters, comment in header["templates"][1:]]
+        ids = sections["template"].astype(numpy.intp)
+        count = len(ids)
+        numbers = {}
+        offsets = {}
+        for name, deltas in sections.items():
+            if name in ("template", "text"):
+                continue
+            numbers[name] = numpy.cumsum(deltas, dtype = numpy.int64)
+            # index of the first number of each line in the column
+            per_line = numpy.array([0] + [[letter for letter, decimals in template[1]].count(name)
+                                          for template in templates[1:]], numpy.uint32)[ids]
+            offsets[name] = numpy.cumsum(per_line, dtype = numpy.uint32) - per_line
+
+        raws = [None] * count
+        order = numpy.argsort(ids, kind = "mergesort")
+        ends = numpy.cumsum(numpy.bincount(ids, minlength = len(templates)))
+        indices = []
+        fields = []
+        values = []
+        for template_id in xrange(1, len(templates)):
+            rows = order[ends[template_id - 1]:ends[template_id]]
+            if not len(rows):
+                continue
+            command, letters, comment = template = templates[template_id]
+            seen = {}
+            columns = []
+            for letter, decimals in letters:
+                k = seen[letter] = seen.get(letter, -1) + 1
+                column = numbers[letter][offsets[letter][rows] + k] / binary_scales[decimals]
+                columns.append(column)
+                if command[0] == "G" and letter in binary_fields:
+                    indices.append(rows)
+                    fields.append(numpy.repeat(numpy.uint8(binary_fields[letter]), len(rows)))
+                    values.append(column)
+            fmt = binary_format(template)
+            if columns:
+                texts = [fmt % row for row in izip(*[column.tolist() for column in columns])]
+            else:
+                texts = [fmt] * len(rows)
+            for i, text in izip(rows.tolist(), texts):
+                raws[i] = text
+        rows = order[:ends[0]].tolist()
+        verbatim = []
+        if rows:
+            for i, text in izip(rows, sections["text"].tostring().split("\n")):
+                raws[i] = text
+                line = Line(text)
+                parse_line(line)
+                verbatim.append(line)
+
+        # unit mode of each line, G20 and G21 lines included
+        units = numpy.array([numpy.nan] + [{"G20": 1, "G21": 0}.get(template[0], numpy.nan)
+                                           for template in templates[1:]])[ids]
+        for i, line in izip(rows, verbatim):
+            units[i] = {"G20": 1, "G21": 0}.get(line.command, numpy.nan)
+        imperial = _fill_forward(units) > 0
+        for i, line in izip(rows, verbatim):
+            if imperial[i]:
+                parse_line(line, True)
+        indices = numpy.concatenate(indices or [[]]).astype(numpy.uint32)
+        fields = numpy.concatenate(fields or [[]]).astype(numpy.uint8)
+        values = numpy.concatenate(values or [[]])
+        values *= numpy.where(imperial[indices], 25.4, 1.0)
+
+        lengths = numpy.fromiter(imap(len, raws), numpy.int64, count)
+        starts = numpy.cumsum(lengths + 1) - lengths - 1
+        if count and starts[-1] + lengths[-1] > 0xffffffff:
+            raise ValueError("Binary G-code too large")
+        names = [""] + [template[0] for template in templates[1:]]
+        flags = numpy.array([0] + [template[0] in move_gcodes for template in templates[1:]],
+                            numpy.uint8)[ids]
+        self.source = "\n".join(raws)
+        self.lines = restore_lines(self.source, names,
+                                   starts.astype(numpy.uint32).tostring(),
+                                   lengths.astype(numpy.uint32).tostring(),
+                                   ids.astype(numpy.uint16).tostring(), flags.tostring(),
+                                   numpy.zeros(count, numpy.uint8).tostring(),
+                                   indices.tostring(), fields.tostring(),
+                                   values.astype(numpy.float64 if Line is PyLine else numpy.float32).tostring())
+        for i, line in izip(rows, verbatim):
+            self.lines[i] = line
+
+        extruding = numpy.zeros(count, bool)
+        extruding[indices[fields == binary_fields["E"]]] = True
+        extruding &= flags.astype(bool)
+        for i, line in izip(rows, verbatim):
+            extruding[i] = line.is_move and line.e is not None
+        self._restore_layers(header["layers"], extruding)
+        self._preprocess_lines(parse = False)
+        self.lazy = True
+        if not lazy:
+            self.preprocess_coordinates()
+
+    def _restore_layers(self, table, extruding):
+        # sets up the layers as _create_layers does, from the (z, line count)
+        # of each layer and whether each line is an extruding move
+        counts = numpy.array([count for z, count in table], numpy.intp)
+        if counts.sum() != len(self.lines):
+            raise ValueError("Binary G-code layers don't match its lines")
+        starts = numpy.cumsum(counts) - counts
+        layer_idxs = numpy.repeat(numpy.arange(len(counts), dtype = numpy.uint32), counts)
+        line_idxs = numpy.arange(len(self.lines), dtype = numpy.uint32) \
+            - numpy.repeat(starts, counts).astype(numpy.uint32)
+        extruding = numpy.bincount(layer_idxs, extruding, len(counts)) > 0
+        all_layers = []
+        all_layers_z = []
+        z_lines = {}
+        extruding_z = set()
+        for (z, count), start, extrudes in izip(table, starts.tolist(), extruding):
+            layer = Layer(self.lines[start:start + count])
+            all_layers.append(layer)
+            all_layers_z.append(z)
+            z_lines.setdefault(z, []).extend(layer)
+            if extrudes:
+                extruding_z.add(z)
+        self.z_lines = z_lines
+        self.layers = dict((z, Layer(z_lines[z])) for z in extruding_z)
+        self.prev_z = all_layers_z[-1] if all_layers_z else None
+        self.append_layer_id = len(all_layers)
+        self.append_layer = Layer([])
+        all_layers.append(self.append_layer)
+        all_layers_z.append(None)
+        self.all_layers = all_layers
+        self.all_layers_z = all_layers_z
+        self.layer_idxs = array('I', layer_idxs.tostring())
+        self.line_idxs = array('I', line_idxs.tostring())
+
+class _NotKept(object):
+    """Leaves a GCode method out of GCodeStream, whose lines are not all
+    kept: getting it raises AttributeError, as for a missing attribute"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls = None):
+        raise AttributeError("GCodeStream has no %s, its lines are not kept" % self.name)
+
+class GCodeStream(GCode):
+    """Print queue parsing G-code on the fly from an iterable of lines, such as
+    an open file, for files too big to be loaded at once. The first layer is
+    parsed on creation and the rest by a background thread, which stays at
+    most lookahead lines ahead of the last line read with getline. Lines are
+    dropped once read, so a stream can be printed only once. Its length is
+    estimated from the size of the file until it has been fully parsed.
+    If lazy is set, the lines are parsed as GCode does with lazy, and the
+    filament length, bounds and duration are left out.
+    """
+
+    lines = None # not kept
+    batch_size = 1000
+
+    # the methods working on lines by index other than getline, or on all
+    # of them at once
+    insert = _NotKept("insert")
+    remove = _NotKept("remove")
+    columns = _NotKept("columns")
+    index = _NotKept("index")
+    send_lines = _NotKept("send_lines")
+
+    def __init__(self, data, lookahead = 10000, size = None, lazy = False):
+        self.data = iter(data)
+        self.lazy = lazy
+        self.lookahead = max(lookahead, 2 * self.batch_size)
+        self.size = size
+        if size is None and hasattr(data, "fileno"):
+            try:
+                self.size = os.fstat(data.fileno()).st_size
+            except (OSError, IOError, ValueError):
+                pass
+        self.bytes_read = 0
+        self.parsed = 0 #lines parsed so far
+        self.consumed = 0 #index of the last line read
+        self.started = False
+        self.done = False
+        self.stopped = False
+        self.waiting = False
+        self.base = 0 #index of the first line of the buffer
+        self.buffer = deque() #(layer id, line) pairs parsed ahead
+        self.appended = []
+        self.cv = Condition()
+
+        self.prev_z = None
+        self.cur_z = 0
+        self.layer_id = 0
+        self.layer = []
+        self.heights = set() #z of the layers with extrusion moves
+        self.cur_e = 0
+        self.total_e = 0
+        self.max_e = 0
+        self.extruded = False
+        self.current = (0, 0, 0)
+        self.bounds = empty_bounds()
+        self.timing = (0.0, 0.0, 0.0, 0.0, 0.0) #see time_moves
+        self.timed = 0 #lines timed so far
+
+        # parse the first layer (layer 1, up to the first layer change)
+        # before returning, so that printing can start right away, but no
+        # more than lookahead lines of it: files which don't extrude or
+        # don't change Z can have a single layer
+        while self.layer_id < 2 and self.parsed < self.lookahead:
+            if not self._read(self.batch_size):
+                self._finish()
+                return
+        self.thread = Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        if self.done or not self.size or not self.bytes_read:
+            return self.parsed
+        return max(self.parsed, int(self.parsed * float(self.size) / self.bytes_read))
+
+    def __iter__(self):
+        i = self.base
+        while True:
+            item = self.getline(i)
+            if item is None:
+                return
+            yield item[1]
+            i += 1
+
+    def getline(self, i):
+        """Returns the (layer id, line) pair of line i, waiting for it to be
+        parsed, or None past the end. Lines before i - 1 are dropped.
+        """
+        with self.cv:
+            while i >= self.base + len(self.buffer) and not self.done:
+                self.cv.wait()
+            if i < self.base:
+                raise IndexError("line %d was already dropped from the stream" % i)
+            while self.base < i - 1:
+                self.buffer.popleft()
+                self.base += 1
+            self.started = True
+            self.consumed = max(self.consumed, i)
+            if self.waiting and self.parsed - self.consumed <= self.lookahead - self.batch_size:
+                self.cv.notify_all()
+            if i >= self.base + len(self.buffer):
+                return None
+            return self.buffer[i - self.base]
+
+    def available(self, i):
+        with self.cv:
+            return i < self.base + len(self.buffer) or self.done
+
+    def append(self, command):
+        """Appends command after the end of the stream"""
+        command = command.strip()
+        if not command:
+            return
+        with self.cv:
+            if not self.done:
+                self.appended.append(command)
+                return
+            self._push(self._parse([command]))
+            self.cv.notify_all()
+
+    def close(self):
+        """Stops the background parsing"""
+        with self.cv:
+            self.stopped = True
+            self.cv.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cv:
+                self.waiting = True
+                while not self.stopped and self.parsed - self.consumed > self.lookahead - self.batch_size:
+                    self.cv.wait()
+                self.waiting = False
+                if self.stopped:
+                    return
+            if not self._read(self.batch_size):
+                break
+        self._finish()
+
+    def _read(self, count):
+        """Parses up to count lines of data, returns False at its end"""
+        raws = list(islice(self.data, count))
+        if not raws:
+            return False
+        self.bytes_read += sum(len(raw) for raw in raws)
+        lines = self._parse(raws)
+        with self.cv:
+            self._push(lines)
+            self.cv.notify_all()
+        return True
+
+    def _push(self, lines):
+        self.buffer.extend(lines)
+        self.parsed += len(lines)
+
+    def _parse(self, raws):
+        """Parses lines as GCode does, returns their (layer id, line) pairs"""
+        line_class = LazyLine if self.lazy else Line
+        lines = [line_class(l2) for l2 in (l.strip() for l in raws) if l2]
+        if not lines:
+            return []
+        self._preprocess_lines(lines, lazy = self.lazy)
+        parsed = []
+        for line in lines:
+            if not self.lazy and line.e is not None:
+                if line.is_move:
+                    if line.relative_e:
+                        line.extruding = line.e != 0
+                        self.total_e += line.e
                     else:
-                        moveduration /= 1000.0
+                        line.extruding = line.e != self.cur_e
+                        self.total_e += line.e - self.cur_e
+                        self.cur_e = line.e
+                    self.max_e = max(self.max_e, self.total_e)
+                    self.extruded = self.extruded or line.extruding
+                elif line.command == "G92":
+                    self.cur_e = line.e
+            if line.command == "G92" and line.z != None:
+                self.cur_z = line.z
+            elif line.is_move and line.z != None:
+                if line.relative:
+                    self.cur_z += line.z
                 else:
-                    x = line.x if line.x != None else lastx
-                    y = line.y if line.y != None else lasty
-                    e = line.e if line.e != None else laste
-                    f = line.f / 60.0 if line.f != None else lastf # mm/s vs mm/m => divide by 60
-                    
-                    # given last feedrate and current feedrate calculate the distance needed to achieve current feedrate.
-                    # if travel is longer than req'd distance, then subtract distance to achieve full speed, and add the time it took to get there.
-                    # then calculate the time taken to complete the remaining distance
-
-                    currenttravel = math.hypot(x - lastx, y - lasty)
-                    # FIXME: review this better
-                    # this looks wrong : there's little chance that the feedrate we'll decelerate to is the previous feedrate
-                    # shouldn't we instead look at three consecutive moves ?
-                    distance = 2 * abs(((lastf + f) * (f - lastf) * 0.5) / acceleration)  # multiply by 2 because we have to accelerate and decelerate
-                    if distance <= currenttravel and lastf + f != 0 and f != 0:
-                        # Unsure about this formula -- iXce reviewing this code
-                        moveduration = 2 * distance / (lastf + f)
-                        currenttravel -= distance
-                        moveduration += currenttravel/f
-                    else:
-                        moveduration = math.sqrt(2 * distance / acceleration) # probably buggy : not taking actual travel into account
+                    self.cur_z = line.z
+            if self.cur_z != self.prev_z:
+                self._finish_layer()
+                self.layer_id += 1
+            self.prev_z = self.cur_z
+            self.layer.append(line)
+            parsed.append((self.layer_id, line))
+        return parsed
 
-                totalduration += moveduration
+    def _finish_layer(self):
+        """Updates the bounds and duration with the layer which was being
+        parsed"""
+        if not self.layer:
+            return
+        for l in self.layer:
+            if l.is_move and l.e != None:
+                self.heights.add(self.prev_z)
+                break
+        if not self.lazy:
+            self.current, xs, ys, zs = Layer(self.layer)._preprocess(*self.current)
+            self.bounds = merge_bounds(self.bounds, xs + ys + zs)
+            self.timing = time_moves(self.layer, self.timing, array("d"))
+            self.timed += len(self.layer)
+        self.layer = []
 
-                lastx = x
-                lasty = y
-                laste = e
-                lastf = f
+    def _finish(self):
+        self._finish_layer()
+        self.filament_length = self.max_e
+        self._set_bounds()
+        with self.cv:
+            self._push(self._parse(self.appended))
+            self.appended = []
+            self.done = True
+            self.cv.notify_all()
 
-            layer.duration = totalduration - layerbeginduration
-            layerbeginduration = totalduration
+    def num_layers(self):
+        return len(self.heights)
 
-        return "%d layers, %s" % (len(self.layers), str(datetime.timedelta(seconds = int(totalduration))))
+    def estimate_duration(self):
+        """Returns a summary with the total duration, estimated as GCode does
+        without a planner while the layers are parsed. Until the stream has
+        been fully parsed, it is extrapolated from the layers parsed so far
+        like the length. Lazy streams only give their number of layers."""
+        if self.lazy:
+            return "%d layers" % self.num_layers()
+        duration, timed = self.timing[-1], self.timed
+        if not self.done and timed:
+            duration *= float(len(self)) / timed
+        return "%d layers, %s" % (self.num_layers(), str(datetime.timedelta(seconds = int(duration))))
 
-def main():
-    if len(sys.argv) < 2:
-        print "usage: %s filename.gcode" % sys.argv[0]
-        return
+# Transformation pipeline. A job goes from a source (read_lines) through
+# filters to a sink (write_lines, or stream for printcore, which also
+# serves SD uploads between M28 and M29). Filters are generator functions
+# taking an iterable of parsed lines and yielding lines: the ones they
+# don't change are passed through, the ones they rewrite are new lines, so
+# that the lines of a loaded GCode are never modified. Everything is pulled
+# one line at a time, so a job is processed in bounded memory.
+#
+# The current_x, current_y and current_z of the lines are the positions in
+# the source: filters selecting moves by position, such as exclude_region,
+# have to come before the ones changing the coordinates.
+
+pipeline_batch_size = 1000
+
+# the words with one of the given letters, or parenthesized comments which
+# are left as is, by letters
+word_exps = {}
+line_number_exp = re.compile("^\s*[Nn]-?[0-9]+[ \t]*")
+checksum_exp = re.compile("\*[0-9]*(?=\s*$)")
+
+def read_lines(data):
+    """Source yielding the preprocessed lines of data, a GCode or an
+    iterable of raw lines such as an open file. Raw lines are parsed by
+    batches of pipeline_batch_size, with the modal flags, extruding flag and
+    positions set as GCode would."""
+    if isinstance(data, GCode):
+        if data.lines is None:
+            # GCodeStream, whose lines get their positions when their layer
+            # is finished, which can be after they are read
+            return _read_raw_lines(line.raw for line in data)
+        data.preprocess_coordinates()
+        return iter(data.lines)
+    return _read_raw_lines(iter(data))
+
+def _read_raw_lines(data):
+    for lines in parse_batches(data, pipeline_batch_size):
+        for line in lines:
+            yield line
+
+def parse_batches(data, size):
+    """Yields lists of the lines of data, an iterator over raw lines, parsed
+    and preprocessed as GCode would, size raw lines at a time"""
+    state = GCode.__new__(GCode)
+    while True:
+        raws = list(islice(data, size))
+        if not raws:
+            return
+        lines = [Line(l2) for l2 in (l.strip() for l in raws) if l2]
+        if lines:
+            state._run_block(lines, state._state(), parse = True)
+            yield lines
+
+def pipeline(lines, *filters):
+    """Chains filters over lines, each filter being a function taking an
+    iterable of lines and returning one, such as functools.partial of the
+    filters below"""
+    for f in filters:
+        lines = f(lines)
+    return lines
+
+def copy_line(line, raw, imperial = False):
+    """Returns a line for raw, parsed in inches if imperial is set, with the
+    modal flags, extruding flag and position of line"""
+    new = Line(raw)
+    parse_line(new, imperial)
+    for name in ("relative", "relative_e", "extruding", "current_tool",
+                 "current_x", "current_y", "current_z"):
+        value = getattr(line, name)
+        if value is not None:
+            setattr(new, name, value)
+    return new
+
+def format_number(value):
+    """Formats value as a G-code word argument, with up to 5 decimals"""
+    text = ("%.5f" % value).rstrip("0").rstrip(".")
+    return "0" if text in ("-0", "") else text
+
+def rewrite_words(line, letters, convert, imperial = False):
+    """Returns a copy of line where the words of its command part with one
+    of letters are replaced by convert(letter, value), letter being
+    uppercase and value the float in the units of the file. convert returns
+    None to keep a word. Returns line itself if no word changed, otherwise
+    the copy loses the line number and checksum line may have, which would
+    no longer match."""
+    exp = word_exps.get(letters)
+    if exp is None:
+        exp = re.compile("\([^\(\)]*\)|([%s%s])[ \t]*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))"
+                         % (letters, letters.lower()))
+        word_exps[letters] = exp
+    body, sep, comment = line.raw.partition(";")
+    changed = []
+    def replace(match):
+        if match.group(1) is None:
+            return match.group(0)
+        value = convert(match.group(1).upper(), float(match.group(2)))
+        if value is None:
+            return match.group(0)
+        changed.append(match.group(1))
+        return match.group(1) + format_number(value)
+    body = exp.sub(replace, body)
+    if not changed:
+        return line
+    body = line_number_exp.sub("", checksum_exp.sub("", body))
+    return copy_line(line, body + sep + comment, imperial)
+
+def _units(line, imperial):
+    """Returns whether the lines after line are in inches, imperial telling
+    if the ones before it are"""
+    if line.command == "G20":
+        return True
+    if line.command == "G21":
+        return False
+    return imperial
+
+def offset(lines, x = 0, y = 0, z = 0):
+    """Filter moving the absolute moves by x, y and z millimeters"""
+    offsets = dict((letter, value) for letter, value in zip("XYZ", (x, y, z)) if value)
+    imperial = False
+    for line in lines:
+        imperial = _units(line, imperial)
+        if offsets and line.is_move and not line.relative:
+            unit = 25.4 if imperial else 1
+            line = rewrite_words(line, "".join(offsets), lambda letter, value:
+                                 value + offsets[letter] / unit, imperial)
+        yield line
+
+def scale(lines, xy = 1, z = 1, e = None):
+    """Filter scaling the X, Y, I and J of the moves and G92s by xy and their
+    Z by z. The E are scaled by e, by default xy * z: paths get xy times
+    longer and layers z times thicker."""
+    if e is None:
+        e = xy * z
+    factors = {"X": xy, "Y": xy, "I": xy, "J": xy, "Z": z, "E": e}
+    letters = "".join(letter for letter, factor in factors.items() if factor != 1)
+    imperial = False
+    for line in lines:
+        imperial = _units(line, imperial)
+        if letters and (line.is_move or line.command == "G92"):
+            line = rewrite_words(line, letters, lambda letter, value:
+                                 value * factors[letter], imperial)
+        yield line
+
+def feed_override(lines, factor):
+    """Filter multiplying the feedrates of the moves by factor"""
+    imperial = False
+    for line in lines:
+        imperial = _units(line, imperial)
+        if line.is_move:
+            line = rewrite_words(line, "F", lambda letter, value:
+                                 value * factor, imperial)
+        yield line
+
+def excluded_move(line, rectangles):
+    """Tells if line is a move in the XY plane ending within one of the
+    (x0, y0, x1, y1) rectangles"""
+    if not line.is_move or (line.x is None and line.y is None):
+        return False
+    for (x0, y0, x1, y1) in rectangles:
+        if x0 <= line.current_x <= x1 and y0 <= line.current_y <= y1:
+            return True
+    return False
+
+def exclude_line(line, next_line, rectangles):
+    """Returns what to send instead of line, next_line being the line after
+    it, to skip the moves ending in rectangles: line itself if it is not
+    excluded, a G92 setting the E the excluded move would have reached if
+    the next move doesn't set it, or None"""
+    if not excluded_move(line, rectangles):
+        return line
+    if next_line is not None and excluded_move(next_line, rectangles) \
+       and next_line.e is not None and not next_line.relative_e:
+        return None # the next move will set the absolute E if needed
+    if line.e is not None and not line.relative_e:
+        g92 = Line("G92 E%.5f" % line.e)
+        parse_line(g92)
+        return g92
+    return None
+
+def exclude_region(lines, rectangles):
+    """Filter dropping the moves ending in one of the (x0, y0, x1, y1)
+    rectangles, keeping the absolute E in sync (see exclude_line)"""
+    lines = iter(lines)
+    line = next(lines, None)
+    while line is not None:
+        next_line = next(lines, None)
+        line = exclude_line(line, next_line, rectangles)
+        if line is not None:
+            yield line
+        line = next_line
+
+def strip_comments(lines):
+    """Filter removing the comments, and the lines which are only comments,
+    keeping the host commands (;@pause)"""
+    imperial = False
+    for line in lines:
+        imperial = _units(line, imperial)
+        raw = line.raw
+        if ";" not in raw or raw.lstrip().startswith(";@"):
+            yield line
+            continue
+        payload = raw.split(";")[0].rstrip()
+        if payload:
+            yield copy_line(line, payload, imperial)
+
+def renumber(lines, start = 1, checksum = False):
+    """Filter numbering the lines with a command from start on, replacing
+    their line numbers and checksums, and dropping their comments. If
+    checksum is set, a checksum is added to each numbered line as printcore
+    does."""
+    imperial = False
+    lineno = start
+    for line in lines:
+        imperial = _units(line, imperial)
+        payload = line_number_exp.sub("", checksum_exp.sub("", line.raw.split(";")[0])).rstrip()
+        if not payload or line.raw.lstrip().startswith(";@"):
+            yield line
+            continue
+        raw = "N%d %s" % (lineno, payload)
+        if checksum:
+            raw = "%s*%d" % (raw, reduce(xor, map(ord, raw)))
+        yield copy_line(line, raw, imperial)
+        lineno += 1
+
+def prefetch(lines, size = 10000):
+    """Returns an iterator over lines, which are read up to size lines ahead
+    by a background thread, so that filters run ahead of the consumer"""
+    batches = Queue(max(1, size // pipeline_batch_size))
+    stopped = []
+    def produce():
+        try:
+            it = iter(lines)
+            while not stopped:
+                batch = list(islice(it, pipeline_batch_size))
+                batches.put((batch, None))
+                if not batch:
+                    return
+        except Exception, e:
+            batches.put((None, e))
+    thread = Thread(target = produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            batch, error = batches.get()
+            if error is not None:
+                raise error
+            if not batch:
+                return
+            for line in batch:
+                yield line
+    finally:
+        # let the producer finish its pending put and stop
+        stopped.append(True)
+        while thread.is_alive():
+            try:
+                batches.get_nowait()
+            except QueueEmpty:
+                thread.join(0.01)
+
+def write_lines(lines, f):
+    """Sink writing the text of lines to the file f, returns their count"""
+    count = 0
+    for line in lines:
+        f.write(line.raw + "\n")
+        count += 1
+    return count
+
+def stream(lines, lookahead = 10000):
+    """Sink returning a GCodeStream over lines, which printcore.startprint
+    prints. The stream parses the text of the output again, so that the
+    positions and extrusion it tracks are the ones of what is sent, and runs
+    the filters on its background thread ahead of the sender."""
+    return GCodeStream(imap(attrgetter("raw"), lines), lookahead)
+
+class GCodeIndex(object):
+    """Sorted arrays over the layers and lines of a GCode, answering seek and
+    progress queries by bisection. Like GCodeColumns, it has to be rebuilt
+    when the lines change (see GCode.index).
+
+    heights: sorted z of the layers with extrusion, the keys of GCode.layers
+    height_layers: index in GCode.all_layers of the first layer at each height
+    starts: first line of each layer of GCode.all_layers, then the line count
+    times: estimated time at the end of each line, in seconds
+    """
+
+    def __init__(self, gcode):
+        self.count = len(gcode.lines)
+        self.starts = array("I", [0])
+        for layer in gcode.all_layers:
+            self.starts.append(self.starts[-1] + len(layer))
+        self.heights = sorted(gcode.layers.keys())
+        first_layers = {}
+        for layer_id, z in enumerate(gcode.all_layers_z):
+            if z in gcode.layers and z not in first_layers:
+                first_layers[z] = layer_id
+        self.height_layers = array("I", [first_layers[z] for z in self.heights])
+        self.times = gcode.line_times
+        self.total = self.times[-1] if self.times else 0
+
+    def layer_range(self, layer_id):
+        """Returns the first line of GCode.all_layers[layer_id] and the one
+        after its last"""
+        return self.starts[layer_id], self.starts[layer_id + 1]
+
+    def height_at(self, z):
+        """Returns the number of the layer z is in, the highest one whose
+        height is at most z, or -1 below the first one"""
+        return bisect_right(self.heights, z) - 1
+
+    def height_start(self, n):
+        """Returns the first line of layer n, where to resume printing it"""
+        return self.starts[self.height_layers[n]]
+
+    def seek_z(self, z):
+        """Returns the first line of the lowest layer at z or above, None if
+        all of them are below z"""
+        n = bisect_left(self.heights, z)
+        if n == len(self.heights):
+            return None
+        return self.height_start(n)
+
+    def seek_time(self, t):
+        """Returns the line being run t seconds into the print, the line
+        count once it's over"""
+        return bisect_right(self.times, t)
+
+    def time_at(self, i):
+        """Returns the estimated time before line i"""
+        i = min(i, len(self.times))
+        return self.times[i - 1] if i > 0 else 0
+
+    def remaining(self, i):
+        """Returns the estimated time from line i to the end"""
+        return self.total - self.time_at(i)
+
+    def progress(self, i):
+        """Returns the fraction of the estimated time spent before line i,
+        or of the lines if there are no moves"""
+        if self.total:
+            return self.time_at(i) / self.total
+        return float(min(i, self.count)) / self.count if self.count else 0
+
+# kinds of lines for the sender
+LINE_SEND = 0
+LINE_SKIP = 1 #only comments
+LINE_HOST_COMMAND = 2 #;@pause
+
+paren_comment_exp = re.compile("\([^\(\)]*\)")
+
+def encode_line(raw):
+    """Returns the (kind, payload, checksum) triplet of a G-code line, where
+    payload is the line stripped from its comment and checksum the XOR of its
+    characters, which printcore combines with the one of the line number.
+    Lines made of (comments) only, as Skeinforge writes, are skipped too.
+    """
+    if raw.lstrip().startswith(";@"):
+        return (LINE_HOST_COMMAND, raw, 0)
+    payload = raw.split(";")[0]
+    if not payload or (payload.lstrip()[:1] == "(" and
+                       not paren_comment_exp.sub("", payload).strip()):
+        return (LINE_SKIP, "", 0)
+    return (LINE_SEND, payload, reduce(xor, map(ord, payload)))
+
+class GCodeSendLines(object):
+    """The lines of a GCode as printcore sends them: the kind of each line
+    and the payload and checksum of the ones to send, stored by chunks of
+    contiguous payloads, plus the indices of the lines which are not
+    skipped, so that the sender steps over comments at once. Lines are
+    encoded up to end, the length of the GCode, by compute, which can run
+    on a background thread while get and next_index are used for the lines
+    already done. Inserting or removing a line splits the run
+    of encoded lines around it and moves the following ones, so that the
+    lines are never encoded again (see GCode.insert); a line inserted among
+    the encoded ones is left to the sender.
+
+    pieces: (start, count, base, chunk) of each run of encoded lines, lines
+    start to start + count being lines base to base + count of chunk
+    starts: the start of each piece, for bisection
+    """
+
+    chunk_size = 4096
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+        self.end = len(gcode.lines)
+        self.ready = 0 #first line left to encode
+        self.pieces = []
+        self.starts = []
+        self.encoding = None #end of the lines compute is encoding, if still unedited
+        self.stop = False
+        self.lock = Lock()
+
+    def compute(self, count = None):
+        """Encodes the lines not done yet, or only the next count chunks of
+        them, until stop is set. Returns True once all lines are done."""
+        with self.lock:
+            self.stop = False
+            while not self.stop and count != 0:
+                # the lines are edited under the edit lock, only taken to
+                # read them and to add the chunk
+                with self.gcode.edit_lock:
+                    if self.ready >= self.end:
+                        break
+                    lines = self.gcode.lines[self.ready:min(self.ready + self.chunk_size, self.end)]
+                    self.encoding = self.ready + len(lines)
+                payloads = []
+                offsets = array('I', [0])
+                checksums = array('B')
+                kinds = array('B')
+                indices = array('I')
+                pos = 0
+                for i, gline in enumerate(lines):
+                    kind, payload, checksum = encode_line(gline.raw)
+                    if kind == LINE_SEND:
+                        payloads.append(payload)
+                        pos += len(payload)
+                    if kind != LINE_SKIP:
+                        indices.append(i)
+                    offsets.append(pos)
+                    checksums.append(checksum)
+                    kinds.append(kind)
+                chunk = ("".join(payloads), offsets, checksums, kinds, indices)
+                with self.gcode.edit_lock:
+                    # the lines up to the first one edited meanwhile are
+                    # still the ones starting at ready
+                    done = self.encoding - self.ready
+                    if done > 0:
+                        self.pieces.append((self.ready, done, 0, chunk))
+                        self.starts.append(self.ready)
+                        self.ready += done
+                    self.encoding = None
+                if count is not None:
+                    count -= 1
+        return self.ready >= self.end
+
+    def edit(self, i, delta):
+        """Follows the insertion (delta 1) or removal (delta -1) of line i,
+        with the edit lock of the GCode held"""
+        self.end += delta
+        if i >= self.ready:
+            if self.encoding is not None:
+                self.encoding = min(self.encoding, i)
+            return
+        pieces = []
+        for start, count, base, chunk in self.pieces:
+            if start + count <= i:
+                pieces.append((start, count, base, chunk))
+            elif start > i or (start == i and delta > 0):
+                pieces.append((start + delta, count, base, chunk))
+            else:
+                # split around line i
+                head = i - start
+                if head:
+                    pieces.append((start, head, base, chunk))
+                if delta > 0:
+                    pieces.append((i + 1, count - head, base + head, chunk))
+                elif count - head > 1:
+                    pieces.append((i, count - head - 1, base + head + 1, chunk))
+        self.pieces = pieces
+        self.starts = [piece[0] for piece in pieces]
+        self.ready += delta
+        if self.encoding is not None:
+            self.encoding += delta
+
+    def get(self, i):
+        """Returns the encoded line at queue index i, or None if it is not
+        available (yet)
+        """
+        if not 0 <= i < self.ready:
+            return None
+        k = bisect_right(self.starts, i) - 1
+        if k < 0:
+            return None
+        start, count, base, chunk = self.pieces[k]
+        if i >= start + count:
+            # inserted since
+            return None
+        data, offsets, checksums, kinds, indices = chunk
+        j = base + i - start
+        return (kinds[j], data[offsets[j]:offsets[j + 1]], checksums[j])
+
+    def next_index(self, i):
+        """Returns the index of the first line from i on which is not
+        skipped, or the first one which isn't encoded"""
+        if not 0 <= i < self.ready:
+            return i
+        k = bisect_right(self.starts, i) - 1
+        if k < 0:
+            return i
+        pieces = self.pieces
+        while k < len(pieces):
+            start, count, base, chunk = pieces[k]
+            if not start <= i < start + count:
+                return i
+            indices = chunk[4]
+            j = bisect_left(indices, base + i - start)
+            if j < len(indices) and indices[j] < base + count:
+                return indices[j] - base + start
+            i = start + count
+            k += 1
+        return i
+
+class GCodeColumns(object):
+    """Struct of arrays copy of the lines of a GCode: one NumPy array per
+    field, NaN standing for None in the float ones, so that whole files can
+    be processed without going through the line objects. The lines stay the
+    reference, these arrays have to be rebuilt when they change (see
+    GCode.columns).
+
+    x, y, z, e, f, i, j, current_x, current_y, current_z: float32
+    command: uint16 index in commands (uint32 past 65536 distinct commands),
+    command_ids is the reverse mapping
+    flags: uint8, or of the is_move, relative, relative_e, extruding bits
+    tool: uint8 current tool of moves
+    layer: uint32 index in GCode.all_layers
+    """
+
+    is_move = 1
+    relative = 2
+    relative_e = 4
+    extruding = 8
+
+    float_fields = ("x", "y", "z", "e", "f", "i", "j",
+                    "current_x", "current_y", "current_z")
+
+    def __init__(self, gcode, lines = None, exact = False):
+        """Columns of the lines of gcode, or of lines, a list of preprocessed
+        lines, which are then all in layer 0 and gcode can be None. If exact
+        is set, the float fields of PyLines are float64, so that they hold
+        their values to the last bit."""
+        if numpy is None:
+            raise ImportError("GCodeColumns needs NumPy")
+        if lines is None:
+            lines = gcode.lines
+        count = len(lines)
+        for name in self.float_fields:
+            setattr(self, name, numpy.empty(count, numpy.float32))
+        self.flags = numpy.empty(count, numpy.uint8)
+        self.tool = numpy.empty(count, numpy.uint8)
+        try:
+            gcoder_line.fill_columns(lines, *[getattr(self, name) for name in
+                                              self.float_fields + ("flags", "tool")])
+        except (AttributeError, TypeError): # no extension or PyLines
+            if exact:
+                for name in self.float_fields:
+                    setattr(self, name, numpy.empty(count, numpy.float64))
+            self._fill(lines)
+        self.commands = []
+        self.command_ids = {}
+        command = [self._command_id(command) for command in map(attrgetter("command"), lines)]
+        self.command = numpy.array(command, numpy.uint16 if len(self.commands) <= 0x10000
+                                   else numpy.uint32)
+        if gcode is None:
+            self.layer = numpy.zeros(count, numpy.uint32)
+            self.layer_count = 1
+        else:
+            self.layer = numpy.frombuffer(gcode.layer_idxs, numpy.uint32)[:len(lines)].copy()
+            self.layer_count = len(gcode.all_layers)
+
+    def __len__(self):
+        return len(self.command)
+
+    def _fill(self, lines):
+        # None converts to NaN for float dtypes and to False for bool
+        floats = numpy.array(map(attrgetter(*self.float_fields), lines), self.x.dtype)
+        floats = floats.reshape(-1, len(self.float_fields))
+        for i, name in enumerate(self.float_fields):
+            getattr(self, name)[:] = floats[:, i]
+        self.flags[:] = 0
+        columns = zip(*map(attrgetter("is_move", "relative", "relative_e", "extruding",
+                                      "current_tool"), lines)) or ((),) * 5
+        for flag, values in zip((self.is_move, self.relative, self.relative_e, self.extruding),
+                                columns):
+            self.flags[numpy.array(values, bool)] |= flag
+        self.tool[:] = numpy.nan_to_num(numpy.array(columns[4], numpy.float32))
+
+    def _command_id(self, command):
+        command_id = self.command_ids.get(command)
+        if command_id is None:
+            command_id = self.command_ids[command] = len(self.commands)
+            self.commands.append(command)
+        return command_id
+
+    def where(self, *commands):
+        """Returns the mask of the lines running one of commands"""
+        mask = numpy.zeros(len(self), bool)
+        for command in commands:
+            if command in self.command_ids:
+                mask |= self.command == self.command_ids[command]
+        return mask
+
+    def moves(self):
+        """Returns the indices of the moves"""
+        return numpy.flatnonzero(self.flags & self.is_move)
+
+    def bounds(self):
+        """Returns ((xmin, xmax), (ymin, ymax), (zmin, zmax)) of the
+        extruding moves, as computed by GCode._preprocess_layers"""
+        bounds = _positions(self, 0, 0, 0)[2]
+        return tuple(tuple(b if not math.isinf(b) else 0 for b in axis) for axis in bounds)
+
+    def filament_length(self):
+        """Returns the filament length, as computed by
+        GCode._preprocess_extrusion"""
+        return _extrusion(self, 0, 0)[4]
+
+    def layer_z(self):
+        """Returns the Z each line is at, as tracked by GCode._create_layers
+        to split layers"""
+        z = self.z.astype(numpy.float64)
+        has_z = ~numpy.isnan(z)
+        move = has_z & ((self.flags & self.is_move) != 0)
+        relative = (self.flags & self.relative) != 0
+        sets = (move & ~relative) | (has_z & self.where("G92"))
+        offset = numpy.cumsum(numpy.where(move & relative, z, 0))
+        last = numpy.where(sets, numpy.arange(len(z)), -1)
+        numpy.maximum.accumulate(last, out = last)
+        base = numpy.where(last >= 0, z[last] - offset[last], 0)
+        return base + offset
+
+    def layer_ids(self):
+        """Returns the layer index of each line, as GCode.layer_idxs before
+        any append"""
+        z = self.layer_z()
+        changes = numpy.ones(len(z), numpy.uint32)
+        changes[1:] = z[1:] != z[:-1]
+        return numpy.cumsum(changes, dtype = numpy.uint32)
+
+    def num_layers(self):
+        """Returns the number of distinct Z with extruding moves, as
+        GCode.num_layers"""
+        z = self.layer_z()
+        mask = ((self.flags & self.is_move) != 0) & ~numpy.isnan(self.e)
+        return len(numpy.unique(z[mask]))
+
+    def duration(self, acceleration = 1500.0):
+        """Returns the total duration and the duration of each layer in
+        seconds, as computed by GCode.estimate_duration but without the G4
+        dwells"""
+        rows = numpy.flatnonzero(self.where("G0", "G1", "G2", "G3"))
+        x = _fill_forward(self.x[rows].astype(numpy.float64))
+        y = _fill_forward(self.y[rows].astype(numpy.float64))
+        f = _fill_forward(self.f[rows].astype(numpy.float64)) / 60.0
+        lastx = numpy.concatenate(([0], x[:-1]))
+        lasty = numpy.concatenate(([0], y[:-1]))
+        lastf = numpy.concatenate(([0], f[:-1]))
+        travel = numpy.hypot(x - lastx, y - lasty)
+        arcs = numpy.flatnonzero(self.where("G2", "G3")[rows])
+        if len(arcs):
+            cx, cy, radius, start, sweep = _arc_arrays(lastx[arcs], lasty[arcs], x[arcs], y[arcs],
+                                                       self.i[rows[arcs]], self.j[rows[arcs]],
+                                                       self.where("G2")[rows[arcs]])
+            travel[arcs] = radius * numpy.abs(sweep)
+        distance = 2 * numpy.abs(((lastf + f) * (f - lastf) * 0.5) / acceleration)
+        cruise = (distance <= travel) & (lastf + f != 0) & (f != 0)
+        # only compute the cruise branch where it doesn't divide by zero
+        safe_f = numpy.where(cruise, f, 1)
+        durations = numpy.where(cruise,
+                                2 * distance / numpy.where(cruise, lastf + f, 1) + (travel - distance) / safe_f,
+                                numpy.sqrt(2 * distance / acceleration))
+        layers = numpy.bincount(self.layer[rows], durations, self.layer_count)
+        return float(durations.sum()), layers
+
+class MotionPlanner(object):
+    """Estimates how long a firmware with a Marlin like planner takes to run
+    each line: moves follow trapezoidal speed profiles within per axis
+    feedrate and acceleration limits, corners are taken at the speed the
+    junction deviation allows, and as the firmware only plans buffer_size
+    moves ahead, it must be able to stop at the end of the last one. Moves
+    start from rest after commands waiting for the moves to finish, such as
+    G4 or M109. Arcs are single moves along their length, whose speed is
+    also limited by the centripetal acceleration. Settings are given as
+    keyword arguments; M204 lines change the accelerations. Speeds are in
+    mm/s, accelerations in mm/s/s, axes in X, Y, Z, E order. Needs NumPy.
+    """
+
+    max_feedrate = (500.0, 500.0, 5.0, 25.0)
+    max_acceleration = (3000.0, 3000.0, 100.0, 10000.0)
+    acceleration = 1500.0 #of extruding moves, M204 P or S
+    travel_acceleration = 1500.0 #of the other moves, M204 T or S
+    retract_acceleration = 3000.0 #of moves of E alone, M204 R
+    junction_deviation = 0.05 #mm
+    buffer_size = 16
+    feedrate = 1500.0 #mm/min, until the first F
+
+    # commands after which moves start from rest
+    sync_commands = ("G4", "G28", "M0", "M1", "M109", "M190", "M400")
+
+    def __init__(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(MotionPlanner, name):
+                raise TypeError("unknown MotionPlanner setting %s" % name)
+            setattr(self, name, value)
+
+    def durations(self, gcode):
+        """Returns the NumPy array of the duration of each line of gcode"""
+        columns = gcode.columns()
+        times = numpy.zeros(len(columns))
+        lines, deltas, paths, radii, directions, feedrates = self._moves(columns)
+        if len(lines):
+            distances, speeds, accelerations = self._limits(gcode, lines, deltas, paths,
+                                                            radii, feedrates)
+            entry = self._plan(columns, lines, directions, distances, speeds, accelerations)
+            exit = numpy.append(entry[1:], 0)
+            # trapezoids, or triangles when the cruise speed isn't reached
+            peak = numpy.minimum(speeds ** 2, accelerations * distances + (entry + exit) / 2)
+            peak = numpy.maximum(peak, numpy.maximum(entry, exit))
+            cruise = distances - (2 * peak - entry - exit) / (2 * accelerations)
+            peak = numpy.sqrt(peak)
+            times[lines] = (2 * peak - numpy.sqrt(entry) - numpy.sqrt(exit)) / accelerations \
+                           + numpy.maximum(cruise, 0) / peak
+        for i in numpy.flatnonzero(columns.where("G4")):
+            line = gcode.lines[i]
+            p, s = P(line), S(line)
+            times[i] += p / 1000.0 if p else s or 0
+        return times
+
+    def _moves(self, columns):
+        """Returns the lines of the moves of columns with a length, the X, Y,
+        Z and E distance between their ends, their length in the XY plane,
+        their radius (infinite for straight moves), their direction at both
+        ends and their feedrate in mm/s"""
+        is_move = columns.where("G0", "G1", "G2", "G3")
+        g92 = columns.where("G92")
+        g28 = columns.where("G28")
+        events = numpy.flatnonzero(is_move | g92 | g28)
+        is_move = is_move[events]
+        g92 = g92[events]
+        g28 = g28[events]
+        flags = columns.flags[events]
+        values = [getattr(columns, name)[events].astype(numpy.float64) for name in "xyze"]
+        homes_all = g28 & numpy.isnan(values[0]) & numpy.isnan(values[1]) & numpy.isnan(values[2])
+        indices = numpy.arange(len(events))
+        positions = []
+        for axis, value in enumerate(values):
+            present = ~numpy.isnan(value)
+            relative = (flags & (columns.relative_e if axis == 3 else columns.relative)) != 0
+            homed = g28 & (present | homes_all) if axis < 3 else numpy.zeros(len(events), bool)
+            # absolute moves, G92 and G28 set the position, relative moves
+            # add to it
+            sets = (is_move & ~relative & present) | (g92 & present) | homed
+            offset = numpy.cumsum(numpy.where(is_move & relative & present, value, 0))
+            last = numpy.where(sets, indices, -1)
+            numpy.maximum.accumulate(last, out = last)
+            base = numpy.where(homed, 0, value)
+            positions.append(numpy.where(last >= 0, base[last] - offset[last], 0) + offset)
+        positions = numpy.column_stack(positions)
+        starts = numpy.vstack((numpy.zeros((1, 4)), positions[:-1]))[is_move]
+        deltas = positions[is_move] - starts
+        lines = events[is_move]
+        # F0 is ignored, as by firmwares
+        feedrates = columns.f[lines].astype(numpy.float64)
+        with numpy.errstate(invalid = "ignore"):
+            feedrates[feedrates <= 0] = numpy.nan
+        feedrates = _fill_forward(feedrates, self.feedrate) / 60.0
+        paths = numpy.hypot(deltas[:, 0], deltas[:, 1])
+        radii = numpy.empty(len(lines))
+        radii.fill(numpy.inf)
+        entry = deltas.copy()
+        exit = deltas.copy()
+        arcs = numpy.flatnonzero(columns.where("G2", "G3")[lines])
+        if len(arcs):
+            rows = lines[arcs]
+            clockwise = columns.where("G2")[rows]
+            cx, cy, radius, angle, sweep = _arc_arrays(starts[arcs, 0], starts[arcs, 1],
+                                                       starts[arcs, 0] + deltas[arcs, 0],
+                                                       starts[arcs, 1] + deltas[arcs, 1],
+                                                       columns.i[rows], columns.j[rows], clockwise)
+            paths[arcs] = radius * numpy.abs(sweep)
+            radii[arcs] = radius
+            # tangents at both ends, scaled to the length like the deltas
+            sign = numpy.where(clockwise, -1, 1) * paths[arcs]
+            for directions, end_angle in ((entry, angle), (exit, angle + sweep)):
+                directions[arcs, 0] = -numpy.sin(end_angle) * sign
+                directions[arcs, 1] = numpy.cos(end_angle) * sign
+        # moves of less than a micron are dropped, as moves of less than a
+        # step are by firmwares
+        moving = (numpy.abs(deltas) > 1e-3).any(axis = 1) | (paths > 1e-3)
+        return lines[moving], deltas[moving], paths[moving], radii[moving], \
+               (entry[moving], exit[moving]), feedrates[moving]
+
+    def _limits(self, gcode, lines, deltas, paths, radii, feedrates):
+        """Returns the length, cruise speed and acceleration of the moves"""
+        xyz = numpy.hypot(paths, deltas[:, 2])
+        e_only = xyz <= 1e-3
+        distances = numpy.where(e_only, numpy.abs(deltas[:, 3]), xyz)
+        # accelerations of each kind of move, as set by M204 lines
+        m204 = numpy.flatnonzero(gcode.columns().where("M204"))
+        settings = [[self.acceleration], [self.travel_acceleration], [self.retract_acceleration]]
+        for i in m204:
+            line = gcode.lines[i]
+            s = find_specific_code(line, "S")
+            for setting, value in zip(settings, (find_specific_code(line, "P") or s,
+                                                 find_specific_code(line, "T") or s,
+                                                 find_specific_code(line, "R"))):
+                setting.append(value if value else setting[-1])
+        current = numpy.searchsorted(m204, lines)
+        print_, travel, retract = [numpy.array(setting)[current] for setting in settings]
+        accelerations = numpy.where(e_only, retract,
+                                    numpy.where(deltas[:, 3] != 0, print_, travel))
+        # no axis may go over its own limits, X and Y running at up to the
+        # whole speed along arcs
+        extents = numpy.abs(deltas)
+        arcs = numpy.isfinite(radii)
+        extents[arcs, 0] = extents[arcs, 1] = paths[arcs]
+        ratios = extents / distances[:, None]
+        with numpy.errstate(divide = "ignore"):
+            speeds = numpy.minimum(feedrates, (numpy.array(self.max_feedrate) / ratios).min(axis = 1))
+            accelerations = numpy.minimum(accelerations,
+                                          (numpy.array(self.max_acceleration) / ratios).min(axis = 1))
+        speeds = numpy.minimum(speeds, numpy.sqrt(accelerations * radii))
+        return distances, numpy.maximum(speeds, 1e-3), accelerations
+
+    def _plan(self, columns, lines, directions, distances, speeds, accelerations):
+        """Returns the square of the entry speed of the moves"""
+        count = len(lines)
+        # corner speeds, from the angle between the XYZE directions
+        entry, exit = [d / numpy.sqrt((d ** 2).sum(axis = 1))[:, None] for d in directions]
+        cos_theta = numpy.clip(-(entry[1:] * exit[:-1]).sum(axis = 1), -1, 1)
+        sin_theta_d2 = numpy.sqrt(0.5 * (1 - cos_theta))
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            junction = accelerations[1:] * self.junction_deviation * sin_theta_d2 / (1 - sin_theta_d2)
+        junction = numpy.where(sin_theta_d2 > 0.999999, numpy.inf, junction)
+        junction = numpy.minimum(junction, numpy.minimum(speeds[1:], speeds[:-1]) ** 2)
+        # moves start from rest at the beginning and after waiting commands
+        syncs = numpy.searchsorted(numpy.flatnonzero(columns.where(*self.sync_commands)), lines)
+        junction = numpy.where(syncs[1:] != syncs[:-1], 0, junction)
+        limits = numpy.concatenate(([0], junction, [0]))
+        # entry[k] <= entry[k + 1] + gains[k] going backwards, up to the end
+        # of the buffer when move k - 1 starts, where the firmware has to be
+        # able to stop: with cumulated gains, the bound from the entry of
+        # move j is limits[j] + gains[j] - gains[k]
+        gains = numpy.concatenate(([0], numpy.cumsum(2 * accelerations * distances)))
+        bounds = limits + gains
+        window = max(self.buffer_size - 1, 1)
+        size = 1
+        minima = bounds
+        while 2 * size <= window:
+            shifted = numpy.empty_like(minima)
+            shifted.fill(numpy.inf)
+            shifted[:-size] = minima[size:]
+            minima = numpy.minimum(minima, shifted)
+            size *= 2
+        ends = numpy.minimum(numpy.arange(count + 1) + window - size, count)
+        backward = numpy.minimum(minima, minima[ends])
+        stop = gains[numpy.minimum(numpy.arange(count + 1) + window, count)]
+        backward = numpy.minimum(backward, stop) - gains
+        # entry[k] <= entry[k - 1] + gains[k - 1] going forwards
+        forward = numpy.minimum.accumulate(backward - gains) + gains
+        return numpy.maximum(numpy.minimum(backward, forward), 0)[:count]
+
+# slicer comments naming the feature the next moves print: ;TYPE: (Cura,
+# Slic3r, PrusaSlicer), ;FEATURE: (Bambu Studio, OrcaSlicer), ; feature
+# (Simplify3D)
+feature_exp = re.compile("^;\s*(?:TYPE|FEATURE)\s*:\s*(.*)$|^;\s*feature\s+(.*)$", re.I)
+
+def feature_marks(lines):
+    """Returns the (index, feature) of the lines of lines naming the feature
+    the next moves print"""
+    marks = []
+    for i, line in enumerate(lines):
+        raw = line.raw
+        if raw[:1] == ";":
+            match = feature_exp.match(raw)
+            if match:
+                marks.append((i, (match.group(1) or match.group(2)).strip()))
+    return marks
+
+class GCodeStatistics(object):
+    """Statistics of the moves of G-code, accumulated over GCodeColumns of
+    consecutive lines, chunk after chunk (see statistics): the position, E,
+    feedrate, layer, feature and Z-hop reached at the end of a chunk carry
+    over to the next one.
+
+    Moves adding filament while moving extrude, the other moves travel, and
+    the ones taking filament back are retractions. Filament added without
+    moving, such as after a retraction, counts as extruded too. The layers
+    are the Z of the extruding moves, the moves after one counting in its
+    layer until the next one. A Z-hop is a move up followed by a move back
+    down to the same Z, without extruding in between.
+    """
+
+    # sums kept for the whole file and per layer, tool and feature
+    fields = ("moves", "extrude_moves", "extruded", "extrude_distance",
+              "travel_distance", "retractions", "retracted")
+    count_fields = ("moves", "extrude_moves", "retractions")
+
+    hop_tolerance = 1e-3
+
+    def __init__(self, speed_bin = 10.0):
+        if numpy is None:
+            raise ImportError("GCodeStatistics needs NumPy")
+        self.speed_bin = speed_bin #mm/s
+        self.lines = 0
+        self.position = (0, 0, 0)
+        self.cur_e = 0
+        self.f = float("nan")
+        self.layer_z = float("nan")
+        self.feature = 0
+        self.feature_ids = {None: 0}
+        self.totals = numpy.zeros(len(self.fields))
+        self.groups = {"layer": {}, "tool": {}, "feature": {}}
+        # moves, distance and time per speed bin
+        self.speeds = {"extrude": numpy.zeros((3, 0)), "travel": numpy.zeros((3, 0))}
+        self.hops = [0, 0.0, 0.0, 0.0] #count, total and max height, XY distance
+        self.xy_distance = 0.0
+        self.extrude_count = 0
+        # (z before, z after, xy_distance, extrude_count) of the last move
+        # up while it isn't known whether it's a Z-hop
+        self.hop = None
+
+    def add(self, columns, features = ()):
+        """Adds the lines of columns, features being the (index, feature)
+        of the lines among them naming a feature, see feature_marks"""
+        count = len(columns)
+        if not count:
+            return
+        self.lines += count
+        flags = columns.flags
+        move = (flags & GCodeColumns.is_move) != 0
+        g92 = columns.where("G92")
+
+        # E delta of each line, as GCode._preprocess_extrusion tracks E
+        e = columns.e.astype(numpy.float64)
+        relative_e = move & ((flags & GCodeColumns.relative_e) != 0)
+        rows = numpy.flatnonzero(~numpy.isnan(e) & (move | g92))
+        deltas = numpy.zeros(count)
+        if len(rows):
+            after = _fill_forward(numpy.where(relative_e[rows], numpy.nan, e[rows]), self.cur_e)
+            before = numpy.concatenate(([self.cur_e], after[:-1]))
+            deltas[rows] = numpy.where(move[rows], numpy.where(relative_e[rows], e[rows],
+                                                               e[rows] - before), 0)
+            self.cur_e = float(after[-1])
+
+        # position before and after each move, G92s moving the position too
+        rows = numpy.flatnonzero(move | g92)
+        if not len(rows):
+            return
+        after = [values[rows].astype(numpy.float64)
+                 for values in (columns.current_x, columns.current_y, columns.current_z)]
+        before = [numpy.concatenate(([start], values[:-1]))
+                  for values, start in zip(after, self.position)]
+        self.position = tuple(float(values[-1]) for values in after)
+        moves = move[rows]
+        rows = rows[moves]
+        if not len(rows):
+            return
+        (x0, y0, z0), (x1, y1, z1) = [[values[moves] for values in ends]
+                                      for ends in (before, after)]
+        xy = numpy.hypot(x1 - x0, y1 - y0)
+        arcs = numpy.flatnonzero(columns.where("G2", "G3")[rows])
+        if len(arcs):
+            cx, cy, radius, start, sweep = _arc_arrays(x0[arcs], y0[arcs], x1[arcs], y1[arcs],
+                                                       columns.i[rows[arcs]], columns.j[rows[arcs]],
+                                                       columns.where("G2")[rows[arcs]])
+            xy[arcs] = radius * numpy.abs(sweep)
+        distance = numpy.hypot(xy, z1 - z0)
+        deltas = deltas[rows]
+        extruding = (deltas > 0) & (distance > 0)
+        travel = (deltas <= 0) & (distance > 0)
+        retraction = deltas < 0
+        speed = _fill_forward(columns.f[rows].astype(numpy.float64), self.f)
+        self.f = float(speed[-1])
+        speed /= 60
+
+        sums = numpy.array([numpy.ones(len(rows)), extruding, numpy.where(deltas > 0, deltas, 0),
+                            numpy.where(extruding, distance, 0), numpy.where(travel, distance, 0),
+                            retraction, numpy.where(retraction, -deltas, 0)]).T
+        self.totals += sums.sum(0)
+
+        layer_z = _fill_forward(numpy.where(extruding, z1, numpy.nan), self.layer_z)
+        self.layer_z = float(layer_z[-1])
+        self._group("layer", numpy.round(layer_z, 4), sums)
+        self._group("tool", columns.tool[rows], sums)
+        feature = numpy.full(count, numpy.nan)
+        for index, name in features:
+            feature[index] = self.feature_ids.setdefault(name, len(self.feature_ids))
+        feature = _fill_forward(feature, self.feature)
+        self.feature = int(feature[-1])
+        self._group("feature", feature[rows].astype(numpy.int64), sums)
+
+        for name, mask in (("extrude", extruding), ("travel", travel)):
+            known = mask & (numpy.nan_to_num(speed) > 0)
+            bins = (speed[known] // self.speed_bin).astype(numpy.int64)
+            if not len(bins):
+                continue
+            size = max(self.speeds[name].shape[1], bins.max() + 1)
+            counts = numpy.array([numpy.bincount(bins, None, size),
+                                  numpy.bincount(bins, distance[known], size),
+                                  numpy.bincount(bins, distance[known] / speed[known], size)])
+            counts[:, :self.speeds[name].shape[1]] += self.speeds[name]
+            self.speeds[name] = counts
+
+        self._hops(z0, z1, xy, extruding)
+
+    def _group(self, kind, keys, sums):
+        valid = ~numpy.isnan(keys) if keys.dtype.kind == "f" else slice(None)
+        keys = keys[valid]
+        if not len(keys):
+            return
+        unique, inverse = numpy.unique(keys, return_inverse = True)
+        values = numpy.array([numpy.bincount(inverse, column, len(unique))
+                              for column in sums[valid].T]).T
+        group = self.groups[kind]
+        for key, row in izip(unique.tolist(), values):
+            if key in group:
+                group[key] += row
+            else:
+                group[key] = row
+
+    def _hops(self, z0, z1, xy, extruding):
+        # the moves changing Z, after the pending move up of the chunk before
+        xy_distance = self.xy_distance + numpy.cumsum(xy)
+        extrude_count = self.extrude_count + numpy.cumsum(extruding)
+        self.xy_distance = float(xy_distance[-1])
+        self.extrude_count = int(extrude_count[-1])
+        changes = numpy.flatnonzero(z1 != z0)
+        events = numpy.array([z0[changes], z1[changes], xy_distance[changes],
+                              extrude_count[changes]])
+        if self.hop is not None:
+            events = numpy.concatenate((numpy.array(self.hop)[:, None], events), 1)
+        if not events.shape[1]:
+            return
+        before, after, distance, extruded = events
+        up = after > before
+        hop = up[:-1] & ~up[1:] & (numpy.abs(after[1:] - before[:-1]) < self.hop_tolerance) \
+            & (extruded[1:] == extruded[:-1])
+        heights = (after - before)[:-1][hop]
+        if len(heights):
+            self.hops[0] += len(heights)
+            self.hops[1] += float(heights.sum())
+            self.hops[2] = max(self.hops[2], float(heights.max()))
+            self.hops[3] += float((distance[1:] - distance[:-1])[hop].sum())
+        self.hop = tuple(events[:, -1].tolist()) if up[-1] else None
+
+    def _sums(self, values):
+        return dict((name, int(value) if name in self.count_fields else float(value))
+                    for name, value in zip(self.fields, values))
+
+    def result(self):
+        """Returns the statistics as a dict of JSON serializable values:
+        lines, the sums of fields for the whole file under totals and per
+        layer, tool and feature under layers, tools and features, the
+        moves, distance and time spent per speed bin of speed_bin mm/s for
+        the extruding and travel moves under speeds, and the count, mean
+        and max height and XY distance travelled of the Z-hops under
+        z_hops. Distances are in mm, E in mm of filament, times in seconds
+        at the feedrate."""
+        def groups(kind, label, keys):
+            group = self.groups[kind]
+            return [dict(self._sums(group[key]), **{label: keys(key)}) for key in sorted(group)]
+        features = sorted(self.feature_ids, key = self.feature_ids.get)
+        speeds = {"bin": self.speed_bin}
+        for name, counts in self.speeds.items():
+            speeds[name] = [{"speed": k * self.speed_bin, "moves": int(counts[0, k]),
+                             "distance": float(counts[1, k]), "time": float(counts[2, k])}
+                            for k in numpy.flatnonzero(counts[0])]
+        count, height, max_height, distance = self.hops
+        return {
+            "lines": self.lines,
+            "totals": self._sums(self.totals),
+            "layers": groups("layer", "z", float),
+            "tools": groups("tool", "tool", int),
+            "features": groups("feature", "feature", features.__getitem__),
+            "speeds": speeds,
+            "z_hops": {"count": count, "mean_height": height / count if count else 0,
+                       "max_height": max_height, "xy_distance": distance},
+        }
+
+def statistics(data, chunk_lines = 100000, speed_bin = 10.0):
+    """Returns the GCodeStatistics result of data, a GCode or an iterable of
+    raw lines such as an open file. Lines are parsed and processed
+    chunk_lines at a time, so that files of any size can be processed in
+    bounded memory."""
+    stats = GCodeStatistics(speed_bin)
+    if isinstance(data, GCode) and data.lines is not None:
+        data.preprocess_coordinates()
+        all_lines = data.lines
+        chunks = (all_lines[i:i + chunk_lines] for i in xrange(0, len(all_lines), chunk_lines))
+    elif isinstance(data, GCode): # GCodeStream, see read_lines
+        chunks = parse_batches((line.raw for line in data), chunk_lines)
+    else:
+        chunks = parse_batches(iter(data), chunk_lines)
+    for lines in chunks:
+        stats.add(GCodeColumns(None, lines), feature_marks(lines))
+    return stats.result()
+
+def _arc_arrays(x0, y0, x1, y1, i, j, clockwise):
+    """arc_geometry over NumPy arrays of arcs"""
+    x0, y0, x1, y1, i, j = [numpy.nan_to_num(numpy.asarray(a, numpy.float64))
+                            for a in (x0, y0, x1, y1, i, j)]
+    cx = x0 + i
+    cy = y0 + j
+    radius = numpy.hypot(i, j)
+    start = numpy.arctan2(-j, -i)
+    sweep = numpy.mod(numpy.arctan2(y1 - cy, x1 - cx) - start, 2 * math.pi)
+    sweep = numpy.where(clockwise, 2 * math.pi - sweep, sweep)
+    sweep = numpy.where(numpy.hypot(x1 - x0, y1 - y0) < 1e-6, 2 * math.pi, sweep)
+    return cx, cy, radius, start, numpy.where(clockwise, -sweep, sweep)
+
+def _arc_extremes(x0, y0, x1, y1, i, j, clockwise):
+    """Returns the X and Y of the points arc_bounds takes the bounds of,
+    over NumPy arrays of arcs"""
+    cx, cy, radius, start, sweep = _arc_arrays(x0, y0, x1, y1, i, j, clockwise)
+    xs = [x0, x1]
+    ys = [y0, y1]
+    for quadrant in range(4):
+        angle = quadrant * math.pi / 2
+        offset = numpy.mod(numpy.where(sweep > 0, angle - start, start - angle), 2 * math.pi)
+        inside = offset <= numpy.abs(sweep)
+        xs.append((cx + radius * math.cos(angle))[inside])
+        ys.append((cy + radius * math.sin(angle))[inside])
+    return numpy.concatenate(xs), numpy.concatenate(ys)
+
+def _fill_forward(values, initial = 0):
+    """Replaces the NaN of values by the last number before them, or by
+    initial"""
+    values = numpy.concatenate(([initial], values))
+    last = numpy.where(numpy.isnan(values), 0, numpy.arange(len(values)))
+    numpy.maximum.accumulate(last, out = last)
+    return values[last][1:]
+
+def _track(sets, deltas, start):
+    """Returns the position after each of a sequence of steps, from start:
+    the value of sets where it isn't NaN, the position before plus the one
+    of deltas otherwise. The deltas are summed one at a time from the last
+    set position, as the loops over the lines do, so that the results are
+    the same to the last bit."""
+    positions = _fill_forward(sets, start)
+    moving = numpy.flatnonzero(deltas)
+    if len(moving):
+        starts = numpy.flatnonzero(~numpy.isnan(sets))
+        edges = numpy.concatenate(([0], starts, [len(sets)]))
+        # one cumulative sum per run of steps from a set position
+        for run in numpy.unique(numpy.searchsorted(starts, moving, "right")):
+            first = edges[run] + 1 if run else 0
+            base = positions[edges[run]] if run else start
+            end = edges[run + 1]
+            positions[first:end] = numpy.cumsum(numpy.concatenate(([base], deltas[first:end])))[1:]
+    return positions
+
+def _positions(columns, current_x, current_y, current_z):
+    """Tracks the positions over columns from the given one, as
+    Layer._preprocess does. Returns the indices of the moves and G92s, the
+    X, Y and Z arrays of the positions after each of them (None if there
+    are none) and the bounds of the extruding moves."""
+    inf = float("inf")
+    move = (columns.flags & columns.is_move) != 0
+    rows = numpy.flatnonzero(move | columns.where("G92"))
+    if not len(rows):
+        return rows, None, [(inf, -inf), (inf, -inf), (0, -inf)]
+    x, y, z, e, i, j = [numpy.asarray(getattr(columns, name)[rows], numpy.float64)
+                        for name in ("x", "y", "z", "e", "i", "j")]
+    move = move[rows]
+    relative = move & ((columns.flags[rows] & columns.relative) != 0)
+    targets = (x, y, z)
+    positions = [_track(numpy.where(relative, numpy.nan, values),
+                        numpy.where(relative, numpy.nan_to_num(values), 0), start)
+                 for values, start in zip(targets, (current_x, current_y, current_z))]
+
+    # moves to a given X or Y, or relative ones, with a non zero E
+    extruding = move & (numpy.nan_to_num(e) != 0)
+    bounds = [positions[axis][extruding & (relative | ~numpy.isnan(targets[axis]))]
+              for axis in (0, 1)]
+    arcs = numpy.flatnonzero(extruding & columns.where("G2", "G3")[rows])
+    if len(arcs):
+        # arc_bounds over python floats, NumPy scalars are slow to compute with
+        starts = [numpy.concatenate(([start], p[:-1]))[arcs].tolist()
+                  for p, start in zip(positions, (current_x, current_y))]
+        ends = [p[arcs].tolist() for p in positions[:2]]
+        centers = [[value if value == value else None for value in values[arcs].tolist()]
+                   for values in (i, j)]
+        clockwise = columns.where("G2")[rows][arcs].tolist()
+        extremes = [arc_bounds(x0, y0, x1, y1, center_i, center_j, cw)
+                    for x0, y0, x1, y1, center_i, center_j, cw
+                    in izip(starts[0], starts[1], ends[0], ends[1], centers[0], centers[1],
+                            clockwise)]
+        extremes = numpy.array(extremes, numpy.float64).reshape(-1, 4)
+        bounds = [numpy.concatenate((bounds[0], extremes[:, 0], extremes[:, 1])),
+                  numpy.concatenate((bounds[1], extremes[:, 2], extremes[:, 3]))]
+    bounds = [(float(values.min()), float(values.max())) if len(values) else (inf, -inf)
+              for values in bounds]
+    zs = positions[2][extruding]
+    bounds.append((min(0, float(zs.min())), float(zs.max())) if len(zs) else (0, -inf))
+    return rows, positions, bounds
 
-    print "Line object size:", sys.getsizeof(Line("G0 X0"))
-    gcode = GCode(open(sys.argv[1])) 
+def preprocess_positions(lines, current_x = 0, current_y = 0, current_z = 0):
+    """Same as Layer._preprocess over lines, with NumPy: the positions are
+    forward filled from the ones the absolute moves and G92s set, plus the
+    cumulative sums of the relative moves."""
+    rows, positions, bounds = _positions(GCodeColumns(None, lines, exact = True),
+                                         current_x, current_y, current_z)
+    if positions is None:
+        return (current_x, current_y, current_z), bounds[0], bounds[1], bounds[2]
+    try:
+        gcoder_line.set_positions(lines, rows, *positions)
+    except (AttributeError, TypeError): # no extension or PyLines
+        for k, position_x, position_y, position_z in izip(rows.tolist(),
+                                                          *[p.tolist() for p in positions]):
+            line = lines[k]
+            line.current_x = position_x
+            line.current_y = position_y
+            line.current_z = position_z
+    return (float(positions[0][-1]), float(positions[1][-1]), float(positions[2][-1])), \
+        bounds[0], bounds[1], bounds[2]
 
-    print "Dimensions:"
-    print "\tX: %0.02f - %0.02f (%0.02f)" % (gcode.xmin,gcode.xmax,gcode.width)
-    print "\tY: %0.02f - %0.02f (%0.02f)" % (gcode.ymin,gcode.ymax,gcode.depth)
-    print "\tZ: %0.02f - %0.02f (%0.02f)" % (gcode.zmin,gcode.zmax,gcode.height)
-    print "Filament used: %0.02fmm" % gcode.filament_length
-    print "Number of layers: %d" % gcode.num_layers()
-    print "Estimated duration: %s" % gcode.estimate_duration()
+def _extrusion(columns, cur_e, total_e):
+    """Tracks the extrusion over columns, starting at cur_e and with total_e
+    extruded, as GCode._preprocess_extrusion does: the E the absolute moves
+    extrude from is forward filled from the absolute moves and G92s, and
+    the extruded length is the cumulative sum of the E deltas. Returns the
+    indices of the moves with an E, whether each of them extrudes, cur_e
+    and total_e after them and the maximum extruded length."""
+    e = numpy.asarray(columns.e, numpy.float64)
+    move = (columns.flags & columns.is_move) != 0
+    rows = numpy.flatnonzero(~numpy.isnan(e) & (move | columns.where("G92")))
+    if not len(rows):
+        return rows, numpy.zeros(0, bool), cur_e, total_e, total_e
+    e = e[rows]
+    move = move[rows]
+    relative = move & ((columns.flags[rows] & columns.relative_e) != 0)
+    after = _fill_forward(numpy.where(relative, numpy.nan, e), cur_e)
+    before = numpy.concatenate(([cur_e], after[:-1]))
+    deltas = numpy.where(move, numpy.where(relative, e, e - before), 0)
+    totals = numpy.cumsum(numpy.concatenate(([total_e], deltas)))[1:]
+    extruding = numpy.where(relative, e != 0, e != before)[move]
+    moves = rows[move]
+    max_e = max(total_e, float(totals[move].max())) if len(moves) else total_e
+    return moves, extruding, float(after[-1]), float(totals[-1]), max_e
 
-if __name__ == '__main__':
-    main()
+def preprocess_extrusion(lines, cur_e = 0, total_e = 0):
+    """Same as GCode._preprocess_extrusion over lines, with NumPy. Returns
+    cur_e and total_e after lines and the maximum extruded length."""
+    moves, extruding, cur_e, total_e, max_e = \
+        _extrusion(GCodeColumns(None, lines, exact = True), cur_e, total_e)
+    try:
+        gcoder_line.set_extruding(lines, moves, extruding.view(numpy.uint8))
+    except (AttributeError, TypeError): # no extension or PyLines
+        for k, value in izip(moves.tolist(), extruding.tolist()):
+            lines[k].extruding = value
+    return cur_e, total_e, max_e
@@ -13,20 +13,92 @@
 # You should have received a copy of the GNU General Public License
 # along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
 
+cimport cython
 from libc.stdlib cimport malloc, free
-from libc.stdint cimport uint32_t
+from libc.stdint cimport uint32_t, uint16_t, uint8_t
+from libc.math cimport NAN
+from cpython.bytes cimport PyBytes_FromStringAndSize
 
 cdef extern from "string.h":
-       char *strncpy(char *dest, char *src, size_t n)
-       size_t strlen(const char *s)
+       void *memcpy(void *dest, void *src, size_t n)
 
-cdef char* copy_string(object value):
-    cdef char* orig = value
-    str_len = len(orig)
-    cdef char* array = <char *>malloc(str_len + 1)
-    strncpy(array, orig, str_len)
-    array[str_len] = 0;
-    return array
+cdef extern from "Python.h":
+       double PyOS_string_to_double(const char *s, char **endptr, void *overflow_exception)
+
+cdef class Arena:
+    """Block of memory the raw text of GLines is copied to, one line after
+    the other, freed along with the last line using it"""
+
+    cdef char* data
+    cdef size_t size
+    cdef size_t used
+
+    def __cinit__(self, size_t size):
+        self.data = <char*> malloc(size)
+        if self.data == NULL:
+            raise MemoryError()
+        self.size = size
+        self.used = 0
+
+    def __dealloc__(self):
+        free(self.data)
+
+# the arena new lines go to, and the size of arenas: longer lines keep a
+# reference to their own string instead
+cdef Arena arena = None
+cdef size_t arena_size = 256 << 10
+cdef size_t arena_line_size = 4 << 10
+
+cdef set_raw(GLine line, bytes value):
+    global arena
+    cdef size_t length = len(value)
+    if length > arena_line_size:
+        line._source = value
+        line._start = 0
+    else:
+        if arena is None or arena.used + length > arena.size:
+            arena = Arena(arena_size)
+        memcpy(arena.data + arena.used, <char*> value, length)
+        line._source = arena
+        line._start = arena.used
+        arena.used += length
+    line._length = length
+
+# commands are stored as their index in command_names, the strings being
+# interned so that comparing them to literals is cheap. The table is shared
+# by all the lines of the process, so only G, M and T command words go in
+# it: other first words, such as the X10 of the modal moves of CNC output,
+# and the commands coming once the table is full get other_command instead
+# and are read again from the raw text.
+cdef list command_names = []
+cdef dict command_ids = {}
+cdef uint16_t other_command = 0xffff
+
+cdef inline bint is_command_word(command):
+    cdef char* s
+    cdef Py_ssize_t n, i
+    if type(command) is not bytes:
+        return False
+    s = command
+    n = len(command)
+    if n == 0:
+        return True
+    if s[0] != 'G' and s[0] != 'M' and s[0] != 'T':
+        return False
+    for i in range(1, n):
+        if not is_digit(s[i]) and s[i] != '.':
+            return False
+    return True
+
+cdef uint16_t command_id(command):
+    cdef object index = command_ids.get(command)
+    if index is None:
+        if not is_command_word(command) or len(command_names) >= other_command:
+            return other_command
+        command = intern(command)
+        index = command_ids[command] = len(command_names)
+        command_names.append(command)
+    return index
 
 cdef enum BitPos:
     pos_x =                 1 << 0
@@ -47,6 +119,8 @@ cdef enum BitPos:
     pos_raw =               1 << 15
     pos_command =           1 << 16
     pos_gcview_end_vertex = 1 << 17
+    pos_lazy =              1 << 18 # coordinates not parsed yet
+    pos_lazy_imperial =     1 << 19 # ... and to be parsed in inches
     # WARNING: don't use bits 24 to 31 as we store current_tool there
 
 cdef inline uint32_t has_var(uint32_t status, uint32_t pos):
@@ -58,31 +132,33 @@ cdef inline uint32_t set_has_var(uint32_t status, uint32_t pos):
 cdef inline uint32_t unset_has_var(uint32_t status, uint32_t pos):
     return status & ~pos
 
+# lines can't be part of reference cycles, leaving them out of the cycle
+# collector saves its header on each of them
+@cython.no_gc
 cdef class GLine:
-    
-    cdef char* _raw
-    cdef char* _command
+
+    # the raw text is _length bytes at _start in _source, an Arena or the
+    # string or memory map it comes from, None if it's not set
+    cdef object _source
+    cdef size_t _start
+    cdef uint32_t _length
     cdef float _x, _y, _z, _e, _f, _i, _j
     cdef float _current_x, _current_y, _current_z
     cdef uint32_t _gcview_end_vertex
     cdef uint32_t _status
+    cdef uint16_t _command
 
     __slots__ = ()
 
-    def __cinit__(self):
+    def __cinit__(self, *args, **kwargs):
         self._status = 0
-        self._raw = NULL
-        self._command = NULL
 
     def __init__(self, line):
-        self.raw = line
-
-    def __dealloc__(self):
-        if self._raw != NULL: free(self._raw)
-        if self._command != NULL: free(self._command)
+        set_raw(self, line)
 
     property x:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_x): return self._x
             else: return None
         def __set__(self, value):
@@ -90,6 +166,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_x)
     property y:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_y): return self._y
             else: return None
         def __set__(self, value):
@@ -97,6 +174,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_y)
     property z:
         def __get__(self):
+            # lazy lines have no Z, see parse_line
             if has_var(self._status, pos_z): return self._z
             else: return None
         def __set__(self, value):
@@ -104,6 +182,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_z)
     property e:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_e): return self._e
             else: return None
         def __set__(self, value):
@@ -111,6 +190,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_e)
     property f:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_f): return self._f
             else: return None
         def __set__(self, value):
@@ -118,6 +198,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_f)
     property i:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_i): return self._i
             else: return None
         def __set__(self, value):
@@ -125,6 +206,7 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_i)
     property j:
         def __get__(self):
+            if has_var(self._status, pos_lazy): parse_lazy(self)
             if has_var(self._status, pos_j): return self._j
             else: return None
         def __set__(self, value):
@@ -195,19 +277,341 @@ cdef class GLine:
             self._status = set_has_var(self._status, pos_gcview_end_vertex)
     property raw:
         def __get__(self):
-            if has_var(self._status, pos_raw): return self._raw
-            else: return None
+            if self._source is None:
+                return None
+            if type(self._source) is Arena:
+                return PyBytes_FromStringAndSize((<Arena> self._source).data + self._start,
+                                                 self._length)
+            return self._source[self._start:self._start + self._length]
         def __set__(self, value):
-            # WARNING: memory leak could happen here, as we don't do the following :
-            # if self._raw != NULL: free(self._raw)
-            self._raw = copy_string(value)
-            self._status = set_has_var(self._status, pos_raw)
+            set_raw(self, value)
     property command:
         def __get__(self):
-            if has_var(self._status, pos_command): return self._command
-            else: return None
+            if not has_var(self._status, pos_command): return None
+            if self._command == other_command: return raw_command(self.raw)
+            return command_names[self._command]
         def __set__(self, value):
-            # WARNING: memory leak could happen here, as we don't do the following :
-            # if self._command != NULL: free(self._command)
-            self._command = copy_string(value)
+            cdef uint16_t index = command_id(value)
+            if index == other_command and value != raw_command(self.raw):
+                raise ValueError("%r is not the command of the line %r" % (value, self.raw))
+            self._command = index
             self._status = set_has_var(self._status, pos_command)
+
+@cython.no_gc
+cdef class MappedGLine(GLine):
+    """GLine whose raw text stays in the buffer it comes from, such as the
+    memory map of a file, instead of being copied to an arena"""
+
+    def __init__(self, source, start, length):
+        self._source = source
+        self._start = start
+        self._length = length
+
+cdef char* token_codes = "xyzefijgtmn"
+cdef char* nonarg_codes = "gtmn"
+move_gcodes = ("G0", "G1", "G2", "G3")
+
+cdef inline char lower(char c):
+    if c >= 'A' and c <= 'Z': return c + 32
+    return c
+
+cdef inline bint is_digit(char c):
+    return c >= '0' and c <= '9'
+
+cdef inline bint has_char(char* chars, char c):
+    while chars[0]:
+        if chars[0] == c: return True
+        chars += 1
+    return False
+
+cdef set_coordinate(GLine line, char code, double value):
+    if code == 'x':
+        line._x = value
+        line._status = set_has_var(line._status, pos_x)
+    elif code == 'y':
+        line._y = value
+        line._status = set_has_var(line._status, pos_y)
+    elif code == 'z':
+        line._z = value
+        line._status = set_has_var(line._status, pos_z)
+    elif code == 'e':
+        line._e = value
+        line._status = set_has_var(line._status, pos_e)
+    elif code == 'f':
+        line._f = value
+        line._status = set_has_var(line._status, pos_f)
+    elif code == 'i':
+        line._i = value
+        line._status = set_has_var(line._status, pos_i)
+    elif code == 'j':
+        line._j = value
+        line._status = set_has_var(line._status, pos_j)
+
+cdef parse_lazy(GLine line):
+    cdef bint imperial = has_var(line._status, pos_lazy_imperial)
+    line._status = unset_has_var(line._status, pos_lazy | pos_lazy_imperial)
+    parse_line(line, imperial)
+
+cdef inline bint has_z(char* s, Py_ssize_t pos, Py_ssize_t n):
+    while pos < n:
+        if s[pos] == 'z' or s[pos] == 'Z': return True
+        pos += 1
+    return False
+
+cdef enum TokenKind:
+    no_token = 0 # a character gcoder.gcode_exp skips
+    comment_token = 1
+    word_token = 2
+
+cdef inline Py_ssize_t scan_token(char* s, Py_ssize_t n, Py_ssize_t pos, int* kind,
+                                  char* code, Py_ssize_t* number, bint* digits):
+    """Scans the token at pos the way gcoder.gcode_exp does and returns the
+    position after it. For a word, code is its lowercase letter, number the
+    start of its number and digits tells whether the number has any."""
+    cdef char c = lower(s[pos])
+    cdef Py_ssize_t end
+    code[0] = 0
+    kind[0] = comment_token
+    if c == '(':
+        end = pos + 1
+        while end < n and s[end] != '(' and s[end] != ')':
+            end += 1
+        if end == n or s[end] != ')':
+            kind[0] = no_token
+            return pos + 1
+        return end + 1
+    elif c == ';':
+        while pos < n and s[pos] != '\n':
+            pos += 1
+        return pos
+    elif c == '/' or c == '*':
+        end = pos + 1
+        while end < n and s[end] != '\n':
+            end += 1
+        if end == n:
+            kind[0] = no_token
+            return pos + 1
+        return end + 1
+    elif has_char(token_codes, c):
+        kind[0] = word_token
+        code[0] = c
+        pos += 1
+        number[0] = pos
+        if pos < n and (s[pos] == '-' or s[pos] == '+'):
+            pos += 1
+        digits[0] = False
+        while pos < n and is_digit(s[pos]):
+            pos += 1
+            digits[0] = True
+        if pos < n and s[pos] == '.':
+            pos += 1
+        while pos < n and is_digit(s[pos]):
+            pos += 1
+            digits[0] = True
+        return pos
+    kind[0] = no_token
+    return pos + 1
+
+cdef raw_command(bytes raw):
+    """Returns the command parse_line finds in raw"""
+    cdef char* s = raw
+    cdef Py_ssize_t n = len(raw), pos = 0, start, number
+    cdef int token = 0, kind
+    cdef char code
+    cdef bint digits
+    while pos < n:
+        start = pos
+        pos = scan_token(s, n, pos, &kind, &code, &number, &digits)
+        if kind == no_token:
+            continue
+        if token > 0 or code != 'n':
+            return raw[start:pos].upper() if code else ""
+        token += 1
+    return ""
+
+def parse_line(GLine line, bint imperial = False, bint force = False, bint lazy = False):
+    """Same as gcoder.py_parse_line: scans the raw line once the way
+    gcoder.gcode_exp does, without building the list of tokens"""
+    cdef bytes raw = line.raw
+    cdef char* s = raw
+    cdef Py_ssize_t n = len(raw)
+    cdef Py_ssize_t pos = 0, start, number
+    cdef int token = 0, kind
+    cdef char code
+    cdef bint digits = False, parse = False, command_set = False
+    cdef double unit_factor = 1
+    cdef double value
+    cdef char buf[64]
+    while pos < n:
+        start = pos
+        pos = scan_token(s, n, pos, &kind, &code, &number, &digits)
+        if kind == no_token:
+            continue
+        # the first token which is not a line number is the command
+        if not command_set and (token > 0 or code != 'n'):
+            command = raw[start:pos].upper() if code else ""
+            # the command is the one raw_command finds, no need to check it
+            line._command = command_id(command)
+            line._status = set_has_var(line._status, pos_command)
+            line.is_move = command in move_gcodes
+            command_set = True
+            if command == "G20":
+                imperial = True
+            elif command == "G21":
+                imperial = False
+            if imperial:
+                unit_factor = 25.4
+            parse = force or code == 'g'
+            if lazy and parse and command != "G92" and not has_z(s, pos, n):
+                line._status |= pos_lazy | (pos_lazy_imperial if imperial else 0)
+                return
+        token += 1
+        if parse and code and digits and not has_char(nonarg_codes, code):
+            if pos - number < 64:
+                memcpy(buf, s + number, pos - number)
+                buf[pos - number] = 0
+                value = PyOS_string_to_double(buf, NULL, NULL)
+            else:
+                value = float(raw[number:pos])
+            set_coordinate(line, code, unit_factor * value)
+    if not command_set:
+        line.command = ""
+        line.is_move = False
+
+cdef list line_list(lines):
+    # lists of lines may be gcoder.Layers, which the list type of an
+    # argument doesn't accept
+    if type(lines) is list:
+        return lines
+    return list(lines)
+
+def fill_columns(lines, float[:] x, float[:] y, float[:] z, float[:] e, float[:] f,
+                 float[:] i_, float[:] j_, float[:] current_x, float[:] current_y, float[:] current_z,
+                 uint8_t[:] flags, uint8_t[:] tool):
+    """Fills the arrays of a gcoder.GCodeColumns from lines, which must all
+    be GLines: NaN for unset coordinates, is_move, relative, relative_e and
+    extruding packed in the low bits of flags"""
+    cdef list items = line_list(lines)
+    cdef GLine line
+    cdef uint32_t status
+    cdef Py_ssize_t i
+    for i in range(len(items)):
+        line = <GLine?> items[i]
+        if has_var(line._status, pos_lazy):
+            parse_lazy(line)
+        status = line._status
+        x[i] = line._x if has_var(status, pos_x) else NAN
+        y[i] = line._y if has_var(status, pos_y) else NAN
+        z[i] = line._z if has_var(status, pos_z) else NAN
+        e[i] = line._e if has_var(status, pos_e) else NAN
+        f[i] = line._f if has_var(status, pos_f) else NAN
+        i_[i] = line._i if has_var(status, pos_i) else NAN
+        j_[i] = line._j if has_var(status, pos_j) else NAN
+        current_x[i] = line._current_x if has_var(status, pos_current_x) else NAN
+        current_y[i] = line._current_y if has_var(status, pos_current_y) else NAN
+        current_z[i] = line._current_z if has_var(status, pos_current_z) else NAN
+        flags[i] = (status >> 7) & 0xf
+        tool[i] = status >> 24 if has_var(status, pos_current_tool) else 0
+
+def set_positions(lines, Py_ssize_t[:] rows, double[:] x, double[:] y, double[:] z):
+    """Sets current_x, current_y and current_z of the GLines of lines at
+    rows, for gcoder's NumPy preprocessing"""
+    cdef list items = line_list(lines)
+    cdef GLine line
+    cdef Py_ssize_t k
+    for k in range(rows.shape[0]):
+        line = <GLine?> items[rows[k]]
+        line._current_x = x[k]
+        line._current_y = y[k]
+        line._current_z = z[k]
+        line._status |= pos_current_x | pos_current_y | pos_current_z
+
+def set_extruding(lines, Py_ssize_t[:] rows, uint8_t[:] extruding):
+    """Sets the extruding flag of the GLines of lines at rows"""
+    cdef list items = line_list(lines)
+    cdef GLine line
+    cdef Py_ssize_t k
+    for k in range(rows.shape[0]):
+        line = <GLine?> items[rows[k]]
+        if extruding[k]:
+            line._status = set_has_var(line._status, pos_extruding)
+        else:
+            line._status = unset_has_var(line._status, pos_extruding)
+
+cdef set_field(GLine line, uint8_t field, float value):
+    if field == 0:
+        line._x = value
+        line._status = set_has_var(line._status, pos_x)
+    elif field == 1:
+        line._y = value
+        line._status = set_has_var(line._status, pos_y)
+    elif field == 2:
+        line._z = value
+        line._status = set_has_var(line._status, pos_z)
+    elif field == 3:
+        line._e = value
+        line._status = set_has_var(line._status, pos_e)
+    elif field == 4:
+        line._f = value
+        line._status = set_has_var(line._status, pos_f)
+    elif field == 5:
+        line._i = value
+        line._status = set_has_var(line._status, pos_i)
+    elif field == 6:
+        line._j = value
+        line._status = set_has_var(line._status, pos_j)
+    elif field == 7:
+        line._current_x = value
+        line._status = set_has_var(line._status, pos_current_x)
+    elif field == 8:
+        line._current_y = value
+        line._status = set_has_var(line._status, pos_current_y)
+    elif field == 9:
+        line._current_z = value
+        line._status = set_has_var(line._status, pos_current_z)
+
+def restore_lines(source, list names, bytes starts, bytes lengths, bytes commands,
+                  bytes flags, bytes tools, bytes indices, bytes fields, bytes values):
+    """Builds the lines of a printrun.gcodecache entry, whose sections are
+    passed as strings: MappedGLines of source, or GLines for the ones
+    longer than 0xffff. The command ids are uint16, or uint32 if commands
+    is twice as long. Returns the list of lines."""
+    cdef uint32_t* c_starts = <uint32_t*> (<char*> starts)
+    cdef uint32_t* c_lengths = <uint32_t*> (<char*> lengths)
+    cdef uint16_t* c_commands = <uint16_t*> (<char*> commands)
+    cdef uint32_t* c_wide_commands = <uint32_t*> (<char*> commands)
+    cdef uint8_t* c_flags = <uint8_t*> (<char*> flags)
+    cdef uint8_t* c_tools = <uint8_t*> (<char*> tools)
+    cdef uint32_t* c_indices = <uint32_t*> (<char*> indices)
+    cdef uint8_t* c_fields = <uint8_t*> (<char*> fields)
+    cdef float* c_values = <float*> (<char*> values)
+    cdef Py_ssize_t count = len(lengths) // 4, i
+    cdef bint wide = len(commands) == 4 * count
+    cdef uint8_t flag
+    cdef GLine line
+    cdef MappedGLine mapped
+    cdef list ids = [command_id(name) for name in names]
+    lines = [None] * count
+    for i in range(count):
+        if c_lengths[i] > 0xffff:
+            line = GLine(source[c_starts[i]:c_starts[i] + c_lengths[i]])
+        else:
+            mapped = MappedGLine.__new__(MappedGLine)
+            mapped._source = source
+            mapped._start = c_starts[i]
+            mapped._length = c_lengths[i]
+            line = mapped
+        flag = c_flags[i]
+        if flag & 1:
+            line._status = set_has_var(line._status, pos_is_move | pos_current_tool)
+            line._status |= (<uint32_t> c_tools[i]) << 24
+            if flag & 2: line._status = set_has_var(line._status, pos_relative)
+            if flag & 4: line._status = set_has_var(line._status, pos_relative_e)
+        if flag & 8:
+            line._status = set_has_var(line._status, pos_extruding)
+        line._command = ids[c_wide_commands[i] if wide else c_commands[i]]
+        line._status = set_has_var(line._status, pos_command)
+        lines[i] = line
+    for i in range(len(fields)):
+        set_field(<GLine> lines[c_indices[i]], c_fields[i], c_values[i])
+    return lines
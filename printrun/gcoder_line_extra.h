@@ -9,20 +9,23 @@ typedef struct {
 } NyHeapDef;
 
 int gline_size(struct __pyx_obj_8printrun_11gcoder_line_GLine *gline) {
-  int size = __pyx_type_8printrun_11gcoder_line_GLine.tp_basicsize;
-  if (gline->_raw != NULL)
-    size += strlen(gline->_raw) + 1;
-  if (gline->_command != NULL)
-    size += strlen(gline->_command) + 1;
-  return size;
+  /* the raw text is counted in the arena or string it's in */
+  return __pyx_type_8printrun_11gcoder_line_GLine.tp_basicsize;
+}
+
+int arena_size(struct __pyx_obj_8printrun_11gcoder_line_Arena *arena) {
+  return __pyx_type_8printrun_11gcoder_line_Arena.tp_basicsize + arena->size;
 }
 
 static NyHeapDef nysets_heapdefs[] = {
     {0, 0, (NyHeapDef_SizeGetter) gline_size},
+    {0, 0, (NyHeapDef_SizeGetter) arena_size},
+    {0}
 };
 
 /*
   nysets_heapdefs[0].type = &__pyx_type_8printrun_11gcoder_line_GLine;
+  nysets_heapdefs[1].type = &__pyx_type_8printrun_11gcoder_line_Arena;
   if (PyDict_SetItemString(__pyx_d,
          "_NyHeapDefs_",
          PyCObject_FromVoidPtrAndDesc(&nysets_heapdefs, "NyHeapDef[] v1.0", 0)) < 0)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+# This file is part of the Printrun suite.
+#
+# Printrun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Printrun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Printrun.  If not, see <http://www.gnu.org/licenses/>.
+
+# Command line tools around gcoder: loading report, conversion to and from
+# the binary format, statistics, and the benchmarks and checks of the
+# tokenizer, the NumPy passes, parallel loading and GCodeColumns. Run with
+#   python -m printrun.gcodetool
+# from the Printrun directory for the usage.
+
+import os
+import sys
+import json
+from itertools import islice, cycle, izip
+from operator import attrgetter
+
+from printrun import gcoder
+
+def synthetic_gcode(count, seed = 0):
+    """Yields count lines looking like the perimeters and infill of a slicer
+    output, with the odd comment, layer change and temperature command"""
+    import random
+    rnd = random.Random(seed)
+    pool = []
+    e = 0
+    for i in range(1000):
+        e += rnd.uniform(0.01, 0.5)
+        if i % 250 == 0:
+            pool.append("G1 Z%.2f F7800" % (0.3 + i / 250 * 0.2))
+        elif i % 100 == 0:
+            pool.append("M104 S%d ; set temperature" % rnd.randint(190, 210))
+        elif i % 10 == 0:
+            pool.append("G1 X%.3f Y%.3f F7800.000" % (rnd.uniform(0, 200), rnd.uniform(0, 200)))
+        else:
+            pool.append("G1 X%.3f Y%.3f E%.5f" % (rnd.uniform(0, 200), rnd.uniform(0, 200), e))
+    return islice(cycle(pool), count)
+
+def benchmark_tokenizer(lines):
+    """Times the regex tokenizer (split followed by parse_coordinates) and
+    parse_line over lines, as _preprocess_lines uses them. Returns the
+    number of lines and both durations in seconds."""
+    import time
+    old_count = new_count = 0
+    start = time.time()
+    for raw in lines():
+        line = gcoder.Line(raw)
+        split_raw = gcoder.split(line)
+        if line.command[:1] == "G":
+            gcoder.parse_coordinates(line, split_raw)
+        old_count += 1
+    old_time = time.time() - start
+    start = time.time()
+    for raw in lines():
+        gcoder.parse_line(gcoder.Line(raw))
+        new_count += 1
+    new_time = time.time() - start
+    assert old_count == new_count
+    return new_count, old_time, new_time
+
+def benchmark_preprocess(gcode):
+    """Times the extrusion and position passes over the lines of gcode,
+    looping over the lines and with NumPy, and checks that both set the
+    same line fields and give the same results. Returns both durations in
+    seconds and the number of lines where they differ."""
+    import time
+    if gcoder.numpy is None:
+        raise ImportError("the NumPy passes need numpy")
+    fields = attrgetter("current_x", "current_y", "current_z", "extruding")
+    saved = gcoder.numpy_min_lines
+    times = []
+    results = []
+    try:
+        for gcoder.numpy_min_lines in (sys.maxint, 0):
+            start = time.time()
+            gcode.filament_length = gcode._preprocess_extrusion()
+            gcode._preprocess_layers()
+            times.append(time.time() - start)
+            results.append((map(fields, gcode.lines), gcode.bounds, gcode.filament_length,
+                            gcode.current, gcode.cur_e, gcode.total_e))
+            # the NumPy pass has to set the fields again
+            for line in gcode.lines:
+                if line.current_x is not None:
+                    line.current_x = line.current_y = line.current_z = float("nan")
+                if line.is_move and line.e is not None:
+                    line.extruding = not line.extruding
+    finally:
+        gcoder.numpy_min_lines = saved
+    gcode._preprocess_extrusion()
+    gcode._preprocess_layers()
+    loops, arrays = results
+    mismatches = sum(a != b for a, b in izip(loops[0], arrays[0]))
+    if loops[1:] != arrays[1:]:
+        mismatches += 1
+    return times[0], times[1], mismatches
+
+def benchmark_parallel(filename, processes = None, chunk_size = None):
+    """Times loading filename with MappedGCode and with ParallelGCode,
+    parsing chunk_size bytes per process (ParallelGCode.chunk_size if None),
+    and checks that both give the same lines and results. Returns both
+    durations in seconds and the number of lines where they differ."""
+    import time
+    fields = attrgetter("command", "is_move", "x", "y", "z", "e", "f", "i", "j",
+                        "relative", "relative_e", "current_tool", "extruding",
+                        "current_x", "current_y", "current_z")
+    saved = gcoder.ParallelGCode.chunk_size
+    times = []
+    results = []
+    try:
+        if chunk_size is not None:
+            gcoder.ParallelGCode.chunk_size = chunk_size
+        for load in (gcoder.MappedGCode, lambda filename: gcoder.ParallelGCode(filename, processes)):
+            start = time.time()
+            gcode = load(filename)
+            times.append(time.time() - start)
+            results.append((map(fields, gcode.lines), gcode.layer_idxs.tolist(), gcode.bounds,
+                            gcode.filament_length, gcode.num_layers()))
+    finally:
+        gcoder.ParallelGCode.chunk_size = saved
+    sequential, parallel = results
+    mismatches = sum(a != b for a, b in izip(sequential[0], parallel[0]))
+    mismatches += abs(len(sequential[0]) - len(parallel[0]))
+    if sequential[1:] != parallel[1:]:
+        mismatches += 1
+    return times[0], times[1], mismatches
+
+def check_columns(gcode, tolerance = 1e-5):
+    """Compares what the GCodeColumns methods return for gcode with the
+    results of the passes over its lines, the float ones within a relative
+    tolerance. Returns the list of the names of the methods whose results
+    differ."""
+    def close(a, b):
+        return abs(a - b) <= tolerance * max(abs(a), abs(b), 1.0)
+    columns = gcoder.GCodeColumns(gcode)
+    lines = gcode.lines
+    failed = []
+    bounds = ((gcode.xmin, gcode.xmax), (gcode.ymin, gcode.ymax), (gcode.zmin, gcode.zmax))
+    if not all(close(a, b) for axis, column_axis in zip(bounds, columns.bounds())
+               for a, b in zip(axis, column_axis)):
+        failed.append("bounds")
+    if not close(gcode.filament_length, columns.filament_length()):
+        failed.append("filament_length")
+    if columns.layer_ids().tolist() != list(gcode.layer_idxs[:len(lines)]):
+        failed.append("layer_ids")
+    if columns.num_layers() != gcode.num_layers():
+        failed.append("num_layers")
+    gcode.estimate_duration()
+    # the columns leave the G4 dwells out
+    durations = [layer.duration - sum((gcoder.P(line) or 0) / 1000.0
+                                      for line in layer if line.command == "G4")
+                 for layer in gcode.all_layers]
+    total, layers = columns.duration()
+    if not close(sum(durations), total) or \
+       not all(close(a, b) for a, b in zip(durations, layers)):
+        failed.append("duration")
+    # each where call goes over all the lines, check the first commands only
+    commands = map(attrgetter("command"), lines)
+    for command in columns.commands[:32] + ["unknown"]:
+        if columns.where(command).tolist() != [c == command for c in commands]:
+            failed.append("where")
+            break
+    if columns.moves().tolist() != [i for i, line in enumerate(lines) if line.is_move]:
+        failed.append("moves")
+    return failed
+
+def heap_size():
+    """Returns the memory used by the process, leaving out the pages mapped
+    from files, in bytes. Linux only, returns None elsewhere."""
+    try:
+        f = open("/proc/self/statm")
+    except IOError:
+        return None
+    try:
+        resident, shared = map(int, f.read().split()[1:3])
+    finally:
+        f.close()
+    return (resident - shared) * os.sysconf("SC_PAGE_SIZE")
+
+def main():
+    if len(sys.argv) < 2:
+        print "usage: %s [-j processes] filename.gcode" % sys.argv[0]
+        print "       %s --benchmark-tokenizer filename.gcode|line_count ..." % sys.argv[0]
+        print "       %s --benchmark-preprocess filename.gcode ..." % sys.argv[0]
+        print "       %s --benchmark-parallel filename.gcode ..." % sys.argv[0]
+        print "       %s --check-columns filename.gcode ..." % sys.argv[0]
+        print "       %s --convert source target" % sys.argv[0]
+        print "       %s --stats filename.gcode ..." % sys.argv[0]
+        return
+
+    if sys.argv[1] == "--benchmark-tokenizer":
+        print "parse_line is %s" % ("gcoder_line.parse_line" if gcoder.parse_line is not gcoder.py_parse_line else "py_parse_line")
+        for arg in sys.argv[2:]:
+            if arg.isdigit():
+                lines = lambda: synthetic_gcode(int(arg))
+            else:
+                lines = lambda: (l.strip() for l in open(arg))
+            count, old_time, new_time = benchmark_tokenizer(lines)
+            print "%s: %d lines, regex %.3fs (%.0f lines/s), parse_line %.3fs (%.0f lines/s), %.2fx" % \
+                (arg, count, old_time, count / old_time, new_time, count / new_time, old_time / new_time)
+        return
+
+    if sys.argv[1] == "--benchmark-preprocess":
+        for arg in sys.argv[2:]:
+            gcode = gcoder.MappedGCode(arg)
+            loop_time, numpy_time, mismatches = benchmark_preprocess(gcode)
+            print "%s: %d lines, loops %.3fs, NumPy %.3fs, %.2fx, %d mismatches" % \
+                (arg, len(gcode), loop_time, numpy_time, loop_time / max(numpy_time, 1e-6), mismatches)
+        return
+
+    if sys.argv[1] == "--stats":
+        # text files are streamed, binary ones loaded
+        results = {}
+        for arg in sys.argv[2:]:
+            f = open(arg, "rb")
+            if gcoder.is_binary(f.read(len(gcoder.binary_magic))):
+                results[arg] = gcoder.statistics(gcoder.BinaryGCode(open(arg, "rb").read()))
+            else:
+                f.seek(0)
+                results[arg] = gcoder.statistics(f)
+            f.close()
+        print json.dumps(results, indent = 2, sort_keys = True)
+        return
+
+    if sys.argv[1] == "--benchmark-parallel":
+        for arg in sys.argv[2:]:
+            # at least 8 chunks, so that small files cross chunk boundaries too
+            chunk_size = min(gcoder.ParallelGCode.chunk_size, max(os.path.getsize(arg) / 8, 1))
+            sequential_time, parallel_time, mismatches = benchmark_parallel(arg, None, chunk_size)
+            print "%s: sequential %.3fs, parallel %.3fs (%d bytes chunks), %.2fx, %d mismatches" % \
+                (arg, sequential_time, parallel_time, chunk_size,
+                 sequential_time / max(parallel_time, 1e-6), mismatches)
+        return
+
+    if sys.argv[1] == "--check-columns":
+        failures = 0
+        for arg in sys.argv[2:]:
+            failed = check_columns(gcoder.MappedGCode(arg))
+            print "%s: %s" % (arg, "differs in " + ", ".join(failed) if failed else "ok")
+            failures += bool(failed)
+        sys.exit(failures and 1)
+
+    import time
+    if sys.argv[1] == "--convert":
+        # to binary from text, and back
+        data = open(sys.argv[2], "rb").read()
+        start = time.time()
+        f = open(sys.argv[3], "wb")
+        if gcoder.is_binary(data):
+            gcode = gcoder.BinaryGCode(data)
+            f.writelines(line.raw + "\n" for line in gcode)
+        else:
+            gcode = gcoder.MappedGCode(sys.argv[2])
+            gcoder.write_binary(gcode, f)
+        f.close()
+        print "Converted %d lines in %.2fs, %d bytes to %d bytes" % \
+            (len(gcode), time.time() - start, len(data), os.path.getsize(sys.argv[3]))
+        return
+
+    print "Line object size:", sys.getsizeof(gcoder.Line("G0 X0"))
+    heap = heap_size()
+    start = time.time()
+    if sys.argv[1] == "-j":
+        gcode = gcoder.ParallelGCode(sys.argv[3], int(sys.argv[2]))
+    elif gcoder.is_binary(open(sys.argv[1], "rb").read(len(gcoder.binary_magic))):
+        gcode = gcoder.BinaryGCode(open(sys.argv[1], "rb").read())
+    else:
+        gcode = gcoder.MappedGCode(sys.argv[1])
+    print "Loaded %d lines in %.2fs" % (len(gcode), time.time() - start)
+    if heap is not None and len(gcode):
+        print "Memory used: %.1f bytes per line" % (float(heap_size() - heap) / len(gcode))
+
+    print "Dimensions:"
+    print "\tX: %0.02f - %0.02f (%0.02f)" % (gcode.xmin,gcode.xmax,gcode.width)
+    print "\tY: %0.02f - %0.02f (%0.02f)" % (gcode.ymin,gcode.ymax,gcode.depth)
+    print "\tZ: %0.02f - %0.02f (%0.02f)" % (gcode.zmin,gcode.zmax,gcode.height)
+    print "Filament used: %0.02fmm" % gcode.filament_length
+    print "Number of layers: %d" % gcode.num_layers()
+    print "Estimated duration: %s" % gcode.estimate_duration()
+    if gcoder.numpy is not None:
+        start = time.time()
+        estimate = gcode.estimate_duration(gcoder.MotionPlanner())
+        print "Estimated duration (motion planner): %s, in %.2fs" % (estimate, time.time() - start)
+
+if __name__ == '__main__':
+    main()
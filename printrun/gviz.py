@@ -149,6 +149,7 @@ class Gviz(wx.Panel):
         self.arcs = {}
         self.arcpens = {}
         self.layers = []
+        self.layerindices = {} #index of each z in layers
         self.layerindex = 0
         self.filament_width = extrusion_width # set it to 0 to disable scaling lines with zoom
         self.update_basescale()
@@ -192,6 +193,7 @@ class Gviz(wx.Panel):
         self.arcs = {}
         self.arcpens = {}
         self.layers = []
+        self.layerindices = {}
         self.clearhilights()
         self.layerindex = 0
         self.showall = 0
@@ -213,8 +215,8 @@ class Gviz(wx.Panel):
             wx.CallAfter(self.Refresh)
 
     def setlayer(self, layer):
-        if layer in self.layers:
-            self.layerindex = self.layers.index(layer)
+        if layer in self.layerindices:
+            self.layerindex = self.layerindices[layer]
             self.dirty = 1
             self.showall = 0
             wx.CallAfter(self.Refresh)
@@ -381,11 +383,12 @@ class Gviz(wx.Panel):
             if gline.i != None: target[5] = gline.i
             if gline.j != None: target[6] = gline.j
             z = target[2]
-            if z not in self.layers:
+            if z not in self.layerindices:
                 self.lines[z] = []
                 self.pens[z] = []
                 self.arcs[z] = []
                 self.arcpens[z] = []
+                self.layerindices[z] = len(self.layers)
                 self.layers.append(z)
             
             start_pos = self.lastpos[:]
@@ -415,9 +418,7 @@ class Gviz(wx.Panel):
         if not gcode:
             return
         gline = gcoder.Line(gcode)
-        #gline.parse_coordinates(False)
-        split_raw = gcoder.split(gline)
-        gcoder.parse_coordinates(gline, split_raw, imperial = False)
+        gcoder.parse_line(gline)
 
         def _y(y):
             return self.build_dimensions[1] - (y - self.build_dimensions[4])
@@ -441,11 +442,12 @@ class Gviz(wx.Panel):
         if gline.j != None: target[6] = gline.j
 
         z = target[2]
-        if not hilight and z not in self.layers:
+        if not hilight and z not in self.layerindices:
             self.lines[z] = []
             self.pens[z] = []
             self.arcs[z] = []
             self.arcpens[z] = []
+            self.layerindices[z] = len(self.layers)
             self.layers.append(z)
 
         if gline.command in ["G0", "G1"]:
@@ -253,10 +253,29 @@ class GcodeModel(Model):
                      (model_data.ymin,model_data.ymax,model_data.depth),
                      (model_data.zmin,model_data.zmax,model_data.height))
 
+        if getattr(model_data, "lines", None) is not None and hasattr(model_data, "columns"):
+            self.load_columns(model_data, model_data.columns())
+            if callback:
+                num_layers = len(model_data.all_layers)
+                callback(num_layers, num_layers)
+        else:
+            self.load_lines(model_data, callback)
+
+        self.max_layers         = len(self.layer_stops) - 1
+        self.num_layers_to_draw = self.max_layers
+        self.printed_until      = -1
+        self.initialized        = False
+        self.loaded             = True
+
+        t_end = time.time()
+
+        logging.log(logging.INFO, _('Initialized 3D visualization in %.2f seconds') % (t_end - t_start))
+        logging.log(logging.INFO, _('Vertex count: %d') % len(self.vertices))
+
+    def load_lines(self, model_data, callback=None):
         vertex_list      = []
         color_list       = []
         self.layer_stops = [0]
-        arrow_list       = []
         num_layers       = len(model_data.all_layers)
 
         prev_pos = (0, 0, 0)
@@ -264,12 +283,18 @@ class GcodeModel(Model):
             for gline in layer:
                 if not gline.is_move:
                     continue
-                vertex_list.append(prev_pos)
                 current_pos = (gline.current_x, gline.current_y, gline.current_z)
-                vertex_list.append(current_pos)
+                if gline.command in ("G2", "G3") and hasattr(model_data, "arc_points"):
+                    points = model_data.arc_points(prev_pos, gline)
+                else:
+                    points = (current_pos,)
 
                 vertex_color = self.movement_color(gline)
-                color_list.append(vertex_color)
+                for point in points:
+                    vertex_list.append(prev_pos)
+                    vertex_list.append(point)
+                    color_list.append(vertex_color)
+                    prev_pos = point
 
                 prev_pos = current_pos
                 gline.gcview_end_vertex = len(vertex_list)
@@ -282,16 +307,48 @@ class GcodeModel(Model):
         self.vertices = numpy.array(vertex_list, dtype = GLfloat)
         self.colors   = numpy.array(color_list, dtype = GLfloat).repeat(2, 0)
 
-        self.max_layers         = len(self.layer_stops) - 1
-        self.num_layers_to_draw = self.max_layers
-        self.printed_until      = -1
-        self.initialized        = False
-        self.loaded             = True
-
-        t_end = time.time()
-
-        logging.log(logging.INFO, _('Initialized 3D visualization in %.2f seconds') % (t_end - t_start))
-        logging.log(logging.INFO, _('Vertex count: %d') % len(self.vertices))
+    def load_columns(self, model_data, columns):
+        """
+        Same as load_lines, building the arrays from the gcoder.GCodeColumns
+        of model_data instead of going through its lines one by one.
+        """
+        moves = columns.moves()
+        lines = model_data.lines
+        current = numpy.column_stack((columns.current_x, columns.current_y,
+                                      columns.current_z))[moves].astype(numpy.float64)
+
+        # arcs are drawn as the segments of their cached tessellation
+        arcs = numpy.flatnonzero(columns.where("G2", "G3")[moves])
+        arc_points = []
+        for k in arcs:
+            start = (0, 0, 0)
+            if k:
+                previous = lines[moves[k - 1]]
+                start = (previous.current_x, previous.current_y, previous.current_z)
+            arc_points.append(model_data.arc_points(start, lines[moves[k]]))
+        segments = numpy.ones(len(moves), int)
+        segments[arcs] = [len(points) for points in arc_points]
+        ends = numpy.cumsum(segments)
+
+        points = numpy.zeros((ends[-1] if len(ends) else 0, 3))
+        points[ends - 1] = current
+        for k, arc in zip(arcs, arc_points):
+            points[ends[k] - len(arc):ends[k]] = arc
+        self.vertices = numpy.zeros((2 * len(points), 3), dtype = GLfloat)
+        self.vertices[1::2] = points
+        self.vertices[2::2] = points[:-1]
+
+        palette = numpy.array([self.color_travel, self.color_tool0, self.color_tool1], dtype = GLfloat)
+        extruding = (columns.flags[moves] & columns.extruding) != 0
+        colors = numpy.where(extruding, numpy.where(columns.tool[moves] == 0, 1, 2), 0)
+        self.colors = palette[colors].repeat(segments, 0).repeat(2, 0)
+
+        segments_per_layer = numpy.bincount(columns.layer[moves], segments,
+                                            minlength = len(model_data.all_layers))
+        self.layer_stops = [0] + (2 * numpy.cumsum(segments_per_layer)).astype(int).tolist()
+
+        for end, i in zip(ends.tolist(), moves):
+            lines[i].gcview_end_vertex = 2 * end
 
     def copy(self):
         copy = GcodeModel()
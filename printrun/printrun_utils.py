@@ -64,33 +64,35 @@ class RemainingTimeEstimator(object):
 
     def __init__(self, gcode):
         self.drift = 1
-        self.previous_layers_estimate = 0
-        self.current_layer_estimate = 0
-        self.current_layer_lines = 0
         self.gcode = gcode
-        self.remaining_layers_estimate = sum(layer.duration for layer in gcode.all_layers)
-        if len(gcode) > 0:
-            self.update_layer(0, 0)
+        self.index = gcode.index()
+        self.edits_seen = len(gcode.edits)
+        self.last_idx = -1
+        self.last_estimate = None
+
+    def _follow_edits(self):
+        # the index is rebuilt once the lines were inserted or removed
+        if len(self.gcode.edits) != self.edits_seen:
+            self.edits_seen = len(self.gcode.edits)
+            self.index = self.gcode.index()
+            self.last_idx = -1
+            self.last_estimate = None
 
     def update_layer(self, layer, printtime):
-        self.previous_layers_estimate += self.current_layer_estimate
-        if self.previous_layers_estimate > 0 and printtime > 0:
-            self.drift = printtime / self.previous_layers_estimate
-        self.current_layer_estimate = self.gcode.all_layers[layer].duration
-        self.current_layer_lines = len(self.gcode.all_layers[layer])
-        self.remaining_layers_estimate -= self.current_layer_estimate
+        self._follow_edits()
+        previous_layers_estimate = self.index.time_at(self.index.layer_range(layer)[0])
+        if previous_layers_estimate > 0 and printtime > 0:
+            self.drift = printtime / previous_layers_estimate
         self.last_idx = -1
         self.last_estimate = None
 
     def __call__(self, idx, printtime):
-        if not self.current_layer_lines:
+        self._follow_edits()
+        if not self.index.count:
             return (0, 0)
         if idx == self.last_idx:
             return self.last_estimate
-        layer, line = self.gcode.idxs(idx)
-        layer_progress = (1 - (float(line+1) / self.current_layer_lines))
-        remaining = layer_progress * self.current_layer_estimate + self.remaining_layers_estimate
-        estimate = self.drift * remaining
+        estimate = self.drift * self.index.remaining(idx)
         total = estimate + printtime
         self.last_idx = idx
         self.last_estimate = (estimate, total)
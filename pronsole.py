@@ -26,7 +26,7 @@ import locale
 
 import printcore
 from printrun.printrun_utils import install_locale
-from printrun import gcoder
+from printrun import gcoder, gcodecache
 install_locale('pronterface')
 
 from functools import wraps
@@ -237,6 +237,8 @@ class Settings(object):
         self._add(StringSetting("slicecommand", "python skeinforge/skeinforge_application/skeinforge_utilities/skeinforge_craft.py $s", _("Slice command"), _("Slice command"), "External"))
         self._add(StringSetting("sliceoptscommand", "python skeinforge/skeinforge_application/skeinforge.py", _("Slicer options command"), _("Slice settings command"), "External"))
         self._add(StringSetting("final_command", "", _("Final command"), _("Executable to run when the print is finished"), "External"))
+        self._add(BooleanSetting("stream_gcode", False, _("Stream G-code files"), _("Parse the files loaded in pronsole while printing them instead of loading them whole first, for files too big to fit in memory (pronterface always loads them whole)")))
+        self._add(SpinSetting("gcode_cache_size", 256, 0, 100000, _("G-code cache size"), _("Disk space in MB taken by the preprocessed G-code files kept to load them again faster, 0 to disable the cache")))
 
     _settings = []
     def __setattr__(self, name, value):
@@ -336,6 +338,7 @@ class pronsole(cmd.Cmd):
         self.in_macro = False
         self.p.onlinecb = self.online
         self.fgcode = None
+        self.gcode_cache = gcodecache.GCodeCache()
         self.listing = 0
         self.sdfiles = []
         self.paused = False
@@ -784,7 +787,7 @@ class pronsole(cmd.Cmd):
     def do_load(self, filename):
         self._do_load(filename)
 
-    def _do_load(self, filename):
+    def _do_load(self, filename, lazy = False):
         if not filename:
             self.logError("No file name given.")
             return
@@ -792,10 +795,20 @@ class pronsole(cmd.Cmd):
         if not os.path.exists(filename):
             self.logError("File not found!")
             return
-        self.fgcode = gcoder.GCode(open(filename))
+        if isinstance(self.fgcode, gcoder.GCodeStream):
+            self.fgcode.close()
+        if self.settings.stream_gcode:
+            self.fgcode = gcoder.GCodeStream(open(filename), lazy = lazy)
+        else:
+            self.fgcode = self.load_gcode(filename, lazy)
         self.filename = filename
         self.log("Loaded %s, %d lines." % (filename, len(self.fgcode)))
 
+    def load_gcode(self, filename, lazy = False):
+        """Loads filename through the G-code cache, unless it is disabled"""
+        self.gcode_cache.max_size = self.settings.gcode_cache_size << 20
+        return self.gcode_cache.load(filename, lazy)
+
     def complete_load(self, text, line, begidx, endidx):
         s = line.split()
         if len(s) > 2:
@@ -820,7 +833,8 @@ class pronsole(cmd.Cmd):
         if not self.p.online:
             self.logError(_("Not connected to printer."))
             return
-        self._do_load(filename)
+        # the upload only needs the text and layers of the lines
+        self._do_load(filename, lazy = True)
         self.log(_("Uploading as %s") % targetname)
         self.log(_("Uploading %s") % self.filename)
         self.p.send_now("M28 " + targetname)
@@ -876,6 +890,9 @@ class pronsole(cmd.Cmd):
         if not self.p.online:
             self.logError(_("Not connected to printer."))
             return
+        if isinstance(self.fgcode, gcoder.GCodeStream) and self.fgcode.started:
+            # streams can only be printed once
+            self._do_load(self.filename)
         self.log(_("Printing %s") % self.filename)
         self.log(_("You can monitor the print with the monitor command."))
         self.p.startprint(self.fgcode)
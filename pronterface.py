@@ -391,6 +391,13 @@ class PronterWindow(MainWindow, pronsole.pronsole):
             wx.CallAfter(self.printbtn.Enable)
 
     def layer_change_cb(self, newlayer):
+        # the layer ids are the ones of the queue being printed, which
+        # isn't fgcode once another file is loaded
+        layerz = self.p.mainqueue.all_layers_z[newlayer]
+        if layerz is not None:
+            self.curlayer = layerz
+            self.gviz.clearhilights()
+            wx.CallAfter(self.gviz.setlayer, layerz)
         if self.compute_eta:
             secondselapsed = int(time.time() - self.starttime + self.extra_print_time)
             self.compute_eta.update_layer(newlayer, secondselapsed)
@@ -400,7 +407,8 @@ class PronterWindow(MainWindow, pronsole.pronsole):
         split_raw = gcoder.split(gline)
         gcoder.parse_coordinates(gline, split_raw, imperial = False)
         if gline.is_move:
-            if gline.z != None:
+            # while printing, layer_change_cb follows the layers of the file
+            if gline.z != None and not self.p.printing:
                 layer = gline.z
                 if layer != self.curlayer:
                     self.curlayer = layer
@@ -424,28 +432,10 @@ class PronterWindow(MainWindow, pronsole.pronsole):
             return
         self.sentlines.put_nowait(line)
 
-    def is_excluded_move(self, gline):
-        if not gline.is_move or not self.excluder or not self.excluder.rectangles:
-            return False
-        if gline.x == None and gline.y == None:
-            return False
-        for (x0, y0, x1, y1) in self.excluder.rectangles:
-            if x0 <= gline.current_x <= x1 and y0 <= gline.current_y <= y1:
-                return True
-        return False
-
     def preprintsendcb(self, gline, next_gline):
-        if not self.is_excluded_move(gline):
+        if not self.excluder or not self.excluder.rectangles:
             return gline
-        else:
-            # Check if next move will be excluded too and if it will emit an absolute E set
-            if next_gline != None and self.is_excluded_move(next_gline) and next_gline.e != None and not next_gline.relative_e:
-                return None # nothing to do: next move will set absolute E if needed
-            else: # else, check if this is an extrusion move with non relative E and replace it
-                if gline.e != None and not gline.relative_e:
-                    return gcoder.Line("G92 E%.5f" % gline.e)
-                else: # or just do nothing
-                    return None
+        return gcoder.exclude_line(gline, next_gline, self.excluder.rectangles)
 
     def printsentcb(self, gline):
         if gline.is_move and hasattr(self.gwindow, "set_current_gline"):
@@ -1454,7 +1444,7 @@ class PronterWindow(MainWindow, pronsole.pronsole):
         fn = self.filename
         try:
             self.filename = self.model_to_gcode_filename(self.filename)
-            self.fgcode = gcoder.GCode(open(self.filename))
+            self.fgcode = self.load_gcode(self.filename)
             if self.p.online:
                 wx.CallAfter(self.printbtn.Enable)
 
@@ -1519,7 +1509,7 @@ class PronterWindow(MainWindow, pronsole.pronsole):
                 self.skein(name)
             else:
                 self.filename = name
-                self.fgcode = gcoder.GCode(open(self.filename))
+                self.fgcode = self.load_gcode(self.filename)
                 self.statusbar.SetStatusText(_("Loaded %s, %d lines") % (name, len(self.fgcode)))
                 print _("Loaded %s, %d lines") % (name, len(self.fgcode))
                 wx.CallAfter(self.printbtn.SetLabel, _("Print"))
@@ -1539,7 +1529,7 @@ class PronterWindow(MainWindow, pronsole.pronsole):
         print _("- from %.2f mm to %.2f mm in X and is %.2f mm wide") % (gcode.xmin, gcode.xmax, gcode.width)
         print _("- from %.2f mm to %.2f mm in Y and is %.2f mm deep") % (gcode.ymin, gcode.ymax, gcode.depth)
         print _("- from %.2f mm to %.2f mm in Z and is %.2f mm high") % (gcode.zmin, gcode.zmax, gcode.height)
-        print _("Estimated duration: %s") % gcode.estimate_duration()
+        print _("Estimated duration: %s") % gcode.duration_summary()
         self.gviz.clear()
         self.gwindow.p.clear()
         self.gviz.addfile(gcode)
@@ -483,7 +483,11 @@ class Prontserve(pronsole.pronsole, EventEmitter):
       elif len(self.jobs.list) > 0:
         print "Starting the next print job"
         self.current_job = self.jobs.list.pop(0)
-        gc = gcoder.GCode(self.current_job['body'].split("\n"))
+        body = self.current_job['body']
+        if gcoder.is_binary(body):
+            gc = gcoder.BinaryGCode(body, lazy = True)
+        else:
+            gc = gcoder.GCode(body.split("\n"), lazy = True)
         self.p.startprint(gc)
         self.fire("job_started", self.jobs.sanitize(self.current_job))
       else:
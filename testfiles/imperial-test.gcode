@@ -0,0 +1,442 @@
+; imperial test file: coordinates in inches, with a layer in mm
+G20 ; inches
+G90
+M82
+G92 E0
+M104 S200
+G28
+;LAYER:0
+G1 Z0.0079 F300
+G1 X6.8206 Y5.2410 E0.00954 F1800
+G1 X6.8132 Y2.1708 E0.01755 F1800
+G1 X6.8156 Y6.5793 E0.02481 F1800
+G1 X1.5195 Y3.2630 E0.03703 F1800
+G1 X1.0434 Y2.5978 E0.04874 F1800
+G1 X3.5357 Y1.8023 E0.05298 F1800
+G1 X6.8422 Y2.7161 E0.05853 F1800
+G1 X4.8193 Y6.1002 E0.06483 F1800
+G1 X0.8866 Y4.4271 E0.06575 F1800
+G1 X0.9806 Y1.6704 E0.07443 F1800
+G1 X2.3410 Y5.2698 E0.07686 F1800
+G1 X1.1474 Y0.4681 E0.08569 F1800
+G1 X6.4856 Y1.8816 E0.08899 F1800
+G1 X0.3935 Y4.9430 E0.09304 F1800
+G1 X1.2855 Y4.9575 E0.10062 F1800
+G1 X3.5212 Y1.4017 E0.10865 F1800
+G1 X4.3010 Y3.4169 E0.11110 F1800
+G1 X6.9876 Y6.5148 E0.11973 F1800
+G1 X7.4712 Y4.4786 E0.12430 F1800
+G1 X1.1377 Y4.6753 E0.13093 F1800
+G1 X3.4423 Y7.4470 E0.14134 F1800
+G1 X1.1268 Y6.6663 E0.14186 F1800
+G1 X4.9906 Y2.5704 E0.15097 F1800
+G1 X7.1583 Y4.1185 E0.16048 F1800
+G1 X0.6914 Y5.1049 E0.16236 F1800
+G1 X3.5776 Y2.7014 E0.16373 F1800
+G1 X5.6801 Y0.9715 E0.16726 F1800
+G1 X0.9186 Y5.0684 E0.17131 F1800
+G1 X0.6191 Y0.4954 E0.17441 F1800
+G1 X3.9478 Y0.3875 E0.17519 F1800
+G1 E0.13579 ; retract
+G1 Z0.0276 ; hop
+G1 Z0.0079
+G2 X4.0000 Y4.0000 I0.1234 J0 E0.17719
+;LAYER:1
+G1 Z0.0158 F300
+G1 X5.0993 Y4.0965 E0.17928 F1800
+G1 X2.5471 Y1.2075 E0.18303 F1800
+G1 X3.0939 Y1.8696 E0.18586 F1800
+G1 X1.9300 Y2.4702 E0.19291 F1800
+G1 X6.6805 Y4.9654 E0.19870 F1800
+G1 X0.3233 Y1.6576 E0.20668 F1800
+G1 X3.2165 Y6.3990 E0.21791 F1800
+G1 X2.4347 Y2.9243 E0.22193 F1800
+G1 X5.1705 Y1.0105 E0.22569 F1800
+G1 X6.6253 Y2.9873 E0.23763 F1800
+G1 X3.1505 Y6.3258 E0.24359 F1800
+G1 X1.0155 Y4.4591 E0.24658 F1800
+G1 X6.9089 Y5.3465 E0.25333 F1800
+G1 X6.9426 Y4.2389 E0.26523 F1800
+G1 X5.4468 Y1.5885 E0.26920 F1800
+G1 X6.3910 Y1.0192 E0.28129 F1800
+G1 X0.5969 Y5.6979 E0.28908 F1800
+G1 X3.2238 Y4.6290 E0.29645 F1800
+G1 X2.8899 Y2.3373 E0.29754 F1800
+G1 X5.0163 Y6.6400 E0.30248 F1800
+G1 X6.4777 Y3.1607 E0.30598 F1800
+G1 X6.0649 Y6.9705 E0.30756 F1800
+G1 X6.5734 Y2.5979 E0.31720 F1800
+G1 X2.4091 Y7.4297 E0.32167 F1800
+G1 X1.7873 Y0.6772 E0.32376 F1800
+G1 X0.9570 Y6.2040 E0.32450 F1800
+G1 X1.1492 Y2.0248 E0.32667 F1800
+G1 X5.8843 Y0.3481 E0.33521 F1800
+G1 X2.8194 Y1.3559 E0.33842 F1800
+G1 X4.0903 Y2.0798 E0.34354 F1800
+G1 E0.30414 ; retract
+G1 Z0.0355 ; hop
+G1 Z0.0158
+G2 X4.0000 Y4.0000 I0.1234 J0 E0.34554
+;LAYER:2
+G1 Z0.0237 F300
+G1 X3.0946 Y4.1596 E0.35433 F1800
+G1 X2.3924 Y4.6854 E0.36326 F1800
+G1 X2.4348 Y5.8019 E0.36474 F1800
+G1 X3.8522 Y2.8381 E0.36673 F1800
+G1 X5.0462 Y6.4332 E0.37294 F1800
+G1 X2.8454 Y6.8145 E0.38513 F1800
+G1 X4.8255 Y4.3410 E0.39317 F1800
+G1 X5.3625 Y5.2139 E0.40003 F1800
+G1 X5.7166 Y5.6749 E0.40815 F1800
+G1 X4.1093 Y2.9673 E0.41117 F1800
+G1 X3.9552 Y2.5107 E0.41723 F1800
+G1 X1.5911 Y6.8217 E0.41925 F1800
+G1 X6.6316 Y4.3809 E0.43049 F1800
+G1 X6.6483 Y1.5300 E0.43423 F1800
+G1 X7.4759 Y5.0630 E0.43573 F1800
+G1 X2.2004 Y0.9905 E0.43982 F1800
+G1 X0.8455 Y0.5840 E0.44085 F1800
+G1 X3.7022 Y5.4320 E0.44735 F1800
+G1 X5.1283 Y5.0079 E0.44944 F1800
+G1 X5.3752 Y3.9167 E0.45488 F1800
+G1 X7.2220 Y3.5803 E0.46347 F1800
+G1 X5.8974 Y3.7823 E0.46578 F1800
+G1 X1.6675 Y2.3853 E0.46852 F1800
+G1 X3.1871 Y0.7898 E0.47810 F1800
+G1 X5.8346 Y4.8821 E0.47995 F1800
+G1 X1.8654 Y6.7714 E0.49077 F1800
+G1 X5.5382 Y6.5576 E0.49371 F1800
+G1 X2.3802 Y3.4372 E0.49979 F1800
+G1 X2.9211 Y2.0626 E0.50988 F1800
+G1 X1.6231 Y4.4187 E0.51999 F1800
+G1 E0.48059 ; retract
+G1 Z0.0434 ; hop
+G1 Z0.0237
+G2 X4.0000 Y4.0000 I0.1234 J0 E0.52199
+;LAYER:3
+G1 Z0.0316 F300
+G1 X1.3860 Y2.7137 E0.52695 F1800
+G1 X2.3530 Y6.8985 E0.53781 F1800
+G1 X1.2265 Y0.7777 E0.54533 F1800
+G1 X3.9302 Y0.5646 E0.55604 F1800
+G1 X6.6083 Y4.3505 E0.55759 F1800
+G1 X1.6825 Y6.3264 E0.56618 F1800
+G1 X3.5001 Y7.0314 E0.56719 F1800
+G1 X5.2235 Y6.2869 E0.57743 F1800
+G1 X0.9882 Y5.3702 E0.58459 F1800
+G1 X4.8231 Y1.4394 E0.59645 F1800
+G1 X7.2710 Y1.1445 E0.60345 F1800
+G1 X4.1580 Y3.5085 E0.60791 F1800
+G1 X2.0114 Y5.5588 E0.61443 F1800
+G1 X3.5495 Y3.9511 E0.61830 F1800
+G1 X6.7680 Y5.8286 E0.62191 F1800
+G1 X2.5124 Y4.1397 E0.62988 F1800
+G1 X6.7841 Y6.9844 E0.63113 F1800
+G1 X6.5328 Y0.3997 E0.63845 F1800
+G1 X5.8556 Y1.5829 E0.64165 F1800
+G1 X0.8142 Y3.4779 E0.65199 F1800
+G1 X0.3063 Y5.7399 E0.65708 F1800
+G1 X7.0396 Y4.3398 E0.66303 F1800
+G1 X2.3629 Y6.4073 E0.66901 F1800
+G1 X5.3214 Y5.0589 E0.67918 F1800
+G1 X2.4313 Y1.0543 E0.68191 F1800
+G1 X4.7772 Y1.1574 E0.68281 F1800
+G1 X2.8344 Y5.0738 E0.68544 F1800
+G1 X2.4080 Y1.1934 E0.69750 F1800
+G1 X6.8494 Y7.4048 E0.70550 F1800
+G1 X3.0247 Y2.2896 E0.71003 F1800
+G1 E0.67063 ; retract
+G1 Z0.0513 ; hop
+G1 Z0.0316
+G2 X4.0000 Y4.0000 I0.1234 J0 E0.71203
+;LAYER:4
+G1 Z0.0395 F300
+G1 X5.9199 Y4.2133 E0.71408 F1800
+G1 X6.6618 Y6.4687 E0.71471 F1800
+G1 X0.9675 Y3.9393 E0.72081 F1800
+G1 X6.2510 Y1.8145 E0.73292 F1800
+G1 X2.8107 Y1.3625 E0.74497 F1800
+G1 X5.7905 Y6.0094 E0.74749 F1800
+G1 X7.2437 Y2.4884 E0.75350 F1800
+G1 X6.5768 Y1.1569 E0.75432 F1800
+G1 X4.7447 Y3.9685 E0.76601 F1800
+G1 X7.2956 Y2.9277 E0.77534 F1800
+G1 X0.4678 Y5.4671 E0.78110 F1800
+G1 X2.5942 Y2.3544 E0.78715 F1800
+G1 X3.5672 Y2.5371 E0.78795 F1800
+G1 X0.5409 Y0.4457 E0.79846 F1800
+G1 X3.3320 Y3.6097 E0.80978 F1800
+G1 X0.9113 Y6.1850 E0.82078 F1800
+G1 X3.3933 Y5.3833 E0.82157 F1800
+G1 X3.1358 Y0.4148 E0.83076 F1800
+G1 X7.2856 Y6.9752 E0.83747 F1800
+G1 X6.1778 Y5.1693 E0.83803 F1800
+G1 X2.5669 Y1.0334 E0.84361 F1800
+G1 X2.7032 Y0.4881 E0.84425 F1800
+G1 X1.1439 Y4.3592 E0.85464 F1800
+G1 X4.8991 Y6.6204 E0.85785 F1800
+G1 X2.0931 Y2.9771 E0.85917 F1800
+G1 X4.0630 Y1.1442 E0.86044 F1800
+G1 X6.3481 Y2.1069 E0.86625 F1800
+G1 X3.6285 Y0.6171 E0.86722 F1800
+G1 X6.5308 Y6.8637 E0.87665 F1800
+G1 X3.6250 Y1.6086 E0.87902 F1800
+G1 E0.83962 ; retract
+G1 Z0.0592 ; hop
+G1 Z0.0395
+G2 X4.0000 Y4.0000 I0.1234 J0 E0.88102
+;LAYER:5
+G1 Z0.0474 F300
+G1 X4.0611 Y1.8589 E0.88885 F1800
+G1 X7.4362 Y7.0785 E0.89224 F1800
+G1 X2.0172 Y0.5933 E0.90365 F1800
+G1 X7.2645 Y6.2880 E0.91272 F1800
+G1 X4.5894 Y6.9181 E0.91693 F1800
+G1 X3.8464 Y6.9157 E0.92458 F1800
+G1 X2.8912 Y1.7218 E0.92843 F1800
+G1 X6.5026 Y4.5972 E0.93734 F1800
+G1 X6.3768 Y5.5676 E0.94409 F1800
+G1 X0.7233 Y5.9577 E0.94736 F1800
+G1 X1.5935 Y0.5445 E0.95380 F1800
+G1 X4.8352 Y1.0715 E0.95556 F1800
+G1 X3.5985 Y4.0179 E0.95874 F1800
+G1 X6.8239 Y3.4347 E0.96218 F1800
+G1 X6.0640 Y5.9142 E0.96634 F1800
+G1 X2.8101 Y3.3749 E0.96761 F1800
+G1 X6.7865 Y1.7693 E0.97067 F1800
+G1 X5.4973 Y3.6696 E0.97887 F1800
+G1 X1.3762 Y5.0543 E0.99071 F1800
+G1 X7.2922 Y0.4814 E0.99291 F1800
+G1 X1.8688 Y4.4909 E0.99944 F1800
+G1 X3.7771 Y2.1501 E1.00123 F1800
+G1 X3.6277 Y1.9224 E1.00956 F1800
+G1 X7.3552 Y1.2687 E1.02062 F1800
+G1 X7.0035 Y3.0937 E1.02147 F1800
+G1 X2.7701 Y2.1514 E1.03050 F1800
+G1 X7.3345 Y7.2235 E1.03357 F1800
+G1 X1.9396 Y3.3040 E1.03706 F1800
+G1 X4.9994 Y4.7386 E1.03769 F1800
+G1 X2.0056 Y3.4745 E1.04316 F1800
+G1 E1.00376 ; retract
+G1 Z0.0671 ; hop
+G1 Z0.0474
+G2 X4.0000 Y4.0000 I0.1234 J0 E1.04516
+;LAYER:6
+G21 ; millimeters
+G1 Z1.4046 F300
+G1 X143.3888 Y22.3561 E26.58603 F1800
+G1 X80.0333 Y40.4079 E26.63624 F1800
+G1 X185.3100 Y133.3643 E26.66226 F1800
+G1 X144.4485 Y29.2984 E26.95694 F1800
+G1 X46.2251 Y68.0007 E26.98307 F1800
+G1 X49.5544 Y32.7453 E27.21101 F1800
+G1 X181.2045 Y27.5916 E27.29924 F1800
+G1 X160.0025 Y110.4389 E27.56306 F1800
+G1 X65.9402 Y20.5524 E27.70856 F1800
+G1 X83.7628 Y30.3131 E27.91067 F1800
+G1 X142.1780 Y111.4093 E28.13022 F1800
+G1 X142.4159 Y166.8167 E28.35475 F1800
+G1 X65.0215 Y168.4917 E28.63191 F1800
+G1 X163.0713 Y175.8932 E28.64616 F1800
+G1 X166.1190 Y161.7706 E28.76000 F1800
+G1 X38.3424 Y151.2826 E29.03155 F1800
+G1 X84.2786 Y16.8079 E29.08975 F1800
+G1 X62.7424 Y128.5711 E29.33732 F1800
+G1 X26.3329 Y21.1905 E29.53933 F1800
+G1 X90.5355 Y100.5009 E29.82742 F1800
+G1 X10.1551 Y127.4979 E29.95440 F1800
+G1 X109.1960 Y45.5820 E30.21284 F1800
+G1 X81.2679 Y95.8074 E30.41200 F1800
+G1 X83.7215 Y32.3342 E30.58028 F1800
+G1 X32.5651 Y96.2013 E30.79797 F1800
+G1 X168.9050 Y101.9752 E30.97041 F1800
+G1 X107.1677 Y110.7789 E31.05791 F1800
+G1 X77.8840 Y20.1860 E31.09562 F1800
+G1 X151.1723 Y31.2506 E31.12033 F1800
+G1 X185.6414 Y31.5387 E31.16549 F1800
+G1 E30.16473 ; retract
+G1 Z1.9050 ; hop
+G1 Z1.4046
+G2 X101.6000 Y101.6000 I3.1344 J0 E31.21629
+;LAYER:7
+G20 ; inches
+G1 Z0.0632 F300
+G1 X1.2145 Y3.7261 E1.23605 F1800
+G1 X2.1401 Y5.9069 E1.24571 F1800
+G1 X3.6569 Y1.6374 E1.24782 F1800
+G1 X6.6433 Y1.6914 E1.25909 F1800
+G1 X2.8508 Y7.2559 E1.26345 F1800
+G1 X5.5047 Y0.6591 E1.26784 F1800
+G1 X5.7462 Y6.7495 E1.27882 F1800
+G1 X6.9626 Y7.1558 E1.28747 F1800
+G1 X3.4762 Y1.5978 E1.29546 F1800
+G1 X5.8819 Y4.3451 E1.29829 F1800
+G1 X4.7215 Y4.8622 E1.30386 F1800
+G1 X1.6547 Y5.6646 E1.30629 F1800
+G1 X0.6222 Y5.2131 E1.31359 F1800
+G1 X7.3238 Y2.4777 E1.31821 F1800
+G1 X6.3880 Y4.6468 E1.32900 F1800
+G1 X6.1625 Y4.9221 E1.33234 F1800
+G1 X3.8913 Y7.3252 E1.33296 F1800
+G1 X5.0555 Y6.8091 E1.34185 F1800
+G1 X3.7344 Y4.9052 E1.34828 F1800
+G1 X2.9031 Y7.2775 E1.35949 F1800
+G1 X1.9708 Y0.8694 E1.36935 F1800
+G1 X3.6841 Y4.4023 E1.37227 F1800
+G1 X7.3076 Y6.9102 E1.38058 F1800
+G1 X7.2288 Y0.9333 E1.38820 F1800
+G1 X1.0715 Y6.4737 E1.39524 F1800
+G1 X5.7192 Y3.3796 E1.39745 F1800
+G1 X2.4604 Y4.4108 E1.40620 F1800
+G1 X7.0328 Y6.0539 E1.41595 F1800
+G1 X6.4681 Y2.9384 E1.42323 F1800
+G1 X1.5672 Y2.9639 E1.43341 F1800
+G1 E1.39401 ; retract
+G1 Z0.0829 ; hop
+G1 Z0.0632
+G2 X4.0000 Y4.0000 I0.1234 J0 E1.43541
+;LAYER:8
+G1 Z0.0711 F300
+G1 X2.2774 Y1.8367 E1.43983 F1800
+G1 X0.3328 Y2.3375 E1.44192 F1800
+G1 X3.6948 Y1.8732 E1.45222 F1800
+G1 X4.2740 Y5.6957 E1.45624 F1800
+G1 X4.4084 Y7.4465 E1.46751 F1800
+G1 X3.5049 Y4.9170 E1.47539 F1800
+G1 X1.4217 Y6.5865 E1.47929 F1800
+G1 X3.8180 Y0.8849 E1.48828 F1800
+G1 X5.1763 Y7.2150 E1.49201 F1800
+G1 X1.2875 Y0.9091 E1.49302 F1800
+G1 X6.1147 Y2.4532 E1.49535 F1800
+G1 X4.0219 Y2.6916 E1.50663 F1800
+G1 X0.5475 Y6.2827 E1.51520 F1800
+G1 X7.0330 Y2.1192 E1.52368 F1800
+G1 X0.6169 Y5.5633 E1.52577 F1800
+G1 X0.5793 Y4.2709 E1.53687 F1800
+G1 X5.4807 Y5.9798 E1.54572 F1800
+G1 X5.2242 Y6.2645 E1.54643 F1800
+G1 X2.2857 Y1.0959 E1.54760 F1800
+G1 X6.8957 Y0.7089 E1.55941 F1800
+G1 X2.3521 Y4.0091 E1.56357 F1800
+G1 X4.6958 Y3.2437 E1.56671 F1800
+G1 X0.7653 Y6.5338 E1.56762 F1800
+G1 X5.3999 Y6.3031 E1.56845 F1800
+G1 X0.6721 Y2.8426 E1.57764 F1800
+G1 X1.5564 Y1.2406 E1.58624 F1800
+G1 X6.4877 Y2.1264 E1.59809 F1800
+G1 X0.3443 Y3.7996 E1.60388 F1800
+G1 X6.3181 Y7.3365 E1.61093 F1800
+G1 X5.7170 Y4.7788 E1.61283 F1800
+G1 E1.57343 ; retract
+G1 Z0.0908 ; hop
+G1 Z0.0711
+G2 X4.0000 Y4.0000 I0.1234 J0 E1.61483
+;LAYER:9
+G1 Z0.0790 F300
+G1 X6.3333 Y1.1435 E1.61854 F1800
+G1 X6.9894 Y6.9497 E1.62738 F1800
+G1 X3.6016 Y2.4439 E1.63152 F1800
+G1 X0.8711 Y0.5689 E1.63300 F1800
+G1 X4.3521 Y4.5025 E1.64452 F1800
+G1 X6.4928 Y3.3575 E1.64597 F1800
+G1 X5.0475 Y5.9414 E1.64919 F1800
+G1 X1.2541 Y7.4121 E1.65763 F1800
+G1 X2.8515 Y5.6913 E1.65894 F1800
+G1 X2.1710 Y6.8430 E1.66476 F1800
+G1 X5.4166 Y5.7386 E1.67315 F1800
+G1 X3.0014 Y2.8796 E1.67923 F1800
+G1 X5.5914 Y3.9236 E1.68003 F1800
+G1 X3.4982 Y3.7844 E1.68742 F1800
+G1 X3.4846 Y3.8873 E1.69746 F1800
+G1 X5.6982 Y2.5007 E1.69867 F1800
+G1 X6.1053 Y4.5149 E1.69931 F1800
+G1 X3.7384 Y4.8377 E1.71148 F1800
+G1 X2.8229 Y1.2547 E1.71719 F1800
+G1 X1.3201 Y6.2866 E1.71924 F1800
+G1 X7.4771 Y0.4566 E1.72718 F1800
+G1 X7.4650 Y2.1267 E1.73117 F1800
+G1 X1.2563 Y4.6609 E1.73906 F1800
+G1 X2.6046 Y5.0674 E1.74611 F1800
+G1 X4.7765 Y6.3748 E1.75159 F1800
+G1 X5.1416 Y6.0719 E1.75715 F1800
+G1 X4.2688 Y7.2918 E1.76088 F1800
+G1 X3.0052 Y5.5289 E1.77317 F1800
+G1 X2.8860 Y6.1220 E1.77459 F1800
+G1 X1.5831 Y3.5031 E1.77870 F1800
+G1 E1.73930 ; retract
+G1 Z0.0987 ; hop
+G1 Z0.0790
+G2 X4.0000 Y4.0000 I0.1234 J0 E1.78070
+;LAYER:10
+G1 Z0.0869 F300
+G1 X2.6444 Y4.9793 E1.79025 F1800
+G1 X4.6425 Y4.4916 E1.79083 F1800
+G1 X6.4258 Y5.5576 E1.79243 F1800
+G1 X3.8252 Y1.3715 E1.79324 F1800
+G1 X4.3414 Y4.8257 E1.80386 F1800
+G1 X3.3091 Y0.9023 E1.80790 F1800
+G1 X3.1349 Y0.8684 E1.81959 F1800
+G1 X2.5166 Y6.4369 E1.82405 F1800
+G1 X5.9255 Y3.5883 E1.82816 F1800
+G1 X5.2150 Y2.7860 E1.83325 F1800
+G1 X6.8275 Y4.1285 E1.84368 F1800
+G1 X6.1424 Y5.9484 E1.85459 F1800
+G1 X7.0962 Y0.7797 E1.86098 F1800
+G1 X4.7154 Y4.5884 E1.86360 F1800
+G1 X3.9918 Y7.3499 E1.86911 F1800
+G1 X2.2661 Y5.1524 E1.87860 F1800
+G1 X4.7305 Y6.5710 E1.88994 F1800
+G1 X3.2321 Y5.9723 E1.90117 F1800
+G1 X2.3219 Y0.7416 E1.91079 F1800
+G1 X6.1379 Y1.5270 E1.91981 F1800
+G1 X4.0092 Y1.9640 E1.92050 F1800
+G1 X1.1311 Y6.2293 E1.92252 F1800
+G1 X6.3386 Y1.4365 E1.92550 F1800
+G1 X6.2987 Y2.1752 E1.93119 F1800
+G1 X5.0381 Y0.3941 E1.93297 F1800
+G1 X4.0102 Y3.4108 E1.93788 F1800
+G1 X6.5045 Y1.0739 E1.94263 F1800
+G1 X4.0386 Y7.3251 E1.95199 F1800
+G1 X3.6524 Y7.4429 E1.96339 F1800
+G1 X6.1210 Y6.3142 E1.97373 F1800
+G1 E1.93433 ; retract
+G1 Z0.1066 ; hop
+G1 Z0.0869
+G2 X4.0000 Y4.0000 I0.1234 J0 E1.97573
+;LAYER:11
+G1 Z0.0948 F300
+G1 X1.9321 Y3.8902 E1.98117 F1800
+G1 X2.3809 Y0.8707 E1.98194 F1800
+G1 X1.5102 Y0.9075 E1.99251 F1800
+G1 X6.2438 Y4.9249 E2.00027 F1800
+G1 X2.9555 Y1.1637 E2.01182 F1800
+G1 X5.9255 Y1.4841 E2.01981 F1800
+G1 X2.1579 Y1.3262 E2.02438 F1800
+G1 X5.2082 Y5.0264 E2.03275 F1800
+G1 X6.4337 Y7.0905 E2.03988 F1800
+G1 X7.4476 Y1.8071 E2.05107 F1800
+G1 X3.1645 Y3.8956 E2.05884 F1800
+G1 X3.7808 Y3.3125 E2.06436 F1800
+G1 X1.5756 Y1.1618 E2.07495 F1800
+G1 X1.9879 Y5.3060 E2.08006 F1800
+G1 X4.8215 Y5.2677 E2.08746 F1800
+G1 X7.1421 Y5.5678 E2.09554 F1800
+G1 X1.4302 Y3.1738 E2.10549 F1800
+G1 X4.4558 Y5.9079 E2.10932 F1800
+G1 X5.2031 Y1.9199 E2.11343 F1800
+G1 X3.8975 Y2.7425 E2.11612 F1800
+G1 X3.4345 Y0.5984 E2.12537 F1800
+G1 X2.7538 Y5.4741 E2.13464 F1800
+G1 X4.5772 Y3.8246 E2.14561 F1800
+G1 X3.7882 Y0.8584 E2.15446 F1800
+G1 X2.9471 Y6.1266 E2.16409 F1800
+G1 X5.0783 Y4.5535 E2.16764 F1800
+G1 X4.7562 Y1.0773 E2.17896 F1800
+G1 X1.8317 Y0.6788 E2.18210 F1800
+G1 X7.0425 Y5.4756 E2.18599 F1800
+G1 X6.4792 Y6.2125 E2.19241 F1800
+G1 E2.15301 ; retract
+G1 Z0.1145 ; hop
+G1 Z0.0948
+G2 X4.0000 Y4.0000 I0.1234 J0 E2.19441
+M104 S0